@@ -1,14 +1,19 @@
 from .correlation import corr
 from .processing import drop_na, neighbors, pca, scale, scale_by_batch, umap
+from .quantile_norm import quantile_normalize
 
 # split the isort section to avoid circular imports
 # isort: split
 from .aggregate import (
     aggregate,
+    aggregate_distribution,
+    aggregate_hierarchy,
     aggregate_mahalanobis,
+    aggregate_modz,
     aggregate_pc,
     aggregate_ttest,
     tstat_distance,
 )
-from .batch_effects import remove_batch_effects
+from .batch_effects import BatchEffectModel, compute_position_effects, remove_batch_effects, remove_position_effects
 from .feature_selection import select_features
+from .permutation import permutation_test
@@ -1,10 +1,30 @@
+import os
+from typing import Any
+
 import numpy as np
 import pandas as pd
 from anndata import AnnData
+from numba import njit, prange
 
 from scmorph.logging import get_logger
 from scmorph.pp import drop_na, pca, scale
-from scmorph.utils import _get_group_keys, _infer_names, get_grouped_op
+from scmorph.utils import (
+    _MOMENT_OPS,
+    GroupIndex,
+    _get_group_keys,
+    _grouped_obs_stream,
+    _infer_names,
+    _process_pool,
+    _quantile_names,
+    _rollup_stats,
+    _stats_op,
+    get_covariance_factor,
+    get_group_index,
+    get_grouped_op,
+    grouped_op,
+    grouped_op_to_anndata,
+    streaming_covariance,
+)
 
 
 def _split_adata_control_drugs(
@@ -43,8 +63,6 @@ def _pca_mahalanobis(
     control: str,
     cov_include_treatment: bool = False,
 ) -> pd.Series:
-    from scipy.spatial.distance import mahalanobis
-
     logger = get_logger()
     drop_na(joint_adata, feature_threshold=0, cell_threshold=1)  # drop NA columns
     joint_adata, _ = _pca_aggregate(joint_adata)
@@ -80,11 +98,11 @@ def _pca_mahalanobis(
                 # combine
                 cov += drug_cov
 
-        cov_inv = np.linalg.inv(cov)
+        factor = get_covariance_factor(cov)
     else:
-        cov_inv = np.array([1])
+        factor = get_covariance_factor(np.eye(1))
 
-    dists = np.apply_along_axis(lambda x: mahalanobis(control_centroid, x, cov_inv), axis=1, arr=drug_data)
+    dists = factor.mahalanobis(drug_data, control_centroid)
 
     # add back information about drugs, then collapse drugs with multiple measurements
     dists = pd.Series(dists, index=pd.Series(drug_adata.obs[treatment_col]), name="mahalanobis").groupby(level=0).mean()
@@ -92,12 +110,118 @@ def _pca_mahalanobis(
     return dists
 
 
+def _control_pca_stats(X_control: np.ndarray) -> dict[str, Any]:
+    """
+    Sufficient statistics of control profiles for :func:`_incremental_pca_mahalanobis`
+
+    Stores the control mean and a thin factor `B` with ``B @ B.T`` equal to the
+    control sums of squared deviations, obtained from one SVD of the centered controls.
+    """
+    X_control = np.asarray(X_control, dtype=np.float64)
+    finite = np.isfinite(X_control).all(axis=0)
+    mean = X_control.mean(axis=0)
+    centered = np.where(finite, X_control - mean, 0)
+
+    _, sv, vt = np.linalg.svd(centered, full_matrices=False)
+    keep = sv > sv.max(initial=0) * 1e-12
+    return {"n": X_control.shape[0], "mean": mean, "factor": vt[keep].T * sv[keep], "finite": finite}
+
+
+def _incremental_pca_mahalanobis(
+    control_stats: dict[str, Any],
+    X_drug: np.ndarray,
+    cum_var_explained: float = 0.9,
+    cov_include_treatment: bool = False,
+) -> float:
+    """
+    Mahalanobis distance of one treatment, updating control statistics with its wells
+
+    Equivalent to running :func:`_pca_mahalanobis` on the joint control and treatment profiles,
+    i.e. dropping features with missing values, scaling, PCA and computing distances on the
+    leading PCs. Instead of redoing these steps, the joint covariance is obtained as a low-rank
+    update of the control statistics, so the cost scales with the number of control wells
+    and features rather than requiring a new SVD of all profiles.
+    """
+    X_drug = np.asarray(X_drug, dtype=np.float64)
+    features = control_stats["finite"] & np.isfinite(X_drug).all(axis=0)
+    X_drug = X_drug[:, features]
+    mean_c, factor_c = control_stats["mean"][features], control_stats["factor"][features]
+    n_c, n_d = control_stats["n"], X_drug.shape[0]
+    n = n_c + n_d
+
+    # joint moments by merging control and treatment (Chan et al. 1979)
+    mean_d = X_drug.mean(axis=0)
+    delta = mean_d - mean_c
+    mean = mean_c + delta * n_d / n
+    drug_centered = X_drug - mean_d
+    joint_factor = np.hstack([factor_c, drug_centered.T, np.sqrt(n_c * n_d / n) * delta[:, np.newaxis]])
+
+    # scale to unit variance like sklearn's StandardScaler, leaving constant features unscaled
+    sd = np.sqrt(np.einsum("ij,ij->i", joint_factor, joint_factor) / n)
+    sd[sd < 10 * np.finfo(np.float64).eps] = 1
+    joint_factor /= sd[:, np.newaxis] * np.sqrt(n - 1)
+
+    # eigendecomposition of the joint covariance through the smaller of its two Gram matrices
+    if joint_factor.shape[1] < joint_factor.shape[0]:
+        eigval, eigvec = np.linalg.eigh(joint_factor.T @ joint_factor)
+        eigval, eigvec = eigval[::-1], eigvec[:, ::-1]
+        nonzero = eigval > eigval[0] * 1e-12
+        eigval = eigval[nonzero]
+        components = joint_factor @ eigvec[:, nonzero] / np.sqrt(eigval)
+    else:
+        eigval, components = np.linalg.eigh(joint_factor @ joint_factor.T)
+        eigval, components = eigval[::-1], components[:, ::-1]
+    total_var = np.einsum("ij,ij->", joint_factor, joint_factor)
+
+    # same number of PCs as scanpy's default, then cut off as in _pca_aggregate
+    min_dim = min(n, joint_factor.shape[0])
+    n_comps = min(min_dim - 1 if min_dim <= 50 else 50, len(eigval))
+    variance_ratio = eigval[:n_comps] / total_var
+    pc_cutoff = np.where(np.cumsum(variance_ratio) > cum_var_explained)[0]
+    pc_cutoff = pc_cutoff[0] if pc_cutoff.size > 0 else n_comps
+    components = components[:, :pc_cutoff] / sd[:, np.newaxis]
+
+    control_centroid = (mean_c - mean) @ components
+    drug_data = (X_drug - mean) @ components
+
+    if pc_cutoff <= 1:
+        return float(np.mean(np.linalg.norm(drug_data - control_centroid, axis=1)))
+
+    control_scores = factor_c.T @ components
+    cov = control_scores.T @ control_scores / (n_c - 1)
+    if cov_include_treatment:
+        if n_d < 2:
+            get_logger().warning(
+                "Not enough drug replicates to compute covariance."
+                + " Using control covariance. Use cov_include_treatment=False"
+                + " to avoid computing covariance on treatments when not all drugs have replicates."
+            )
+        else:
+            drug_scores = drug_centered @ components
+            cov = cov / n_c + drug_scores.T @ drug_scores / (n_d - 1) / n_d
+
+    return float(np.mean(get_covariance_factor(cov).mahalanobis(drug_data, control_centroid)))
+
+
+def _incremental_pca_mahalanobis_batch(
+    control_stats: dict[str, Any], drug_blocks: list[np.ndarray], cov_include_treatment: bool
+) -> list[float]:
+    """Apply :func:`_incremental_pca_mahalanobis` to several treatments, e.g. in a worker process"""
+    return [
+        _incremental_pca_mahalanobis(control_stats, X_drug, cov_include_treatment=cov_include_treatment)
+        for X_drug in drug_blocks
+    ]
+
+
 def aggregate(
     adata: AnnData,
     well_key: str = "infer",
     group_keys: str | list[str] | None = None,
-    method: str = "median",
+    method: str | list[str] = "median",
     progress: bool = True,
+    approximate: bool = False,
+    skipna: bool = False,
+    **kwargs: Any,
 ) -> AnnData:
     """
     Aggregate single-cell measurements into well-level profiles
@@ -110,11 +234,27 @@ def aggregate(
         Name of column in metadata used to define wells. Default: "infer"
     group_keys : Optional[Union[str, List[str]]]
         Other column names to group by, e.g. plate names, by default None
-    method : str,
+    method : str | list[str],
         Which aggregation to perform. Must be one of 'mean', 'median', 'std',
-        'var', 'sem', 'mad', and 'mad_scaled' (i.e. median/mad)
+        'var', 'sem', 'mad', 'mad_scaled' (i.e. median/mad), 'quantile' and 'count'.
+        For 'quantile', pass the quantile to compute as `q`. A sequence of quantiles is stored in
+        one layer per quantile, named e.g. "quantile_0.1".
+        If a list of methods is given, all are computed in a single pass over the data
+        and stored in layers named after each method, with `X` holding the first method.
     progress : bool
         Whether to show a progress bar, by default True
+    approximate : bool
+        Whether to approximate quantile-based methods with mergeable streaming sketches.
+        This reads cells in chunks and so also works on very large, backed datasets.
+        See :func:`scmorph.utils.grouped_op` for details. By default False
+    skipna : bool
+        Whether to ignore missing values per feature instead of returning missing values
+        for features with any missing measurement in a well. This keeps all cells, rather
+        than dropping cells with missing values via :func:`scmorph.pp.drop_na` beforehand.
+        The number of values each profile is based on is stored in layer "n_valid".
+        By default False
+    kwargs : Any
+        Other arguments passed to :func:`scmorph.utils.grouped_op`, e.g. `q` or `sketch_size`
 
     Note
     ---------
@@ -123,7 +263,8 @@ def aggregate(
     feature is constant in that group. However, this will produce missing values.
     Before proceeding, you should therefore use
     :func:`scmorph.pp.drop_na(adata, feature_threshold=1, cell_threshold=0)`
-    to remove features with missing values.
+    to remove features with missing values. Missing values in the single-cell data
+    are better handled with `skipna=True`.
 
     Returns
     -------
@@ -138,7 +279,189 @@ def aggregate(
 
     group_keys = [well_key, *group_keys]
 
-    return get_grouped_op(adata, group_keys, operation=method, as_anndata=True, progress=progress)
+    if not skipna:
+        return get_grouped_op(
+            adata, group_keys, operation=method, as_anndata=True, progress=progress, approximate=approximate, **kwargs
+        )
+
+    methods = [method] if isinstance(method, str) else list(method)
+    if "q" in kwargs and np.ndim(kwargs["q"]) > 0:
+        methods = _quantile_names(methods, kwargs.pop("q"))
+    res = get_grouped_op(
+        adata,
+        group_keys,
+        operation=list(dict.fromkeys([*methods, "count"])),
+        progress=progress,
+        approximate=approximate,
+        skipna=True,
+        **kwargs,
+    )
+    agg = grouped_op_to_anndata(
+        res[method] if isinstance(method, str) and len(methods) == 1 else {m: res[m] for m in methods}, group_keys
+    )
+    agg.layers["n_valid"] = res["count"].T.to_numpy()
+    return agg
+
+
+def aggregate_hierarchy(
+    adata: AnnData,
+    levels: dict[str, str | list[str]],
+    method: str | list[str] = "mean",
+    layer: str | None = None,
+    sketch_size: int = 200,
+    chunk_size: int = 10000,
+    progress: bool = True,
+    skipna: bool = False,
+    **kwargs: Any,
+) -> dict[str, AnnData]:
+    """
+    Aggregate single-cell measurements at several levels in one pass
+
+    Reads the cells once to compute mergeable statistics for the finest groups, i.e.
+    all combinations of the columns in `levels`. Profiles at each level are then derived
+    by merging these statistics, so that the cost per level scales with the number of groups
+    rather than the number of cells.
+
+    Parameters
+    ----------
+    adata :class:`~anndata.AnnData`
+        Annotated data matrix
+    levels : dict[str, str | list[str]]
+        Name of each level mapped to the column(s) defining its groups, e.g.
+        ``{"site": ["Image_Metadata_Site", "Image_Metadata_Well", "Image_Metadata_Plate"],
+        "well": ["Image_Metadata_Well", "Image_Metadata_Plate"], "plate": "Image_Metadata_Plate"}``.
+        Levels do not need to be nested, e.g. a treatment level spanning several plates is valid.
+    method : str | list[str]
+        Which aggregation(s) to perform, any of 'mean', 'var', 'std', 'sem', 'median',
+        'mad', 'mad_scaled' and 'quantile'. If a list of methods is given, each is stored
+        in a layer named after it, with `X` holding the first method.
+    layer : str | None
+        Layer to aggregate, by default None (i.e. `X`)
+    sketch_size : int
+        Accuracy parameter of the quantile sketches, see :class:`scmorph.utils.QuantileSketch`
+    chunk_size : int
+        Number of cells to read at once, by default 10000
+    progress : bool
+        Whether to show a progress bar, by default True
+    skipna : bool
+        Whether to ignore missing values per feature, see :func:`aggregate`. If True, the number of
+        values each profile is based on is stored in layer "n_valid" at every level. By default False
+    kwargs : Any
+        Other arguments for the aggregation, e.g. `q` for method 'quantile'
+
+    Note
+    ---------
+    'mean', 'var', 'std' and 'sem' roll up exactly. Medians of medians are not medians, so
+    quantile-based methods are instead computed from mergeable quantile sketches
+    (see :class:`scmorph.utils.QuantileSketch`), which are exact for groups with fewer than `sketch_size`
+    cells and otherwise have a rank error of roughly ``1.7 / sketch_size`` at every level.
+
+    Returns
+    -------
+    dict[str, :class:`~anndata.AnnData`]
+        Aggregated annotated data matrix for each level
+    """
+    methods = [method] if isinstance(method, str) else list(method)
+    levels = {name: [cols] if isinstance(cols, str) else list(cols) for name, cols in levels.items()}
+    finest = list(dict.fromkeys(col for cols in levels.values() for col in cols))
+
+    sketch_methods = [m for m in methods if m not in _MOMENT_OPS]
+    index, stats = _grouped_obs_stream(
+        adata,
+        finest,
+        layer=layer,
+        moments=len(sketch_methods) < len(methods),
+        sketch_size=sketch_size if sketch_methods else None,
+        chunk_size=chunk_size,
+        progress=progress,
+        skipna=skipna,
+    )
+    fine_keys = index.key_frame()
+
+    aggregated = {}
+    for name, cols in levels.items():
+        coarse = GroupIndex.from_obs(fine_keys, cols)
+        coarse_stats = _rollup_stats(stats, coarse.codes, len(coarse))
+        res = {
+            m: pd.DataFrame(
+                _stats_op(m, coarse_stats, skipna=skipna, **kwargs).T, columns=coarse.keys, index=adata.var_names
+            )
+            for m in methods
+        }
+        aggregated[name] = grouped_op_to_anndata(res, cols)
+        if skipna:
+            aggregated[name].layers["n_valid"] = coarse_stats["count"]
+
+    return aggregated
+
+
+def aggregate_modz(
+    adata: AnnData,
+    treatment_key: str = "infer",
+    group_keys: str | list[str] | None = None,
+    method: str = "spearman",
+    min_weight: float = 0.01,
+    layer: str | None = None,
+) -> AnnData:
+    """
+    Consensus profile of each treatment from its replicate wells, using MODZ
+
+    Each replicate is weighted by the mean of its correlations to the other replicates of
+    the same treatment, with negative correlations set to 0, so that replicates which disagree
+    with the rest contribute less. Weights are clamped at `min_weight` and normalized to sum to 1
+    per treatment, as in the Connectivity Map [Subramanian17]_ and cmapPy's ``modz``.
+
+    Parameters
+    ----------
+    adata :class:`~anndata.AnnData`
+        Well-level profiles, e.g. as returned by :func:`scmorph.pp.aggregate`
+    treatment_key : str
+        Name of column in metadata used to define treatments, by default "infer"
+    group_keys : str | list[str] | None
+        Other column names to group by, e.g. cell lines or doses, by default None
+    method : str
+        Correlation between replicates, one of "spearman" or "pearson", by default "spearman"
+    min_weight : float
+        Smallest weight of a replicate before normalization, by default 0.01
+    layer : str | None
+        Layer holding the profiles, by default None (i.e. `X`)
+
+    Returns
+    -------
+    :class:`~anndata.AnnData`
+        Consensus profiles, with the weight of each well in `uns["modz_weights"]`
+    """
+    from scipy.stats import rankdata
+
+    if method not in ("spearman", "pearson"):
+        raise ValueError("method must be one of 'spearman' or 'pearson'")
+
+    keys, _ = _get_group_keys(adata, treatment_key, group_keys)
+    index = get_group_index(adata, keys)
+    X = np.asarray(adata.X if layer is None else adata.layers[layer], dtype=np.float64)[index.order]
+
+    # standardize profiles such that inner products are correlations
+    Z = rankdata(X, axis=1) if method == "spearman" else X.copy()
+    Z -= Z.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(Z, axis=1, keepdims=True)
+    Z /= np.where(norm == 0, 1, norm)
+
+    # mean of the non-negative correlations to the other replicates, clamped and normalized per group
+    starts, sizes = index.bounds[:-1], index.sizes
+    weights = np.ones(len(Z))
+    for start, size in zip(starts, sizes, strict=True):
+        if size < 2:
+            continue
+        block = Z[start : start + size]
+        corr = np.clip(block @ block.T, 0, None)
+        raw = (corr.sum(axis=1) - np.diagonal(corr)) / (size - 1)
+        weights[start : start + size] = np.maximum(raw, min_weight)
+    weights /= np.repeat(np.add.reduceat(np.abs(weights), starts), sizes)
+
+    consensus = np.add.reduceat(X * weights[:, np.newaxis], starts, axis=0)
+    agg = grouped_op_to_anndata(pd.DataFrame(consensus.T, index=adata.var_names, columns=index.keys), keys)
+    agg.uns["modz_weights"] = pd.Series(weights, index=adata.obs_names[index.order]).reindex(adata.obs_names)
+    return agg
 
 
 def aggregate_mahalanobis(
@@ -150,6 +473,8 @@ def aggregate_mahalanobis(
     cov_include_treatment: bool = False,
     cov_from_single_cell: bool = False,
     progress: bool = False,
+    n_cores: int = 1,
+    cov_shrinkage: str | None = None,
 ) -> pd.DataFrame:
     """
     Measure distance between groups using mahalanobis distance
@@ -180,16 +505,32 @@ def aggregate_mahalanobis(
     cov_from_single_cell : bool
             Whether to compute covariance matrix from single cells. This computes distances directly on features
             with no prior PCA. As a result, cov_include_treatment and per_treatment will be ignored (both False).
+            The covariance is accumulated over chunks of cells, so this also works for backed data.
 
     progress : bool
             Whether to show a progress bar, by default False
 
+    n_cores : int
+            Number of processes to distribute treatments over when `per_treatment` is True.
+            -1 for all cores. By default 1
+
+    cov_shrinkage : str | None
+            Shrinkage of the single-cell covariance matrix when `cov_from_single_cell` is True,
+            one of "ledoit_wolf" or "oas". Shrinkage guarantees an invertible covariance matrix,
+            so no fallback to aggregate data is needed. See :func:`scmorph.utils.streaming_covariance`.
+            By default None (no shrinkage)
+
     Returns
     -------
     dists : :class:`~pandas.DataFrame`
             Mahalanobis distances between treatments
+
+    Note
+    ---------
+    With `per_treatment`, the control profiles are decomposed once. The PCA of each treatment
+    together with the controls is then derived by updating this decomposition with the
+    treatment's wells, rather than scaling and decomposing all profiles again.
     """
-    import anndata
     from tqdm import tqdm
 
     group_keys, treatment_col = _get_group_keys(adata, treatment_key, well_key)
@@ -209,19 +550,13 @@ def aggregate_mahalanobis(
         name="mahalanobis",
         dtype=np.float64,
     )
-    iterator = tqdm(dists.index) if progress else dists.index
 
     if cov_from_single_cell:
-        from scipy.spatial.distance import mahalanobis
-
-        adata_control_sc, _, _ = _split_adata_control_drugs(adata, treatment_col, control, well_key)
-        cov = np.cov(adata_control_sc.X, rowvar=False)
+        control_mask = (adata.obs[treatment_col] == control).to_numpy()
+        cov, _ = streaming_covariance(adata, mask=control_mask, shrinkage=cov_shrinkage)
         try:
-            vi = np.linalg.inv(cov)
-        except np.linalg.LinAlgError as e:
-            if "Singular matrix" not in str(e):
-                raise e
-
+            factor = get_covariance_factor(cov, fallback="raise")
+        except np.linalg.LinAlgError:
             logger = get_logger()
             logger.warning(
                 f"Covariance matrix estimated from single cells of {control} was not invertible."
@@ -232,24 +567,38 @@ def aggregate_mahalanobis(
 
     if cov_from_single_cell:  # check that covariance matrix was invertible
         control_centroid = np.median(adata_control.X, axis=0)
-
-        for cur_treatment in iterator:
-            drug_idx = adata_drugs.obs[treatment_col] == cur_treatment
-            if sum(drug_idx) == 1:
-                drug_centroid = adata_drugs[drug_idx].X.flatten()
-            else:
-                drug_centroid = np.median(adata_drugs[drug_idx].X, axis=0).flatten()
-
-            dists[cur_treatment] = mahalanobis(control_centroid, drug_centroid, VI=vi)
+        drug_centroids = grouped_op(adata_drugs, treatment_col, "median", progress=False)[dists.index]
+        dists[:] = factor.mahalanobis(drug_centroids.T.to_numpy(), control_centroid)
         return dists
 
-    # only per_treatment = True and cov_from_single_cell = True remaining
+    # only per_treatment = True remaining
     # (or cov_from_single_cell = True but covariance matrix not invertible)
-    if not cov_from_single_cell:
-        for cur_treatment in iterator:
-            drug_idx = adata_drugs.obs[treatment_col] == cur_treatment
-            joint_adata = anndata.concat([adata_control, adata_drugs[drug_idx]])
-            dists[cur_treatment] = _pca_mahalanobis(joint_adata, treatment_col, control, cov_include_treatment)[0]
+    control_stats = _control_pca_stats(adata_control.X)
+    treatments = adata_drugs.obs[treatment_col].to_numpy()
+    drug_blocks = [adata_drugs.X[treatments == cur_treatment] for cur_treatment in dists.index]
+
+    if n_cores == 1 or not drug_blocks:
+        iterator = tqdm(drug_blocks) if progress else drug_blocks
+        dists[:] = [
+            _incremental_pca_mahalanobis(control_stats, X_drug, cov_include_treatment=cov_include_treatment)
+            for X_drug in iterator
+        ]
+        return dists
+
+    n_cores = (os.cpu_count() or 1) if n_cores == -1 else n_cores
+    batches = np.array_split(np.arange(len(drug_blocks)), min(len(drug_blocks), n_cores * 4))
+    with _process_pool(n_cores) as pool:
+        futures = [
+            pool.submit(
+                _incremental_pca_mahalanobis_batch,
+                control_stats,
+                [drug_blocks[i] for i in batch],
+                cov_include_treatment,
+            )
+            for batch in batches
+        ]
+        futures = tqdm(futures) if progress else futures
+        dists[:] = np.concatenate([future.result() for future in futures])
 
     return dists
 
@@ -309,12 +658,30 @@ def aggregate_pc(
     return pd.Series(dist, index=agg_adata.obs[treatment_col[0]], name="pc_dist")
 
 
-# TODO: check speedup options
+def _welch_ttest(
+    n_a: np.ndarray, mean_a: np.ndarray, var_a: np.ndarray, n_b: np.ndarray, mean_b: np.ndarray, var_b: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Welch's t-test from sufficient statistics, as in :func:`scipy.stats.ttest_ind` with `equal_var=False`
+
+    Statistics of either sample broadcast, so one control can be tested against many groups at once.
+    Variances use one degree of freedom. Returns t-statistics and two-sided p-values.
+    """
+    from scipy.stats import t
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        se_a, se_b = var_a / n_a, var_b / n_b
+        dof = (se_a + se_b) ** 2 / (se_a**2 / (n_a - 1) + se_b**2 / (n_b - 1))
+        tstat = (mean_a - mean_b) / np.sqrt(se_a + se_b)
+    pval = 2 * t.sf(np.abs(tstat), dof)
+    return tstat, pval
+
+
 def aggregate_ttest(
     adata: AnnData,
     treatment_key: str = "infer",
     control: str = "DMSO",
-    group_key: str | None = None,
+    group_key: str | GroupIndex | None = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Measure per-feature distance between groups using t-statistics.
@@ -332,8 +699,9 @@ def aggregate_ttest(
     control : str
             Name of control treatment. Must be valid value in `treatment_key`.
 
-    group_key : str
-            Name of column in metadata used to define groups
+    group_key : str | GroupIndex
+            Name of column in metadata used to define groups. Alternatively, a prebuilt
+            :class:`scmorph.utils.GroupIndex` of the treatment and group columns.
 
     Returns
     -------
@@ -343,25 +711,30 @@ def aggregate_ttest(
     qvals: :class:`~pandas.DataFrame`
             q-values (i.e. FDR-corrected p-values)
     """
-    import scipy
     from statsmodels.stats.multitest import fdrcorrection
 
     logger = get_logger()
 
-    adata_control, adata_drugs, group_keys = _split_adata_control_drugs(adata, treatment_key, control, group_key)
+    prebuilt = isinstance(group_key, GroupIndex)
+    group_keys, treatment_col = _get_group_keys(adata, treatment_key, None if prebuilt else group_key)
+    index = get_group_index(adata, group_key if prebuilt else group_keys)
 
-    tstats = {}
-    pvals = {}
+    # one streamed pass for the sufficient statistics of the controls (group 0) and each group of drug cells
+    control_idx = (adata.obs[treatment_col[0]] == control).to_numpy()
+    drug_index = GroupIndex(np.where(control_idx, -1, index.codes), index.keys, index.group_key)
+    drug_index = drug_index.subset(np.arange(adata.n_obs))
+    # drug cells with missing group keys keep code -1 and are left out
+    joint_codes = np.where(control_idx, 0, np.where(drug_index.codes >= 0, drug_index.codes + 1, -1))
+    joint_index = GroupIndex(joint_codes, ["control", *drug_index.keys], ["_joint"])
+    _, stats = _grouped_obs_stream(adata, joint_index, progress=False)
 
-    def _get_stats(control: np.array, drug: np.array) -> tuple[np.array, np.array]:
-        tstat, pval = scipy.stats.ttest_ind(control, drug, axis=0, equal_var=False)
-        return tstat, pval
+    n, mean = stats["count"], stats["mean"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = stats["m2"] / (n - 1)
+    tstat, pval = _welch_ttest(n[0], mean[0], var[0], n[1:], mean[1:], var[1:])
 
-    for group, idx in adata_drugs.obs.groupby(group_keys, observed=True).groups.items():
-        cur_drug = adata_drugs[idx, :]
-        tstat, pval = _get_stats(adata_control.X, cur_drug.X)
-        pvals[group] = pval
-        tstats[group] = tstat
+    tstats = dict(zip(drug_index.keys, tstat, strict=True))
+    pvals = dict(zip(drug_index.keys, pval, strict=True))
 
     pvalsdf = pd.DataFrame(pvals, index=adata.var.index).T
 
@@ -406,3 +779,133 @@ def tstat_distance(tstats: pd.DataFrame) -> pd.DataFrame:
     # score[j] = sqrt(t_1^2 + ... + t_i^2)
     # where i = features and j = compounds
     return tstats.pow(2).sum(axis=0).pow(0.5)
+
+
+_DISTRIBUTION_METHODS = ("wasserstein", "ks", "auc")
+
+
+@njit(parallel=True, cache=True)
+def _distribution_distances(
+    control: np.ndarray, n_control: np.ndarray, treated: np.ndarray, bounds: np.ndarray
+) -> np.ndarray:  # pragma: no cover
+    """
+    Wasserstein-1 distance, Kolmogorov-Smirnov statistic and AUC of each group and feature
+
+    `control` holds each feature's control values sorted in ascending order, with missing
+    values last and `n_control` non-missing values per feature. Rows `bounds[g]:bounds[g + 1]`
+    of `treated` are the cells of group g. Each group is sorted per feature and merged
+    with the sorted control values in a single pass.
+    """
+    n_groups, n_features = len(bounds) - 1, control.shape[1]
+    res = np.full((n_groups, n_features, 3), np.nan)
+
+    for f in prange(n_features):
+        a = control[: n_control[f], f]
+        n_a = a.size
+        for g in range(n_groups):
+            b = treated[bounds[g] : bounds[g + 1], f]
+            b = np.sort(b[~np.isnan(b)])
+            n_b = b.size
+            if n_a == 0 or n_b == 0:
+                continue
+
+            i, j = 0, 0
+            wasserstein, ks, auc = 0.0, 0.0, 0.0
+            prev, cdf_diff = 0.0, 0.0
+            while i < n_a or j < n_b:
+                x = min(a[i] if i < n_a else np.inf, b[j] if j < n_b else np.inf)
+                if i + j > 0:
+                    wasserstein += cdf_diff * (x - prev)
+
+                below = i
+                while i < n_a and a[i] == x:
+                    i += 1
+                ties = i - below
+                while j < n_b and b[j] == x:
+                    j += 1
+                    auc += below + 0.5 * ties
+
+                cdf_diff = abs(i / n_a - j / n_b)
+                ks = max(ks, cdf_diff)
+                prev = x
+
+            res[g, f, 0] = wasserstein
+            res[g, f, 1] = ks
+            res[g, f, 2] = auc / (n_a * n_b)
+    return res
+
+
+def aggregate_distribution(
+    adata: AnnData,
+    treatment_key: str = "infer",
+    control: str = "DMSO",
+    group_key: str | GroupIndex | None = None,
+    method: str | list[str] = "wasserstein",
+    layer: str | None = None,
+) -> pd.DataFrame | dict[str, pd.DataFrame]:
+    """
+    Measure per-feature distance between single-cell distributions of groups and control
+
+    Unlike comparisons of well medians, this also detects shifts of subpopulations and changes
+    in spread. Control values of each feature are sorted once, and every group is compared
+    to them with a merge of sorted values, in parallel across features.
+    Missing values are ignored per feature.
+
+    Parameters
+    ----------
+    adata :class:`~anndata.AnnData`
+            Annotated data matrix
+
+    treatment_key : str
+            Name of column in metadata used to define treatments
+
+    control : str
+            Name of control treatment. Must be valid value in `treatment_key`.
+
+    group_key : str | GroupIndex
+            Name of column in metadata used to define groups. Alternatively, a prebuilt
+            :class:`scmorph.utils.GroupIndex` of the treatment and group columns.
+
+    method : str | list[str]
+            Which comparison to compute, one or several of:
+
+            - "wasserstein": Wasserstein-1 (earth mover's) distance, as in :func:`scipy.stats.wasserstein_distance`
+            - "ks": two-sample Kolmogorov-Smirnov statistic, as in :func:`scipy.stats.ks_2samp`
+            - "auc": probability that a cell of the group has a larger value than a control cell,
+              counting ties as one half. 0.5 indicates no shift.
+
+            By default "wasserstein"
+
+    layer : str | None
+            Layer to compare, by default None (i.e. `X`)
+
+    Returns
+    -------
+    dists : :class:`~pandas.DataFrame` | dict[str, :class:`~pandas.DataFrame`]
+            Per-feature comparisons of each group to control. If `method` is a list,
+            a dictionary mapping each method to its result.
+    """
+    methods = [method] if isinstance(method, str) else list(method)
+    if any(m not in _DISTRIBUTION_METHODS for m in methods):
+        raise ValueError(f"method must be one of {', '.join(_DISTRIBUTION_METHODS)}")
+
+    prebuilt = isinstance(group_key, GroupIndex)
+    group_keys, treatment_col = _get_group_keys(adata, treatment_key, None if prebuilt else group_key)
+    index = get_group_index(adata, group_key if prebuilt else group_keys)
+
+    control_idx = (adata.obs[treatment_col[0]] == control).to_numpy()
+    drug_index = index.subset(~control_idx)
+    X = adata.X if layer is None else adata.layers[layer]
+
+    X_control = np.sort(np.asarray(X[control_idx], dtype=np.float64), axis=0)
+    n_control = np.sum(~np.isnan(X_control), axis=0)
+    X_drugs = np.asarray(X[~control_idx], dtype=np.float64)[drug_index.order]
+
+    res = _distribution_distances(X_control, n_control, X_drugs, drug_index.bounds)
+
+    dists = {
+        m: pd.DataFrame(dict(zip(drug_index.keys, res[:, :, i], strict=True)), index=adata.var.index)
+        for i, m in enumerate(_DISTRIBUTION_METHODS)
+        if m in methods
+    }
+    return dists[method] if isinstance(method, str) else {m: dists[m] for m in methods}
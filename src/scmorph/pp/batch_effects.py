@@ -1,10 +1,145 @@
 """Functions to remove batch effects from morphological datasets."""
 
+import warnings
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 from anndata import AnnData
 
-from scmorph.utils import _infer_names, get_grouped_op, group_obs_fun_inplace
+from scmorph.logging import get_logger
+from scmorph.utils import (
+    GroupIndex,
+    _infer_names,
+    _iter_chunks,
+    get_group_index,
+    group_broadcast_inplace,
+    grouped_op,
+)
+
+
+def _batch_effect_summary(
+    adata: AnnData, index: GroupIndex, log: bool, chunk_size: int = 10000, progress: bool = True
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per-group means and per-feature minimums of grouped cells in one streamed pass
+
+    Cells with a group code of -1 are skipped. Only `chunk_size` cells are read at a time,
+    so this also works on backed data. If `log`, means are computed on log1p-transformed data.
+    """
+    from tqdm import tqdm
+
+    sums = np.zeros((len(index), adata.n_vars), dtype=np.float64)
+    minimum = np.full(adata.n_vars, np.inf)
+
+    chunks = _iter_chunks(adata, chunk_size=chunk_size)
+    chunks = tqdm(chunks, total=int(np.ceil(adata.n_obs / chunk_size)), unit=" chunks") if progress else chunks
+    for start, end, X in chunks:
+        codes = index.codes[start:end]
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        if len(order) == 0:
+            continue
+        codes, X = codes[order], X[order].astype(np.float64, copy=False)
+        groups, starts = np.unique(codes, return_index=True)
+
+        minimum = np.fmin(minimum, np.fmin.reduce(X, axis=0))
+        if log:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                X = np.log1p(X)
+        sums[groups] += np.add.reduceat(X, starts, axis=0)
+
+    return sums / index.sizes[:, np.newaxis], minimum
+
+
+def _batch_effect_data(
+    adata: AnnData,
+    bio_key: str | None,
+    batch_key: str,
+    log: bool | None,
+    treatment_key: str | None,
+    control: str,
+    progress: bool,
+    chunk_size: int,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Average of each feature per biological entity and batch (features × groups) and the groups' labels"""
+    # combine keys for batch and bio
+    joint_keys = [i for i in [bio_key, batch_key] if i is not None]
+
+    index = get_group_index(adata, joint_keys)
+    if treatment_key is not None:
+        # keep all cells, but only assign control cells to groups
+        is_control = (adata.obs[treatment_key] == control).to_numpy()
+        control_index = index.subset(is_control)
+        codes = np.full(adata.n_obs, -1, dtype=np.int64)
+        codes[is_control] = control_index.codes
+        index = GroupIndex(codes, control_index.keys, index.group_key)
+
+    means, minimum = _batch_effect_summary(
+        adata, index, log=bool(log), chunk_size=chunk_size, progress=progress
+    )  # compute average feature per batch/bio group
+    keep = minimum >= -0.99 if log else np.ones(adata.n_vars, dtype=bool)  # remove features with values < -0.99
+    return pd.DataFrame(means[:, keep].T, index=adata.var_names[keep]), index.key_frame()
+
+
+def _solve_batch_effects(
+    data: pd.DataFrame,
+    groups: pd.DataFrame,
+    bio_key: str | None,
+    batch_key: str,
+    max_iter: int = 1000,
+    tol: float = 1e-10,
+) -> tuple[pd.Series, pd.DataFrame, pd.DataFrame]:
+    """
+    Fit the additive model of group averages
+
+    Solves the least-squares problem ``average = intercept + beta[bio] + gamma[batch]`` by alternating
+    between biological and batch effects, each of which is a mean of residuals per entity or batch.
+    Residual means are computed with sparse indicator matrices, so each iteration is linear in the number
+    of groups, and balanced designs converge after one iteration.
+
+    Returns the intercept, i.e. the average of the first biological entity in the first batch,
+    and the biological and batch effects relative to the first entity and batch.
+    """
+    from scipy.sparse import csr_matrix
+
+    Y = data.to_numpy(dtype=np.float64).T  # groups × features
+    n_groups = len(groups)
+
+    def _indicator(key: str | None) -> tuple[csr_matrix, np.ndarray, pd.Index]:
+        if key is None:
+            codes, labels = np.zeros(n_groups, dtype=np.int64), pd.Index([])
+        else:
+            codes, labels = pd.factorize(groups[key], sort=True)
+        indicator = csr_matrix((np.ones(n_groups), (codes, np.arange(n_groups))), shape=(codes.max() + 1, n_groups))
+        # mean per level: divide sums of rows by the number of groups of each level
+        sizes = np.asarray(indicator.sum(axis=1))
+        return indicator.multiply(1 / sizes).tocsr(), codes, labels
+
+    bio_means, bio_codes, bio_groups = _indicator(bio_key)
+    batch_means, batch_codes, batch_groups = _indicator(batch_key)
+
+    beta = bio_means @ Y
+    scale = max(np.nanmax(np.abs(Y), initial=0), np.finfo(np.float64).tiny)
+    for _ in range(max_iter):
+        gamma = batch_means @ (Y - beta[bio_codes])
+        new_beta = bio_means @ (Y - gamma[batch_codes])
+        converged = np.nanmax(np.abs(new_beta - beta), initial=0) <= tol * scale
+        beta = new_beta
+        if converged:
+            break
+    else:
+        get_logger().warning(
+            f"Batch effects did not converge after {max_iter} iterations,"
+            + " check that batches share biological entities"
+        )
+
+    # express effects relative to the first entity and batch
+    intercept = pd.Series(beta[0] + gamma[0], index=data.index)
+    betas = (beta - beta[0]).T if bio_key is not None else np.zeros((len(data), 0))
+    betas_df = pd.DataFrame(betas, columns=bio_groups, index=data.index)
+    gammas_df = pd.DataFrame((gamma - gamma[0]).T, columns=batch_groups, index=data.index)
+    return intercept, betas_df, gammas_df
 
 
 def compute_batch_effects(
@@ -15,6 +150,7 @@ def compute_batch_effects(
     treatment_key: str | None = None,
     control: str = "DMSO",
     progress: bool = True,
+    chunk_size: int = 10000,
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Compute batch effects
@@ -25,6 +161,9 @@ def compute_batch_effects(
 
     For details on scone, see [Cole19]_. For details on the results particularly view Eq. 3.
 
+    The model is fit to the average of each biological entity and batch, which are accumulated
+    in a single pass over chunks of cells. This also works for backed data.
+
     Parameters
     ----------
     adata :class:`~anndata.AnnData`
@@ -52,6 +191,9 @@ def compute_batch_effects(
     progress: bool
             Whether to show a progress bar, by default True
 
+    chunk_size: int
+            Number of cells to read at once, by default 10000
+
     Returns
     -------
     betas : :class:`~pandas.DataFrame`
@@ -60,59 +202,207 @@ def compute_batch_effects(
     gammas : :class:`~pandas.DataFrame`
         Technical effects, i.e. batch effects.
     """
-    from formulaic import Formula
-    from patsy.contrasts import Treatment
-
-    withbio = bio_key is not None
-
     if batch_key == "infer":
         batch_key = _infer_names("batch", adata.obs.columns)[0]
 
-    # combine keys for batch and bio
-    joint_keys = [i for i in [bio_key, batch_key] if i is not None]
+    get_logger().info("Computing batch effects...")
+    data, groups = _batch_effect_data(adata, bio_key, batch_key, log, treatment_key, control, progress, chunk_size)
+    _, betas_df, gammas_df = _solve_batch_effects(data, groups, bio_key, batch_key)
+    return betas_df if bio_key is not None else [], gammas_df
 
-    if treatment_key is not None:
-        adata = adata[adata.obs[treatment_key] == control, :]
-    fun = "logmean" if log else "mean"
-    if log:
-        adata = adata[:, ~np.any(adata.X < -0.99, axis=0)]  # remove features with values < -0.99
-    print("Computing batch effects...")
-    data = get_grouped_op(
-        adata, group_key=joint_keys, operation=fun, progress=progress, store=False
-    )  # compute average feature per batch/bio group
-
-    data = data.loc[adata.var.index]  # ensure correct feature order
-
-    groups = pd.DataFrame(data.columns.to_list(), columns=joint_keys)
 
-    # create design matrix
-    if withbio:
-        dmatrix = Formula(f"C({bio_key}) +C({batch_key})").get_model_matrix(groups)
-    else:
-        dmatrix = Formula(f"C({batch_key})").get_model_matrix(groups)
+class BatchEffectModel:
+    """
+    Batch effects that can be fit once and applied to new data
 
-    # identify model parameters using linear modeling
-    # rcond=None to avoid FutureWarning
-    params = np.linalg.lstsq(dmatrix, data.T, rcond=None)[0]
+    Stores the intercept, biological effects and batch effects estimated as in :func:`compute_batch_effects`,
+    so that cells of known batches can be corrected without refitting, e.g. plates that are streamed
+    from disk. Batches that were not part of the fit are added with :meth:`partial_fit`, which estimates
+    only their batch effects while keeping the intercept and biological effects fixed. The model can be
+    saved to and loaded from disk.
 
-    # extract parameters into beta and gammas
-    gamma_ind = np.where(dmatrix.columns.str.contains(batch_key))[0]
+    Parameters
+    ----------
+    bio_key : str | None
+        Name of column used to delineate biological entities, e.g. cell lines. Default: None
+    batch_key : str
+        Name of column used to delineate batch effects, e.g. plates. Will try to guess if
+        no argument is given. Default: "infer"
+    log : bool
+        Whether to compute log1p-transformed batch effects, see :func:`compute_batch_effects`. Default: False
+    treatment_key : str | None
+        Name of column used to delineate treatments. If given, effects are estimated on control cells only.
+    control : str
+        Name of control treatment. Must be valid value in `treatment_key`.
 
-    batch_groups = groups[batch_key].drop_duplicates().to_list()
-    contrast_gamma = Treatment(reference=0).code_without_intercept(batch_groups)
-    gammas = (contrast_gamma.matrix @ params[gamma_ind, :]).T
+    Attributes
+    ----------
+    intercept : :class:`~pandas.Series`
+        Average of each feature in the first biological entity and batch
+    betas : :class:`~pandas.DataFrame`
+        Biological effects of shape features × biological entities
+    gammas : :class:`~pandas.DataFrame`
+        Batch effects of shape features × batches
+    """
 
-    betas = []
-    if withbio:
-        beta_ind = np.where(dmatrix.columns.str.contains(bio_key))[0]
-        bio_groups = groups[bio_key].drop_duplicates().to_list()
-        contrast_beta = Treatment(reference=0).code_without_intercept(bio_groups)
-        betas = (contrast_beta.matrix @ params[beta_ind, :]).T
+    def __init__(
+        self,
+        bio_key: str | None = None,
+        batch_key: str = "infer",
+        log: bool = False,
+        treatment_key: str | None = None,
+        control: str = "DMSO",
+    ) -> None:
+        self.bio_key = bio_key
+        self.batch_key = batch_key
+        self.log = bool(log)
+        self.treatment_key = treatment_key
+        self.control = control
+
+    def _check_fitted(self) -> None:
+        if not hasattr(self, "gammas"):
+            raise RuntimeError("Model is not fitted yet, call fit first")
+
+    def _data(self, adata: AnnData, progress: bool, chunk_size: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+        if self.batch_key == "infer":
+            self.batch_key = _infer_names("batch", adata.obs.columns)[0]
+        return _batch_effect_data(
+            adata, self.bio_key, self.batch_key, self.log, self.treatment_key, self.control, progress, chunk_size
+        )
+
+    def fit(self, adata: AnnData, progress: bool = True, chunk_size: int = 10000) -> "BatchEffectModel":
+        """
+        Estimate biological and batch effects
+
+        Parameters
+        ----------
+        adata : :class:`~anndata.AnnData`
+            Annotated data matrix, may be backed
+        progress : bool
+            Whether to show a progress bar, by default True
+        chunk_size : int
+            Number of cells to read at once, by default 10000
+
+        Returns
+        -------
+        BatchEffectModel
+            The fitted model
+        """
+        data, groups = self._data(adata, progress, chunk_size)
+        self.intercept, self.betas, self.gammas = _solve_batch_effects(data, groups, self.bio_key, self.batch_key)
+        return self
+
+    def partial_fit(self, adata: AnnData, progress: bool = True, chunk_size: int = 10000) -> "BatchEffectModel":
+        """
+        Estimate the effects of new batches against the fitted reference
+
+        Only batches that are not yet part of the model are estimated. Their effect is the average
+        difference of their group averages to the model's prediction without batch effect. Intercept,
+        biological effects and effects of known batches are unchanged, so that data corrected before stays
+        comparable to newly corrected data.
+
+        Parameters
+        ----------
+        adata : :class:`~anndata.AnnData`
+            Annotated data matrix holding the new batches, may be backed
+        progress : bool
+            Whether to show a progress bar, by default True
+        chunk_size : int
+            Number of cells to read at once, by default 10000
+
+        Returns
+        -------
+        BatchEffectModel
+            The updated model
+        """
+        self._check_fitted()
+        data, groups = self._data(adata, progress, chunk_size)
+        # labels are matched as strings, as they are stored by save
+        is_new = ~groups[self.batch_key].astype(str).isin(self.gammas.columns.astype(str)).to_numpy()
+        if not is_new.any():
+            return self
+        data, groups = data.reindex(self.gammas.index).loc[:, is_new], groups[is_new]
+
+        expected = np.broadcast_to(self.intercept.to_numpy()[:, np.newaxis], data.shape)
+        if self.bio_key is not None:
+            bio = groups[self.bio_key].astype(str)
+            betas = self.betas.rename(columns=str)
+            missing = set(bio) - set(betas.columns)
+            if missing:
+                raise ValueError(f"No biological effects for: {', '.join(sorted(missing))}, refit the model")
+            expected = expected + betas[bio].to_numpy()
+
+        residuals = pd.DataFrame((data.to_numpy() - expected).T, index=groups[self.batch_key].to_numpy())
+        new_gammas = residuals.groupby(level=0, sort=True).mean().T
+        new_gammas.index = self.gammas.index
+        self.gammas = pd.concat([self.gammas, new_gammas], axis=1)
+        return self
+
+    def transform(self, adata: AnnData, copy: bool = False) -> None | AnnData:
+        """
+        Remove batch effects of known batches
+
+        Parameters
+        ----------
+        adata : :class:`~anndata.AnnData`
+            Annotated data matrix, may be backed
+        copy : bool
+            If False, will perform operation in-place, else return a modified copy of the data.
 
-    # convert to DataFrames to store metadata
-    gammas_df = pd.DataFrame(gammas, columns=sorted(batch_groups), index=data.index)
-    betas_df = pd.DataFrame(betas, columns=sorted(bio_groups), index=data.index) if len(betas) != 0 else []
-    return betas_df, gammas_df
+        Returns
+        -------
+        adata : :class:`~anndata.AnnData`
+            Annotated data matrix with batch effects removed. If `copy` is False, will modify in-place and not return anything.
+        """
+        self._check_fitted()
+        if copy:
+            adata = adata.copy()
+
+        # per-batch offsets, applied to all cells in a single pass
+        offsets = (np.exp(self.gammas) if self.log else self.gammas).rename(columns=str)
+        index = get_group_index(adata, self.batch_key)
+        batches = [str(key) for key in index.keys]
+        missing = [batch for batch in batches if batch not in offsets.columns]
+        if missing:
+            raise ValueError(f"No batch effects for: {', '.join(missing)}, add them with partial_fit")
+        offsets = offsets.reindex(index=adata.var_names, fill_value=0)[batches]
+
+        group_broadcast_inplace(adata, index, offsets.to_numpy(), operation="subtract")
+        if copy:
+            return adata
+        return None
+
+    def save(self, path: str | Path) -> None:
+        """Save the fitted model to a `.npz` file"""
+        self._check_fitted()
+        np.savez(
+            path,
+            config=np.array(
+                [self.bio_key or "", self.batch_key, str(self.log), self.treatment_key or "", self.control]
+            ),
+            features=self.gammas.index.to_numpy(dtype=str),
+            intercept=self.intercept.to_numpy(),
+            betas=self.betas.to_numpy(),
+            bio_groups=self.betas.columns.to_numpy(dtype=str),
+            gammas=self.gammas.to_numpy(),
+            batches=self.gammas.columns.to_numpy(dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path: str | Path) -> "BatchEffectModel":
+        """
+        Load a model saved with :meth:`save`
+
+        Labels of biological entities and batches are restored as strings.
+        """
+        with np.load(path, allow_pickle=False) as f:
+            bio_key, batch_key, log, treatment_key, control = (str(x) for x in f["config"])
+            model = cls(bio_key or None, batch_key, log == "True", treatment_key or None, control)
+            features = pd.Index(f["features"])
+            model.intercept = pd.Series(f["intercept"], index=features)
+            model.betas = pd.DataFrame(f["betas"], index=features, columns=f["bio_groups"])
+            model.gammas = pd.DataFrame(f["gammas"], index=features, columns=f["batches"])
+        return model
 
 
 def remove_batch_effects(
@@ -168,27 +458,244 @@ def remove_batch_effects(
     """
     if copy:
         adata = adata.copy()
-    betas, gammas = compute_batch_effects(
-        adata,
-        bio_key=bio_key,
-        batch_key=batch_key,
-        log=log,
-        treatment_key=treatment_key,
-        control=control,
+    model = BatchEffectModel(
+        bio_key=bio_key, batch_key=batch_key, log=bool(log), treatment_key=treatment_key, control=control
     )
-    adata.uns["batch_effects"] = pd.concat((betas, gammas), axis=1) if len(betas) > 0 else gammas
+    logger = get_logger()
+    logger.info("Computing batch effects...")
+    model.fit(adata)
+    adata.uns["batch_effects"] = pd.concat((model.betas, model.gammas), axis=1)
 
-    if log:
+    logger.info("Removing batch effects...")
+    model.transform(adata)
+    if copy:
+        return adata
 
-        def batch_corrector(x: np.ndarray, group: str) -> np.ndarray:
-            return x - np.power(np.e, gammas[group].to_numpy())
 
-    else:
+def _parse_wells(wells: pd.Series | np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Zero-based row and column of well IDs such as "A01", "P24" or "AF48"
 
-        def batch_corrector(x: np.ndarray, group: str) -> np.ndarray:
-            return x - gammas[group].to_numpy()
+    Rows after "Z" continue with "AA", "AB", ..., as in 1536-well plates.
+    """
+    wells = pd.Series(np.asarray(wells), dtype=str)
+    parts = wells.str.extract(r"^\s*([A-Za-z]+)0*(\d+)\s*$")
+    invalid = parts[0].isna()
+    if invalid.any():
+        raise ValueError(f"Could not parse well IDs: {', '.join(wells[invalid].unique()[:5])}")
+
+    # letters are digits of a bijective base-26 number, A=1, ..., Z=26, AA=27
+    letters = {
+        name: sum(26**i * (ord(c) - ord("A") + 1) for i, c in enumerate(reversed(name)))
+        for name in parts[0].str.upper().unique()
+    }
+    rows = parts[0].str.upper().map(letters).to_numpy(dtype=np.int64)
+    return rows - 1, parts[1].to_numpy(dtype=np.int64) - 1
+
+
+def _median_polish(grid: np.ndarray, max_iter: int = 10, tol: float = 0.01) -> tuple[np.ndarray, ...]:
+    """
+    Tukey's two-way median polish of many plates and features at once
+
+    `grid` has shape (n_plates, n_rows, n_cols, n_features), with NaN for missing wells.
+    Follows R's `medpolish` with `na.rm=TRUE`, alternating between removing row and column medians
+    until the sum of absolute residuals of each plate and feature changes by less than `tol` relative to it.
+
+    Returns overall effects (n_plates, 1, 1, n_features), row effects (n_plates, n_rows, 1, n_features),
+    column effects (n_plates, 1, n_cols, n_features) and residuals of the same shape as `grid`.
+    Effects of empty rows or columns are 0.
+    """
 
-    print("Removing batch effects...")
-    group_obs_fun_inplace(adata, batch_key, batch_corrector)
+    def _median(x: np.ndarray, axis: int) -> np.ndarray:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN slices
+            return np.nanmedian(x, axis=axis, keepdims=True)
+
+    residuals = grid.astype(np.float64, copy=True)
+    present = ~np.isnan(residuals)
+    # effects of rows and columns without data are missing, so that they do not enter medians
+    row = np.where(present.any(axis=2, keepdims=True), 0.0, np.nan)
+    col = np.where(present.any(axis=1, keepdims=True), 0.0, np.nan)
+    overall = np.zeros((grid.shape[0], 1, 1, grid.shape[3]))
+
+    # plates and features stop updating once converged, as if polished one at a time
+    active = np.ones_like(overall, dtype=bool)
+    old_sum = np.zeros_like(overall)
+    for _ in range(max_iter):
+        delta = np.nan_to_num(_median(residuals, axis=2)) * active
+        residuals -= delta
+        row += delta
+        delta = np.nan_to_num(_median(col, axis=2)) * active
+        col -= delta
+        overall += delta
+
+        delta = np.nan_to_num(_median(residuals, axis=1)) * active
+        residuals -= delta
+        col += delta
+        delta = np.nan_to_num(_median(row, axis=1)) * active
+        row -= delta
+        overall += delta
+
+        new_sum = np.nansum(np.abs(residuals), axis=(1, 2), keepdims=True)
+        active &= (new_sum != 0) & (np.abs(new_sum - old_sum) >= tol * new_sum)
+        old_sum = new_sum
+        if not active.any():
+            break
+
+    return overall, np.nan_to_num(row), np.nan_to_num(col), residuals
+
+
+def compute_position_effects(
+    adata: AnnData,
+    well_key: str = "infer",
+    batch_key: str = "infer",
+    layer: str | None = None,
+    max_iter: int = 10,
+    progress: bool = True,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Compute plate position effects
+
+    Estimates row and column effects within each plate, e.g. edge effects or gradients, with
+    Tukey's median polish of the median of each well, as used for B-scores [Malo06]_. Well IDs like "A01"
+    are parsed into rows and columns. All plates and features are polished at once.
+
+    Parameters
+    ----------
+    adata :class:`~anndata.AnnData`
+            Annotated data matrix of single cells or of wells, e.g. as returned by :func:`scmorph.pp.aggregate`
+
+    well_key : str
+            Name of column holding well IDs. Will try to guess if no argument is given. Default: "infer"
+
+    batch_key : str
+            Name of column used to delineate plates. Will try to guess if
+            no argument is given. Default: "infer"
+
+    layer : str | None
+            Layer holding the data, by default None (i.e. `X`)
+
+    max_iter : int
+            Maximum number of iterations of median polish, by default 10
+
+    progress: bool
+            Whether to show a progress bar, by default True
+
+    Returns
+    -------
+    effects : :class:`~pandas.DataFrame`
+        Sum of row and column effect of each feature (rows) in each plate and well (columns)
+
+    plate_effects : :class:`~pandas.DataFrame`
+        Overall effect of each feature (rows) in each plate (columns)
+
+    plate_mad : :class:`~pandas.DataFrame`
+        Scaled median absolute deviation of the residuals of each feature (rows) in each plate (columns)
+    """
+    if well_key == "infer":
+        well_key = _infer_names("well", adata.obs.columns)[0]
+    if batch_key == "infer":
+        batch_key = _infer_names("batch", adata.obs.columns)[0]
+
+    index = get_group_index(adata, [batch_key, well_key])
+    medians = grouped_op(adata, index, "median", layer=layer, progress=progress, skipna=True)
+    groups = index.key_frame()
+    plate_codes, plates = pd.factorize(groups[batch_key], sort=True)
+    rows, cols = _parse_wells(groups[well_key])
+
+    grid = np.full((len(plates), rows.max() + 1, cols.max() + 1, adata.n_vars), np.nan)
+    grid[plate_codes, rows, cols] = medians.T.to_numpy()
+    overall, row, col, residuals = _median_polish(grid, max_iter=max_iter)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # plates without values of a feature
+        center = np.nanmedian(residuals, axis=(1, 2))
+        mad = 1.4826 * np.nanmedian(np.abs(residuals - center[:, np.newaxis, np.newaxis]), axis=(1, 2))
+
+    effects = pd.DataFrame(
+        (row[plate_codes, rows, 0] + col[plate_codes, 0, cols]).T,
+        index=adata.var_names,
+        columns=pd.MultiIndex.from_frame(groups),
+    )
+    plate_effects = pd.DataFrame(overall[:, 0, 0].T, index=adata.var_names, columns=plates)
+    plate_mad = pd.DataFrame(mad.T, index=adata.var_names, columns=plates)
+    return effects, plate_effects, plate_mad
+
+
+def remove_position_effects(
+    adata: AnnData,
+    well_key: str = "infer",
+    batch_key: str = "infer",
+    bscore: bool = False,
+    layer: str | None = None,
+    copy: bool = False,
+    progress: bool = True,
+) -> None | AnnData:
+    """
+    Remove plate position effects
+
+    Subtracts the row and column effects estimated by :func:`compute_position_effects` from every
+    well, or from every cell by broadcasting the effects of its well. This works on well aggregates
+    and single cells alike, also for backed data.
+
+    Parameters
+    ----------
+    adata :class:`~anndata.AnnData`
+            Annotated data matrix of single cells or of wells
+
+    well_key : str
+            Name of column holding well IDs. Will try to guess if no argument is given. Default: "infer"
+
+    batch_key : str
+            Name of column used to delineate plates. Will try to guess if
+            no argument is given. Default: "infer"
+
+    bscore : bool
+            Whether to also subtract the overall effect of each plate and divide by the plate's scaled median
+            absolute deviation of residuals, i.e. compute B-scores [Malo06]_. Features without spread of residuals
+            on a plate are not scaled on that plate. Default: False
+
+    layer : str | None
+            Layer to correct, by default None (i.e. `X`)
+
+    copy : bool
+            If False, will perform operation in-place, else return a modified copy of the data.
+
+    progress: bool
+            Whether to show a progress bar, by default True
+
+    Returns
+    -------
+    adata : :class:`~anndata.AnnData`
+            Annotated data matrix with position effects removed. If `copy` is False, will modify in-place and not return anything.
+    """
+    if copy:
+        adata = adata.copy()
+    if well_key == "infer":
+        well_key = _infer_names("well", adata.obs.columns)[0]
+    if batch_key == "infer":
+        batch_key = _infer_names("batch", adata.obs.columns)[0]
+
+    effects, plate_effects, plate_mad = compute_position_effects(
+        adata, well_key=well_key, batch_key=batch_key, layer=layer, progress=progress
+    )
+    index = get_group_index(adata, [batch_key, well_key])
+    group_broadcast_inplace(adata, index, effects.to_numpy(), operation="subtract", layer=layer)
+    if bscore:
+        plates = get_group_index(adata, batch_key)
+        mad = plate_mad[plates.keys].to_numpy()
+        invalid = ~(np.isfinite(mad) & (mad > 0))
+        if invalid.any():
+            # constant features would otherwise become inf or NaN, leave them unscaled as in scaling by zero std
+            features = adata.var_names[invalid.any(axis=1)]
+            get_logger().warning(
+                "Residuals of some features have no spread on some plates, these are not scaled: "
+                + ", ".join(features[:5])
+                + (", ..." if len(features) > 5 else "")
+            )
+            mad[invalid] = 1
+        group_broadcast_inplace(adata, plates, plate_effects[plates.keys].to_numpy(), layer=layer)
+        group_broadcast_inplace(adata, plates, mad, operation="divide", layer=layer)
     if copy:
         return adata
+    return None
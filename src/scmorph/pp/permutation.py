@@ -0,0 +1,215 @@
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+from scmorph.pp import drop_na
+from scmorph.pp.aggregate import _pca_aggregate, _welch_ttest
+from scmorph.utils import (
+    _get_group_keys,
+    _grouped_obs_stream,
+    _process_pool,
+    get_covariance_factor,
+    get_grouped_op,
+)
+
+
+def _mahalanobis_stat(Z: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    """Mean distance of selected wells to the centroid of the other wells, on whitened profiles"""
+    k = selected[0].sum()
+    centroids = (1 - selected) @ Z / (Z.shape[0] - k)
+    sq_dists = np.sum(Z**2, axis=1) - 2 * centroids @ Z.T + np.sum(centroids**2, axis=1)[:, np.newaxis]
+    return (np.sqrt(np.maximum(sq_dists, 0)) * selected).sum(axis=1) / k
+
+
+def _centroid_stat(Z: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    """Distance between centroids of selected and other wells, on weighted PCs"""
+    k = selected[0].sum()
+    diff = selected @ Z / k - (1 - selected) @ Z / (Z.shape[0] - k)
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+
+def _tstat_stat(stats: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    """Norm of Welch t-statistics of cells in selected versus other wells, from per-well moments"""
+    n, mean, m2 = np.split(stats, 3, axis=1)
+
+    def _pool(weights: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        n_pool = weights @ n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_pool = weights @ (n * mean) / n_pool
+            var_pool = (weights @ m2 + weights @ (n * mean**2) - n_pool * mean_pool**2) / (n_pool - 1)
+        return n_pool, mean_pool, var_pool
+
+    tstat, _ = _welch_ttest(*_pool(1 - selected), *_pool(selected))
+    return np.sqrt(np.nansum(tstat**2, axis=1))
+
+
+_STATISTICS: dict[str, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    "mahalanobis": _mahalanobis_stat,
+    "pc": _centroid_stat,
+    "tstat": _tstat_stat,
+}
+
+
+def _permute(
+    method: str,
+    data: np.ndarray,
+    n_treated: int,
+    n_permutations: int,
+    seed: np.random.SeedSequence,
+    batch_size: int,
+) -> tuple[float, float]:
+    """
+    Observed statistic and empirical p-value of one treatment
+
+    `data` holds one row per well, control wells first and treated wells last.
+    Permutations are evaluated in batches of `batch_size` label assignments at once.
+    """
+    stat = _STATISTICS[method]
+    rng = np.random.default_rng(seed)
+    n_wells = data.shape[0]
+
+    observed_labels = np.zeros((1, n_wells))
+    observed_labels[0, n_wells - n_treated :] = 1
+    observed = stat(data, observed_labels)[0]
+
+    n_extreme = 0
+    for start in range(0, n_permutations, batch_size):
+        n_batch = min(batch_size, n_permutations - start)
+        treated = np.argsort(rng.random((n_batch, n_wells)), axis=1)[:, :n_treated]
+        labels = np.zeros((n_batch, n_wells))
+        np.put_along_axis(labels, treated, 1, axis=1)
+        n_extreme += np.sum(stat(data, labels) >= observed)
+
+    return observed, (n_extreme + 1) / (n_permutations + 1)
+
+
+def _permute_batch(method: str, tasks: list[tuple[np.ndarray, int, np.random.SeedSequence]], **kwargs: Any) -> list:
+    """Apply :func:`_permute` to several treatments, e.g. in a worker process"""
+    return [_permute(method, data, n_treated, seed=seed, **kwargs) for data, n_treated, seed in tasks]
+
+
+def permutation_test(
+    adata: AnnData,
+    treatment_key: str = "infer",
+    control: str = "DMSO",
+    well_key: str = "infer",
+    method: str = "mahalanobis",
+    n_permutations: int = 1000,
+    seed: int = 0,
+    batch_size: int = 1000,
+    n_cores: int = 1,
+    cum_var_explained: float = 0.9,
+    progress: bool = False,
+) -> pd.DataFrame:
+    """
+    Empirical significance of distances between treatments and control
+
+    For each treatment, well labels are shuffled between the treatment's and the control wells
+    and the distance is recomputed for every permutation. The proportion of permutations
+    with a distance at least as large as observed gives an empirical p-value, which is then
+    corrected for multiple testing across treatments.
+
+    Profiles are normalized once: the PCA, control covariance and its factorization are computed
+    on the observed data and held fixed across permutations, so that all permutations of a treatment
+    are evaluated as a few matrix products.
+
+    Parameters
+    ----------
+    adata :class:`~anndata.AnnData`
+        Annotated data matrix of single cells
+    treatment_key : str
+        Name of column in metadata used to define treatments
+    control : str
+        Name of control treatment. Must be valid value in `treatment_key`.
+    well_key : str
+        Name of column in metadata used to define wells, i.e. the units that are permuted
+    method : str
+        Distance to test, one of:
+
+        - "mahalanobis": mean Mahalanobis distance of treatment wells to the control centroid on PCs
+          of well-level profiles, as in :func:`scmorph.pp.aggregate_mahalanobis`
+        - "pc": distance between treatment and control centroids on PCs weighted by variance explained,
+          similar to :func:`scmorph.pp.aggregate_pc` but with well-level profiles
+        - "tstat": norm of Welch t-statistics of single cells, as in :func:`scmorph.pp.aggregate_ttest`
+          followed by :func:`scmorph.pp.tstat_distance`
+
+        By default "mahalanobis"
+    n_permutations : int
+        Number of permutations per treatment, by default 1000
+    seed : int
+        Seed of the random number generator. Results do not depend on `n_cores`. By default 0
+    batch_size : int
+        Number of permutations evaluated at once, by default 1000
+    n_cores : int
+        Number of processes to distribute treatments over. -1 for all cores. By default 1
+    cum_var_explained : float
+        Fraction of variance the PCs need to explain for "mahalanobis" and "pc", by default 0.9
+    progress : bool
+        Whether to show a progress bar, by default False
+
+    Returns
+    -------
+    :class:`~pandas.DataFrame`
+        Observed distance ("distance"), empirical p-value ("pvalue") and
+        FDR-corrected p-value ("qvalue") of each treatment
+    """
+    import os
+
+    from statsmodels.stats.multitest import fdrcorrection
+    from tqdm import tqdm
+
+    if method not in _STATISTICS:
+        raise ValueError(f"method must be one of {', '.join(_STATISTICS)}")
+
+    group_keys, treatment_col = _get_group_keys(adata, treatment_key, well_key)
+    treatment_col = treatment_col[0]
+
+    if method == "tstat":
+        index, stats = _grouped_obs_stream(adata, group_keys, progress=progress)
+        treatments = index.key_frame()[treatment_col].to_numpy()
+        is_control = treatments == control
+        with np.errstate(invalid="ignore", divide="ignore"):
+            center = np.nansum(stats["mean"][is_control] * stats["count"][is_control], axis=0) / np.sum(
+                stats["count"][is_control], axis=0
+            )
+        data = np.hstack([stats["count"], stats["mean"] - center, stats["m2"]])
+    else:
+        agg_adata = get_grouped_op(adata, group_keys, "median", progress=progress, as_anndata=True, store=False)
+        drop_na(agg_adata, feature_threshold=0, cell_threshold=1)
+        agg_adata, weights = _pca_aggregate(agg_adata, cum_var_explained)
+        treatments = agg_adata.obs[treatment_col].to_numpy()
+        is_control = treatments == control
+        X_pca = agg_adata.obsm["X_pca"].astype(np.float64)
+
+        if method == "pc":
+            data = X_pca * np.sqrt(weights)
+        elif X_pca.shape[1] > 1:
+            data = get_covariance_factor(np.cov(X_pca[is_control], rowvar=False)).whiten(X_pca)
+        else:
+            data = X_pca
+
+    names = pd.unique(treatments[~is_control])
+    seeds = np.random.SeedSequence(seed).spawn(len(names))
+    tasks = [
+        (np.vstack([data[is_control], data[treatments == name]]), np.sum(treatments == name), s)
+        for name, s in zip(names, seeds, strict=True)
+    ]
+    kwargs = {"n_permutations": n_permutations, "batch_size": batch_size}
+
+    n_cores = (os.cpu_count() or 1) if n_cores == -1 else n_cores
+    if n_cores == 1 or not tasks:
+        tasks = tqdm(tasks) if progress else tasks
+        results = [_permute(method, data, n_treated, seed=s, **kwargs) for data, n_treated, s in tasks]
+    else:
+        batches = np.array_split(np.arange(len(tasks)), min(len(tasks), n_cores * 4))
+        with _process_pool(n_cores) as pool:
+            futures = [pool.submit(_permute_batch, method, [tasks[i] for i in batch], **kwargs) for batch in batches]
+            futures = tqdm(futures) if progress else futures
+            results = [res for future in futures for res in future.result()]
+
+    res = pd.DataFrame(results, index=pd.Index(names, name=treatment_col), columns=["distance", "pvalue"])
+    res["qvalue"] = fdrcorrection(res["pvalue"])[1]
+    return res
@@ -3,6 +3,8 @@ import scanpy as sc
 from anndata import AnnData
 from scanpy._utils import AnyRandom
 
+from scmorph.utils import GroupIndex, get_group_index
+
 neighbors = sc.pp.neighbors
 neighbors.__doc__ = "| Copied from scanpy [Wolf18]_." + neighbors.__doc__
 umap = sc.tl.umap
@@ -77,7 +79,7 @@ def scale(adata: AnnData, chunked: bool = False) -> None:
         adata.X = np.apply_along_axis(scaler, 0, adata.X)
 
 
-def scale_by_batch(adata: AnnData, batch_key: str, chunked: bool = False) -> None:
+def scale_by_batch(adata: AnnData, batch_key: str | GroupIndex, chunked: bool = False) -> None:
     """
     Scale data to unit variance per batch
 
@@ -86,8 +88,9 @@ def scale_by_batch(adata: AnnData, batch_key: str, chunked: bool = False) -> Non
     adata :class:`~anndata.AnnData`
             Object as returned by :func:`scmorph.read_cellprofiler`. Represents AnnData object populated with data.
 
-    batch_key : str
-            Name of the column in the AnnData object that contains the batch information.
+    batch_key : str | GroupIndex
+            Name of the column in the AnnData object that contains the batch information,
+            or a prebuilt :class:`scmorph.utils.GroupIndex`.
 
     chunked : bool
             Whether to save memory by processing in chunks. This is slower but less memory intensive.
@@ -100,7 +103,7 @@ def scale_by_batch(adata: AnnData, batch_key: str, chunked: bool = False) -> Non
     -------
     Initial idea taken from https://github.com/scverse/scanpy/issues/2142#issuecomment-1041591406
     """
-    for _, idx in adata.obs.groupby(batch_key, observed=True).indices.items():
+    for _, idx in get_group_index(adata, batch_key).items():
         scale(adata[idx, :], chunked=chunked)
 
 
@@ -1,11 +1,63 @@
 import numpy as np
 import pandas as pd
-from formulaic import Formula
-from numpy.lib.stride_tricks import sliding_window_view
+from anndata import AnnData
+from numba import njit, prange
+
+from scmorph.utils import _getX, _grouped_obs_stream, _infer_names
+
+
+@njit(parallel=True, cache=True)
+def _running_median_kernel(X: np.ndarray, window: int) -> np.ndarray:
+    """
+    Medians of sliding windows over the columns of an edge-padded array
+
+    Each column is ranked once, and the counts of ranks in the current window are kept in a
+    Fenwick tree, so that the median is found by descending the tree, rather than sorting every window.
+    """
+    n, p = X.shape
+    n_windows = n - window + 1
+    out = np.empty((n_windows, p))
+    # largest power of two not exceeding n, to descend the tree
+    top = 1
+    while top * 2 <= n:
+        top *= 2
+
+    for j in prange(p):
+        order = np.argsort(X[:, j], kind="mergesort")
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        tree = np.zeros(n + 1, dtype=np.int64)
+
+        for i in range(n):
+            # add the entering value
+            k = rank[i] + 1
+            while k <= n:
+                tree[k] += 1
+                k += k & -k
+            if i >= window:
+                # remove the leaving value
+                k = rank[i - window] + 1
+                while k <= n:
+                    tree[k] -= 1
+                    k += k & -k
+            if i >= window - 1:
+                # find the (window // 2 + 1)-th smallest rank in the window
+                remaining = window // 2 + 1
+                pos = 0
+                step = top
+                while step > 0:
+                    nxt = pos + step
+                    if nxt <= n and tree[nxt] < remaining:
+                        pos = nxt
+                        remaining -= tree[nxt]
+                    step //= 2
+                out[i - window + 1, j] = X[order[pos], j]
+    return out
 
 
 def _running_median(x: np.ndarray, window: int = 3) -> np.ndarray:
     # follows R's runmed function with endrule="constant"
+    # medians are computed along the first axis, for each column of 2D input
     if window % 2 == 0:
         raise ValueError("Window must be odd")
     if window == 1:
@@ -13,9 +65,8 @@ def _running_median(x: np.ndarray, window: int = 3) -> np.ndarray:
 
     # Pad array to ensure len(m) = len(x)
     k2 = window // 2
-    xp = np.pad(x, (k2, k2), mode="edge")
-    w = sliding_window_view(xp, window)
-    m = np.median(w, axis=1)
+    xp = np.pad(np.asarray(x, dtype=np.float64), [(k2, k2)] + [(0, 0)] * (np.ndim(x) - 1), mode="edge")
+    m = _running_median_kernel(xp.reshape(xp.shape[0], -1), window).reshape(np.shape(x))
 
     # Emulate R's endrule="constant"
     # I.e. fill edges with the last correct medians
@@ -29,8 +80,21 @@ def _quantile(x: np.ndarray, q: np.ndarray, axis: int = 0) -> tuple[np.ndarray,
     # method = "inverted_cdf" to be consistent with qsmooth's implementation
     # this could be adapted by defaulting back to "linear" which
     # may give better interpolation
-    quant = np.quantile(x, q, axis=axis, method="inverted_cdf")
-    return q, quant
+    # sort once and pick all quantiles from the sorted values: the inverted CDF at q
+    # is the ceil(n * q)-th smallest value
+    q = np.asarray(q)
+    x = np.sort(x, axis=axis)
+    n = x.shape[axis]
+    idx = np.clip(np.ceil(n * q).astype(np.int64) - 1, 0, n - 1)
+    return q, np.take(x, idx, axis=axis)
+
+
+def _group_means(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Mean of `values` per group along the first axis, broadcast back to each member"""
+    sizes = np.bincount(codes)
+    sums = np.zeros((len(sizes),) + values.shape[1:])
+    np.add.at(sums, codes, values)
+    return (sums / sizes.reshape((-1,) + (1,) * (values.ndim - 1)))[codes]
 
 
 # 2. Quantile regression
@@ -41,10 +105,9 @@ def _quantile_regression(Z: pd.DataFrame | np.ndarray, q: np.ndarray, axis: int
     if not isinstance(q, np.ndarray):
         q = np.array(q)
     # Assumes Z is categorical
-    m = np.array(Formula("0 + C(Z)").get_model_matrix(Z))
-    mt = m.T
-    qbetas = (np.linalg.inv(mt @ m).T @ mt @ q.T).T
-    qhat = qbetas @ mt
+    # least squares on a one-hot design of Z are the means of each category
+    codes = pd.factorize(Z.iloc[:, 0])[0]
+    qhat = _group_means(q.T, codes).T
     qbar = np.mean(q.T, axis=axis)
     return qhat, qbar
 
@@ -62,8 +125,10 @@ def _weights(res: tuple[float, float, float], window: float = 0.05) -> np.ndarra
     SST, SSB, _ = res
 
     # Compute rough weights
-    roughWeights = 1 - SSB / SST
-    roughWeights = np.where(roughWeights < 1e-6, 1, roughWeights)
+    # quantiles that do not vary between samples (SST = 0) are not corrected
+    with np.errstate(invalid="ignore", divide="ignore"):
+        roughWeights = 1 - SSB / SST
+    roughWeights = np.where(~(roughWeights >= 1e-6), 1, roughWeights)
 
     # Compute smooth weights
     k = np.floor(window * len(roughWeights))  # type: ignore
@@ -76,7 +141,8 @@ def _weights(res: tuple[float, float, float], window: float = 0.05) -> np.ndarra
 
 # 5. Correct
 def _apply_correction(fbar: np.ndarray, fhat: np.ndarray, w: float) -> np.ndarray:
-    return (np.array(w * fbar + (1 - w)) * fhat.T).T
+    # weighted average of overall and group quantiles, as in qsmooth
+    return (np.array(w * fbar) + np.array(1 - w) * fhat.T).T
 
 
 # 6. Do all
@@ -122,3 +188,179 @@ def quantile_norm(
     res = _residuals(quantiles, qhat, qbar, axis=axis)
     w = _weights(res, window=window)
     return _apply_correction(qbar, qhat, w)
+
+
+def _qsmooth_targets(quantiles: np.ndarray, bio: np.ndarray, window: float) -> np.ndarray:
+    """
+    Normalized quantiles of shape (n_batches, n_quantiles, n_features) from quantiles of each batch
+
+    All features are normalized at once. Batches with missing quantiles of a feature are left out
+    of that feature's averages and their normalized quantiles are missing.
+    """
+    finite = np.isfinite(quantiles).all(axis=1, keepdims=True)
+    values = np.where(finite, quantiles, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        qbar = values.sum(axis=0) / finite.sum(axis=0)
+        qhat = _group_means(values, bio) / _group_means(finite.astype(np.float64), bio)
+    SST = np.sum(np.where(finite, values - qbar, 0) ** 2, axis=0)
+    SSB = np.sum(np.where(finite, qhat - qbar, 0) ** 2, axis=0)
+    w = _weights((SST, SSB, SST - SSB), window=window)
+    return np.where(finite, w * qbar + (1 - w) * qhat, np.nan)
+
+
+@njit(parallel=True, cache=True)
+def _remap_quantiles(X: np.ndarray, codes: np.ndarray, source: np.ndarray, target: np.ndarray) -> None:
+    """
+    Map values inplace from the quantiles of their batch onto the normalized quantiles
+
+    `source` and `target` have shape (n_batches, n_features, n_quantiles). Values between two
+    quantiles are interpolated linearly, values tied with several quantiles receive the mean of
+    their targets. Values outside the quantile range, of cells without batch and missing values
+    are clipped or left unchanged, respectively.
+    """
+    n_obs, n_features = X.shape
+    n_quantiles = source.shape[2]
+    # visit cells batch by batch, so that the quantiles of a batch stay in cache
+    order = np.argsort(codes, kind="mergesort")
+    for j in prange(n_features):
+        for i in order:
+            b = codes[i]
+            x = X[i, j]
+            if b < 0 or np.isnan(x) or np.isnan(source[b, j, 0]):
+                continue
+            # first quantile not smaller than x
+            lo, hi = 0, n_quantiles
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if source[b, j, mid] < x:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < n_quantiles and source[b, j, lo] == x:
+                # x is tied with quantiles lo, ..., hi - 1
+                hi = lo + 1
+                total = target[b, j, lo]
+                while hi < n_quantiles and source[b, j, hi] == x:
+                    total += target[b, j, hi]
+                    hi += 1
+                X[i, j] = total / (hi - lo)
+            elif lo == 0:
+                X[i, j] = target[b, j, 0]
+            elif lo == n_quantiles:
+                X[i, j] = target[b, j, n_quantiles - 1]
+            else:
+                x_lo, x_hi = source[b, j, lo - 1], source[b, j, lo]
+                frac = (x - x_lo) / (x_hi - x_lo)
+                X[i, j] = target[b, j, lo - 1] + frac * (target[b, j, lo] - target[b, j, lo - 1])
+
+
+def quantile_normalize(
+    adata: AnnData,
+    batch_key: str = "infer",
+    bio_key: str | None = None,
+    n_quantiles: int = 1000,
+    window: float = 0.05,
+    layer: str | None = None,
+    sketch_size: int = 2000,
+    chunk_size: int = 10000,
+    progress: bool = True,
+    copy: bool = False,
+) -> None | AnnData:
+    """
+    Quantile normalization of batches
+
+    Normalizes the distribution of every feature in each batch with smooth quantile
+    normalization (qsmooth, [Hicks18]_). If biological entities are given, quantiles are normalized
+    towards the average of the entity the batch belongs to, and only shrunk towards the overall
+    average where entities do not differ. Without `bio_key`, this is standard quantile normalization.
+
+    Quantiles of each batch and feature are estimated in one streamed pass with mergeable sketches
+    (see :class:`scmorph.utils.QuantileSketch`). Each cell is then mapped from the quantiles of its
+    batch onto the normalized quantiles in a second pass. Both passes read `chunk_size` cells at a time,
+    so this also works for backed data. Features are processed in parallel by compiled kernels.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        Annotated data matrix, may be backed
+    batch_key : str
+        Name of column used to delineate batches, e.g. plates. Will try to guess if
+        no argument is given. Default: "infer"
+    bio_key : str | None
+        Name of column used to delineate biological entities, e.g. cell lines. Every batch
+        must belong to a single entity. Default: None
+    n_quantiles : int
+        Number of evenly spaced quantiles to normalize, by default 1000
+    window : float
+        Width of the running median smoothing the qsmooth weights, as fraction of quantiles, by default 0.05
+    layer : str | None
+        Layer to normalize, by default None (i.e. `X`)
+    sketch_size : int
+        Accuracy parameter `k` of the quantile sketches. Quantiles are exact for batches of up to about
+        this many cells. By default 2000
+    chunk_size : int
+        Number of cells to read at once, by default 10000
+    progress : bool
+        Whether to show a progress bar, by default True
+    copy : bool
+        If False, will perform operation in-place, else return a modified copy of the data.
+
+    Returns
+    -------
+    adata : :class:`~anndata.AnnData`
+        Annotated data matrix with normalized batches. If `copy` is False, will modify in-place and not return anything.
+    """
+    if copy:
+        adata = adata.copy()
+    if batch_key == "infer":
+        batch_key = _infer_names("batch", adata.obs.columns)[0]
+
+    index, stats = _grouped_obs_stream(
+        adata,
+        batch_key,
+        layer=layer,
+        moments=False,
+        sketch_size=sketch_size,
+        chunk_size=chunk_size,
+        progress=progress,
+        skipna=True,
+    )
+    q = np.linspace(0, 1, n_quantiles)
+    # quantiles of shape (n_batches, n_quantiles, n_features)
+    source = np.stack([sketch.quantile(q, skipna=True) for sketch in stats["sketches"]])
+
+    if bio_key is None:
+        bio = np.zeros(len(index), dtype=np.int64)
+    else:
+        labels = adata.obs[[batch_key, bio_key]].drop_duplicates()
+        if labels[batch_key].duplicated().any():
+            raise ValueError(f"Every batch must belong to a single value of {bio_key}")
+        bio = pd.factorize(labels.set_index(batch_key)[bio_key].loc[index.keys])[0]
+
+    # (n_batches, n_features, n_quantiles) so that each feature's quantiles are contiguous
+    target = np.ascontiguousarray(_qsmooth_targets(source, bio, window).transpose(0, 2, 1))
+    source = np.ascontiguousarray(source.transpose(0, 2, 1))
+
+    X = _getX(adata, layer)
+    is_float = np.issubdtype(X.dtype, np.floating)
+    if adata.isbacked and not is_float:
+        raise ValueError(f"Cannot normalize backed data of type {X.dtype} in place, convert it to float first")
+    # normalized values are written back in place, which needs a float array owned by adata
+    in_memory = isinstance(X, np.ndarray) and not adata.is_view and is_float
+    if not (in_memory or adata.isbacked):
+        X = np.array(X, dtype=X.dtype if is_float else np.float64)
+    for start in range(0, adata.n_obs, chunk_size):
+        end = min(start + chunk_size, adata.n_obs)
+        # column-major, so that each thread reads contiguous values of its features
+        block = np.asfortranarray(X[start:end], dtype=np.float64)
+        _remap_quantiles(block, index.codes[start:end], source, target)
+        X[start:end] = block
+
+    if not (in_memory or adata.isbacked):
+        if layer is None:
+            adata.X = X
+        else:
+            adata.layers[layer] = X
+    if copy:
+        return adata
+    return None
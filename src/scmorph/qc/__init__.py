@@ -1,3 +1,4 @@
 from .cells import calculate_qc_metrics
 from .images import qc_images, read_image_qc
+from .mixing import batch_mixing
 from .outliers import filter_outliers
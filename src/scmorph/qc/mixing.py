@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+from scmorph.utils import _getX, _infer_names
+
+
+def _sample_embedding(
+    adata: AnnData, cells: np.ndarray, layer: str | None, use_rep: str | None, n_comps: int, seed: int
+) -> np.ndarray:
+    """Principal components of standardized features, or an existing embedding, of the sampled cells"""
+    if use_rep is not None:
+        return np.asarray(adata.obsm[use_rep][cells], dtype=np.float32)
+
+    from sklearn.decomposition import PCA
+
+    X = np.asarray(_getX(adata, layer)[cells], dtype=np.float64)
+    X = X[:, np.all(np.isfinite(X), axis=0)]
+    std = X.std(axis=0)
+    X = (X[:, std > 0] - X[:, std > 0].mean(axis=0)) / std[std > 0]
+    n_comps = min(n_comps, *X.shape)
+    return PCA(n_components=n_comps, random_state=seed).fit_transform(X).astype(np.float32)
+
+
+def _knn_graph(X: np.ndarray, n_neighbors: int, approximate: bool, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indices and distances of the `n_neighbors` nearest other cells of each cell"""
+    if approximate:
+        from pynndescent import NNDescent
+
+        indices, distances = NNDescent(X, n_neighbors=n_neighbors + 1, random_state=seed).neighbor_graph
+    else:
+        from sklearn.neighbors import NearestNeighbors
+
+        distances, indices = NearestNeighbors(n_neighbors=n_neighbors + 1).fit(X).kneighbors(X)
+
+    # drop each cell itself, which is not always found first among duplicates
+    is_self = indices == np.arange(len(X))[:, np.newaxis]
+    is_self[~is_self.any(axis=1), -1] = True
+    keep = ~is_self
+    return indices[keep].reshape(len(X), -1), distances[keep].reshape(len(X), -1)
+
+
+def _neighbor_counts(labels: np.ndarray, n_labels: int) -> np.ndarray:
+    """Number of neighbors of each cell per label, from the labels of its neighbors"""
+    rows = np.repeat(np.arange(len(labels)), labels.shape[1])
+    return np.bincount(rows * n_labels + labels.ravel(), minlength=len(labels) * n_labels).reshape(-1, n_labels)
+
+
+def _kbet_acceptance(neighbor_labels: np.ndarray, codes: np.ndarray, alpha: float) -> float:
+    """
+    Fraction of cells whose neighborhoods have the global batch composition
+
+    Tests the batch counts among the neighbors of every cell against the batch frequencies of all cells
+    with Pearson's chi-squared test, as in kBET [Buttner19]_.
+    """
+    from scipy.stats import chi2
+
+    n_batches = codes.max() + 1
+    if n_batches < 2:
+        return np.nan
+    expected = np.bincount(codes, minlength=n_batches) / len(codes) * neighbor_labels.shape[1]
+    observed = _neighbor_counts(neighbor_labels, n_batches)
+    stat = np.sum((observed - expected) ** 2 / expected, axis=1)
+    return float(np.mean(chi2.sf(stat, n_batches - 1) >= alpha))
+
+
+def _neighbor_weights(distances: np.ndarray, perplexity: float, n_steps: int = 50) -> np.ndarray:
+    """
+    Gaussian weights of neighbors with an entropy of log(`perplexity`) per cell
+
+    The precision of each cell's kernel is found by bisection, for all cells at once.
+    """
+    target = np.log(perplexity)
+    distances = distances - distances[:, :1]  # for numerical stability, does not change weights
+    beta = np.ones((len(distances), 1))
+    low, high = np.zeros_like(beta), np.full_like(beta, np.inf)
+    for _ in range(n_steps):
+        weights = np.exp(-distances * beta)
+        total = weights.sum(axis=1, keepdims=True)
+        entropy = np.log(total) + beta * np.sum(distances * weights, axis=1, keepdims=True) / total
+        too_flat = entropy > target
+        low = np.where(too_flat, beta, low)
+        high = np.where(too_flat, high, beta)
+        beta = np.where(np.isinf(high), beta * 2, (low + high) / 2)
+    weights = np.exp(-distances * beta)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def _lisi(neighbor_labels: np.ndarray, weights: np.ndarray, n_labels: int) -> np.ndarray:
+    """Local inverse Simpson's index of each cell [Korsunsky19]_"""
+    rows = np.repeat(np.arange(len(weights)), weights.shape[1])
+    probs = np.bincount(
+        rows * n_labels + neighbor_labels.ravel(), weights=weights.ravel(), minlength=len(weights) * n_labels
+    ).reshape(-1, n_labels)
+    return 1 / np.sum(probs**2, axis=1)
+
+
+def _simplified_silhouette(X: np.ndarray, codes: np.ndarray) -> float:
+    """
+    Mean silhouette width computed with distances to group centroids rather than to all cells
+
+    This needs one distance per cell and group instead of all pairwise distances.
+    """
+    n_groups = codes.max() + 1
+    if n_groups < 2:
+        return np.nan
+    centroids = np.stack([X[codes == g].mean(axis=0) for g in range(n_groups)])
+    sq_dists = np.sum(X**2, axis=1)[:, np.newaxis] - 2 * X @ centroids.T + np.sum(centroids**2, axis=1)
+    dists = np.sqrt(np.maximum(sq_dists, 0))
+    own = dists[np.arange(len(X)), codes]
+    dists[np.arange(len(X)), codes] = np.inf
+    other = dists.min(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        width = (other - own) / np.maximum(own, other)
+    return float(np.nanmean(width))
+
+
+def batch_mixing(
+    adata: AnnData | dict[str, AnnData],
+    batch_key: str = "infer",
+    bio_key: str | None = None,
+    n_cells: int = 50000,
+    n_neighbors: int = 90,
+    perplexity: float = 30,
+    alpha: float = 0.05,
+    layer: str | None = None,
+    use_rep: str | None = None,
+    n_comps: int = 50,
+    approximate: bool | None = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Diagnose how well batches mix, e.g. before and after batch effect removal
+
+    Samples cells, embeds them into principal components and builds one k-nearest-neighbor graph,
+    from which all mixing metrics are computed:
+
+    - "kbet_acceptance": fraction of cells whose neighbors have the same batch composition as all cells,
+      as in kBET [Buttner19]_. Higher is better mixed.
+    - "ilisi_batch" and "clisi_bio": median local inverse Simpson's index [Korsunsky19]_ of batches and
+      biological labels among the neighbors, i.e. the effective number of labels in a neighborhood.
+      Higher "ilisi_batch" means better mixed batches, "clisi_bio" close to 1 means preserved biology.
+    - "silhouette_batch" and "silhouette_bio": mean simplified silhouette width, using distances to
+      centroids, of batches and biological labels. Close to 0 or below for batches means well mixed,
+      positive for biology means preserved.
+
+    Passing several datasets, e.g. ``{"before": adata, "after": corrected}``, gives a before/after report.
+    Datasets with the same number of cells are evaluated on the same sampled cells.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData` | dict[str, :class:`~anndata.AnnData`]
+        Single-cell data, or several versions of it named by their keys
+    batch_key : str
+        Name of column used to delineate batches. Will try to guess if
+        no argument is given. Default: "infer"
+    bio_key : str | None
+        Name of column holding biological labels, e.g. treatments or cell types. If None,
+        biological metrics are missing. Default: None
+    n_cells : int
+        Number of cells to sample, by default 50000
+    n_neighbors : int
+        Number of neighbors of each cell, by default 90
+    perplexity : float
+        Perplexity of the neighbor weights of LISI, at most `n_neighbors`, by default 30
+    alpha : float
+        Significance level of the kBET tests, by default 0.05
+    layer : str | None
+        Layer holding the data, by default None (i.e. `X`)
+    use_rep : str | None
+        Embedding in `obsm` to use instead of computing principal components, by default None
+    n_comps : int
+        Number of principal components of standardized features to compute, by default 50
+    approximate : bool | None
+        Whether to build the neighbor graph approximately with pynndescent
+        rather than exactly. If None, approximate if more than 100000 cells are sampled. By default None
+    seed : int
+        Seed of the random number generator for sampling and embedding, by default 0
+
+    Returns
+    -------
+    :class:`~pandas.DataFrame`
+        Mixing metrics (columns) of each dataset (rows)
+    """
+    datasets = adata if isinstance(adata, dict) else {"data": adata}
+    if perplexity > n_neighbors:
+        raise ValueError("perplexity must be at most n_neighbors")
+
+    res = {}
+    for name, data in datasets.items():
+        key = _infer_names("batch", data.obs.columns)[0] if batch_key == "infer" else batch_key
+        rng = np.random.default_rng(seed)
+        cells = np.sort(rng.choice(data.n_obs, min(n_cells, data.n_obs), replace=False))
+
+        X = _sample_embedding(data, cells, layer, use_rep, n_comps, seed)
+        use_approximate = len(cells) > 100000 if approximate is None else approximate
+        indices, distances = _knn_graph(X, min(n_neighbors, len(cells) - 1), use_approximate, seed)
+        weights = _neighbor_weights(distances, perplexity)
+
+        metrics = {}
+        labels = {"batch": data.obs[key].to_numpy()[cells]}
+        if bio_key is not None:
+            labels["bio"] = data.obs[bio_key].to_numpy()[cells]
+        for kind, values in labels.items():
+            codes, uniques = pd.factorize(values)
+            if (codes < 0).any():
+                raise ValueError(f"Missing values in {key if kind == 'batch' else bio_key}")
+            if kind == "batch":
+                metrics["kbet_acceptance"] = _kbet_acceptance(codes[indices], codes, alpha)
+            lisi = np.median(_lisi(codes[indices], weights, len(uniques)))
+            metrics["ilisi_batch" if kind == "batch" else "clisi_bio"] = lisi
+            metrics[f"silhouette_{kind}"] = _simplified_silhouette(X, codes)
+        res[name] = metrics
+
+    columns = ["kbet_acceptance", "ilisi_batch", "clisi_bio", "silhouette_batch", "silhouette_bio"]
+    return pd.DataFrame.from_dict(res, orient="index").reindex(columns=columns)
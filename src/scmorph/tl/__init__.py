@@ -1,5 +1,9 @@
 import scanpy as sc
 
+from .dose_response import fit_dose_response
+from .linear_model import linear_model
+from .replicates import mean_average_precision, percent_replicating
+from .similarity import ProfileIndex, similarity_neighbors
 from .trajectories import (
     slingshot,
     test_common_trajectory,
@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+
+def _hill(log_dose: np.ndarray, params: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Four-parameter Hill curves and their Jacobian
+
+    `log_dose` has shape (n_curves, n_points) and `params` shape (n_curves, 4), holding
+    bottom, top, log10 EC50 and Hill slope of each curve.
+    """
+    from scipy.special import expit
+
+    bottom, top, log_ec50, slope = (params[:, i, np.newaxis] for i in range(4))
+    # fraction of the maximum effect, 1 / (1 + 10^((log_ec50 - log_dose) * slope))
+    frac = expit((log_dose - log_ec50) * slope * np.log(10))
+    dfrac = (top - bottom) * frac * (1 - frac) * np.log(10)
+    jac = np.stack([1 - frac, frac, -dfrac * slope, dfrac * (log_dose - log_ec50)], axis=-1)
+    return bottom + (top - bottom) * frac, jac
+
+
+def _levenberg_marquardt(
+    log_dose: np.ndarray, y: np.ndarray, weights: np.ndarray, params: np.ndarray, max_iter: int, tol: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Least-squares fit of many Hill curves at once
+
+    All curves take a damped Gauss-Newton step per iteration, solved as a batch of 4 × 4 systems.
+    Each curve keeps its own damping and stops updating once its residual sum of squares or its
+    parameters converge, or once no step improves the fit even with very strong damping. The
+    latter curves are not converged.
+    Points with zero weight, e.g. padding or missing values, do not contribute to the fit.
+    """
+    params = params.copy()
+    model, _ = _hill(log_dose, params)
+    rss = np.sum(weights * (y - model) ** 2, axis=1)
+    damping = np.full(len(params), 1e-3)
+    converged = np.zeros(len(params), dtype=bool)
+    failed = np.zeros(len(params), dtype=bool)
+
+    for _ in range(max_iter):
+        active = np.flatnonzero(~(converged | failed))
+        if len(active) == 0:
+            break
+        x, w, p = log_dose[active], weights[active], params[active]
+        model, jac = _hill(x, p)
+        jtj = np.einsum("cni,cn,cnj->cij", jac, w, jac)
+        grad = np.einsum("cni,cn->ci", jac, w * (y[active] - model))
+
+        # Marquardt scaling by the diagonal, bounded away from zero for flat curves
+        diag = np.diagonal(jtj, axis1=1, axis2=2)
+        diag = np.maximum(diag, 1e-12 * np.maximum(diag.max(axis=1, keepdims=True), 1e-12))
+        lhs = jtj + damping[active, np.newaxis, np.newaxis] * np.einsum("ci,ij->cij", diag, np.eye(4))
+        step = np.linalg.solve(lhs, grad[..., np.newaxis])[..., 0]
+
+        candidate = p + step
+        new_model, _ = _hill(x, candidate)
+        new_rss = np.sum(w * (y[active] - new_model) ** 2, axis=1)
+        improved = np.isfinite(new_rss) & (new_rss <= rss[active])
+
+        small_step = np.linalg.norm(step, axis=1) <= tol * (np.linalg.norm(p, axis=1) + tol)
+        done = improved & ((rss[active] - new_rss <= tol * rss[active]) | small_step)
+        params[active[improved]] = candidate[improved]
+        rss[active[improved]] = new_rss[improved]
+        damping[active] = np.where(improved, damping[active] / 10, damping[active] * 10)
+        converged[active[done]] = True
+        # curves that no longer improve however strongly damped are given up, without converging
+        failed[active[~done & (damping[active] > 1e10)]] = True
+
+    return params, rss, converged
+
+
+def fit_dose_response(
+    data: AnnData | pd.DataFrame | pd.Series,
+    compound_key: str,
+    dose_key: str,
+    layer: str | None = None,
+    max_iter: int = 200,
+    tol: float = 1.49012e-8,
+    batch_size: int = 100000,
+) -> dict[str, pd.DataFrame]:
+    """
+    Fit Hill curves of every compound and feature at once
+
+    Fits the four-parameter log-logistic model
+
+    ``response = bottom + (top - bottom) / (1 + (EC50 / dose) ^ hill_slope)``
+
+    to the dilution series of every compound, for every feature or distance.
+    All curves are fitted together by a vectorized Levenberg-Marquardt algorithm
+    rather than one call of :func:`scipy.optimize.curve_fit` per curve.
+
+    Parameters
+    ----------
+    data : :class:`~anndata.AnnData` | :class:`~pandas.DataFrame` | :class:`~pandas.Series`
+        Responses, one row per well or treatment. Either profiles, e.g. as returned by
+        :func:`scmorph.pp.aggregate` with compound and dose in `obs`, or distances,
+        e.g. as returned by :func:`scmorph.pp.aggregate_mahalanobis`, with compound and dose
+        as index levels or columns. Numeric columns of a DataFrame other than the
+        compound and dose are fitted as separate responses.
+    compound_key : str
+        Column or index level holding the compound of each row
+    dose_key : str
+        Column or index level holding the dose of each row. Rows with non-positive or missing
+        doses, e.g. vehicle controls, are ignored.
+    layer : str | None
+        Layer holding the profiles if `data` is an AnnData, by default None (i.e. `X`)
+    max_iter : int
+        Maximum number of iterations, by default 200
+    tol : float
+        Relative decrease of the residual sum of squares or relative change of the parameters
+        at which a fit has converged, by default 1.49012e-8 as in :func:`scipy.optimize.curve_fit`
+    batch_size : int
+        Number of curves fitted at once, by default 100000
+
+    Returns
+    -------
+    dict[str, :class:`~pandas.DataFrame`]
+        Response without compound ("bottom"), maximum effect ("top"), EC50 in units of dose ("ec50"),
+        Hill slope ("hill_slope"), coefficient of determination ("r2") and whether the fit converged
+        ("converged"), each with one row per compound and one column per feature. Curves of compounds
+        with fewer than four distinct doses are not fitted and missing.
+    """
+    if isinstance(data, AnnData):
+        X = data.X if layer is None else data.layers[layer]
+        responses = pd.DataFrame(np.asarray(X), columns=data.var_names)
+        meta = data.obs[[compound_key, dose_key]].reset_index(drop=True)
+    else:
+        frame = data.to_frame() if isinstance(data, pd.Series) else data
+        levels = [name for name in frame.index.names if name in (compound_key, dose_key)]
+        frame = frame.reset_index(level=levels) if levels else frame
+        meta = frame[[compound_key, dose_key]].reset_index(drop=True)
+        responses = frame.drop(columns=[compound_key, dose_key]).select_dtypes("number").reset_index(drop=True)
+
+    dose = pd.to_numeric(meta[dose_key], errors="coerce").to_numpy(dtype=np.float64)
+    valid = np.isfinite(dose) & (dose > 0)
+    codes, compounds = pd.factorize(meta[compound_key].to_numpy()[valid], sort=True)
+    log_dose = np.log10(dose[valid])
+    Y = responses.to_numpy(dtype=np.float64)[valid]
+    n_compounds, n_features = len(compounds), Y.shape[1]
+
+    # pad the dilution series of all compounds to the same length
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes, minlength=n_compounds)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    position = np.arange(len(order)) - np.repeat(starts, sizes)
+    n_points = sizes.max(initial=0)
+    x_pad = np.zeros((n_compounds, n_points))
+    x_pad[codes[order], position] = log_dose[order]
+    y_pad = np.zeros((n_compounds, n_features, n_points))
+    y_pad[codes[order], :, position] = Y[order]
+    w_pad = np.zeros_like(y_pad)
+    w_pad[codes[order], :, position] = np.isfinite(Y[order])
+    y_pad[w_pad == 0] = 0
+
+    n_doses = np.array([len(np.unique(log_dose[codes == c])) for c in range(n_compounds)])
+    x_curves = np.repeat(x_pad, n_features, axis=0)
+    y_curves = y_pad.reshape(-1, n_points)
+    w_curves = w_pad.reshape(-1, n_points)
+    fitted = np.repeat(n_doses >= 4, n_features) & (w_curves.sum(axis=1) >= 4)
+
+    params = np.full((len(y_curves), 4), np.nan)
+    r2 = np.full(len(y_curves), np.nan)
+    converged = np.zeros(len(y_curves), dtype=bool)
+    curves = np.flatnonzero(fitted)
+    for start in range(0, len(curves), batch_size):
+        batch = curves[start : start + batch_size]
+        x, y, w = x_curves[batch], y_curves[batch], w_curves[batch]
+        x_valid = np.where(w > 0, x, np.nan)
+        low = x_valid == np.nanmin(x_valid, axis=1, keepdims=True)
+        high = x_valid == np.nanmax(x_valid, axis=1, keepdims=True)
+
+        # start from the responses at the lowest and highest dose and the midpoint of the dose range
+        init = np.column_stack(
+            [
+                np.sum(y * low, axis=1) / low.sum(axis=1),
+                np.sum(y * high, axis=1) / high.sum(axis=1),
+                (np.nanmin(x_valid, axis=1) + np.nanmax(x_valid, axis=1)) / 2,
+                np.ones(len(batch)),
+            ]
+        )
+        params[batch], rss, converged[batch] = _levenberg_marquardt(x, y, w, init, max_iter, tol)
+        mean = np.sum(w * y, axis=1) / w.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r2[batch] = 1 - rss / np.sum(w * (y - mean[:, np.newaxis]) ** 2, axis=1)
+
+    index = pd.Index(compounds, name=compound_key)
+
+    def _frame(values: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(values.reshape(n_compounds, n_features), index=index, columns=responses.columns)
+
+    with np.errstate(over="ignore"):
+        ec50 = 10 ** params[:, 2]
+    return {
+        "bottom": _frame(params[:, 0]),
+        "top": _frame(params[:, 1]),
+        "ec50": _frame(ec50),
+        "hill_slope": _frame(params[:, 3]),
+        "r2": _frame(r2),
+        "converged": _frame(converged),
+    }
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+from scmorph.logging import get_logger
+from scmorph.utils import get_group_index
+
+
+def linear_model(
+    adata: AnnData,
+    formula: str,
+    group_key: str | list[str] | None = None,
+    layer: str | None = None,
+) -> dict[str, pd.DataFrame]:
+    """
+    Fit a linear model of well-level profiles for all features at once
+
+    Builds one design matrix from `formula` and the metadata in `obs` and fits every
+    feature by least squares with a single QR decomposition, e.g. to estimate effects
+    of dose, time and cell line jointly rather than comparing each treatment to control.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        Well-level profiles, e.g. as returned by :func:`scmorph.pp.aggregate`
+    formula : str
+        Right-hand side of the model in Wilkinson notation, e.g. ``"C(TARGETGENE) + np.log(dose)"``.
+        See :doc:`formulaic <formulaic:index>`. Wells with missing covariates are dropped.
+    group_key : str | list[str] | None
+        Column(s) in `obs` defining groups of correlated wells, e.g. plates. If given, standard errors are
+        cluster-robust by group (CR1 sandwich estimator) and t-tests use one degree of freedom fewer than the
+        number of groups. This accounts for random group effects without fitting a mixed model per feature.
+        Wells with missing groups are dropped. By default None (independent wells)
+    layer : str | None
+        Layer holding the profiles, by default None (i.e. `X`)
+
+    Returns
+    -------
+    dict[str, :class:`~pandas.DataFrame`]
+        Coefficients ("coef"), standard errors ("se"), t-statistics ("tstat"), p-values ("pvalue") and
+        q-values ("qvalue", FDR-corrected across features per term), each with one row per feature
+        and one column per term of the design
+    """
+    from formulaic import Formula
+    from scipy.stats import t
+    from statsmodels.stats.multitest import fdrcorrection
+
+    design = Formula(formula).get_model_matrix(adata.obs)
+    rows = adata.obs_names.get_indexer(design.index)
+    if group_key is not None:
+        grouped = get_group_index(adata, group_key).codes[rows] >= 0
+        if not grouped.all():
+            get_logger().warning(f"Dropping {np.sum(~grouped)} wells with missing {group_key}")
+            design, rows = design.iloc[grouped], rows[grouped]
+    D = np.asarray(design, dtype=np.float64)
+    X = adata.X if layer is None else adata.layers[layer]
+    Y = np.asarray(X, dtype=np.float64)[rows]
+    n, k = D.shape
+
+    Q, R = np.linalg.qr(D)
+    diag = np.abs(np.diag(R))
+    if diag.min() <= diag.max() * max(n, k) * np.finfo(np.float64).eps:
+        raise ValueError("Design matrix is rank deficient, check the formula for collinear terms")
+
+    coef = np.linalg.solve(R, Q.T @ Y)
+    residuals = Y - D @ coef
+    R_inv = np.linalg.inv(R)
+
+    if group_key is None:
+        dof = n - k
+        sigma_sq = np.sum(residuals**2, axis=0) / dof
+        se = np.sqrt(np.sum(R_inv**2, axis=1)[:, np.newaxis] * sigma_sq)
+    else:
+        index = get_group_index(adata, group_key).subset(rows)
+        n_groups = len(index)
+        dof = n_groups - 1
+        starts = index.bounds[:-1]
+        # influence of each well on each coefficient, summed per group
+        influence = (D @ R_inv @ R_inv.T)[index.order]
+        residuals_sorted = residuals[index.order]
+        variance = np.empty((k, Y.shape[1]))
+        for term in range(k):
+            scores = np.add.reduceat(influence[:, term, np.newaxis] * residuals_sorted, starts, axis=0)
+            variance[term] = np.sum(scores**2, axis=0)
+        variance *= n_groups / (n_groups - 1) * (n - 1) / (n - k)
+        se = np.sqrt(variance)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tstat = coef / se
+    pval = 2 * t.sf(np.abs(tstat), dof)
+    qval = np.full_like(pval, np.nan)
+    for term in range(k):
+        finite = np.isfinite(pval[term])
+        if finite.any():
+            qval[term, finite] = fdrcorrection(pval[term, finite])[1]
+
+    terms = list(design.columns)
+    return {
+        name: pd.DataFrame(values.T, index=adata.var_names, columns=terms)
+        for name, values in zip(["coef", "se", "tstat", "pvalue", "qvalue"], [coef, se, tstat, pval, qval], strict=True)
+    }
@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+from scmorph.tl.similarity import _normalize_profiles
+from scmorph.utils import get_group_index
+
+
+def _average_precision(ranked_positive: np.ndarray) -> np.ndarray:
+    """Average precision of each row of a boolean matrix of positives ordered by decreasing similarity"""
+    hits = np.cumsum(ranked_positive, axis=1)
+    precision = hits / np.arange(1, ranked_positive.shape[1] + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sum(precision * ranked_positive, axis=1) / hits[:, -1]
+
+
+def _null_average_precision(
+    n_positive: int, n_total: int, size: tuple[int, ...], rng: np.random.Generator
+) -> np.ndarray:
+    """Average precisions of `n_positive` positives placed at random among `n_total` ranks"""
+    n = int(np.prod(size))
+    res = np.empty(n)
+    # ranks of positives are the positions of the smallest random keys, sampled in chunks to bound memory
+    chunk_size = max(1, 2**22 // n_total)
+    for start in range(0, n, chunk_size):
+        keys = rng.random((min(chunk_size, n - start), n_total))
+        ranks = np.sort(np.argpartition(keys, n_positive - 1, axis=1)[:, :n_positive], axis=1) + 1
+        res[start : start + chunk_size] = np.mean(np.arange(1, n_positive + 1) / ranks, axis=1)
+    return res.reshape(size)
+
+
+def _query_block(profiles: np.ndarray, codes: np.ndarray, start: int, end: int, queries: np.ndarray) -> np.ndarray:
+    """Average precision of queries `queries[start:end]` against all other profiles"""
+    rows = queries[start:end]
+    sims = profiles[rows] @ profiles.T
+    sims[np.arange(len(rows)), rows] = -np.inf
+    order = np.argsort(-sims, axis=1, kind="stable")[:, :-1]  # drop self, which is ranked last
+    return _average_precision(codes[order] == codes[rows, np.newaxis])
+
+
+def mean_average_precision(
+    adata: AnnData,
+    group_key: str | list[str],
+    metric: str = "cosine",
+    layer: str | None = None,
+    n_null: int = 1000,
+    seed: int = 0,
+    block_size: int = 1024,
+    n_cores: int = 1,
+) -> pd.DataFrame:
+    """
+    Retrieval of replicates by profile similarity, measured by mean average precision (mAP)
+
+    Every profile with at least one replicate is used as a query. All other profiles are ranked by
+    similarity to it and the average precision of retrieving its replicates is computed.
+    Average precisions are averaged per group and compared to a null distribution of groups of the
+    same size whose replicates are ranked at random.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        Well-level profiles, e.g. as returned by :func:`scmorph.pp.aggregate`
+    group_key : str | list[str]
+        Column(s) in `obs` defining replicates, e.g. the treatment
+    metric : str
+        Similarity, one of "cosine" or "pearson", by default "cosine"
+    layer : str | None
+        Layer holding the profiles, by default None (i.e. `X`)
+    n_null : int
+        Number of samples of the null distribution, by default 1000
+    seed : int
+        Seed of the random number generator for the null distribution, by default 0
+    block_size : int
+        Number of queries ranked at once, by default 1024
+    n_cores : int
+        Number of threads to rank blocks of queries with. -1 for all cores. By default 1
+
+    Returns
+    -------
+    :class:`~pandas.DataFrame`
+        Per group, number of replicates ("n_replicates"), mean average precision ("mean_average_precision"),
+        empirical p-value ("pvalue") and FDR-corrected p-value ("qvalue")
+    """
+    import os
+
+    from statsmodels.stats.multitest import fdrcorrection
+
+    X = adata.X if layer is None else adata.layers[layer]
+    profiles = _normalize_profiles(np.asarray(X), metric)
+    index = get_group_index(adata, group_key)
+    sizes = index.sizes
+    queries = index.order[np.repeat(sizes, sizes) > 1]
+
+    starts = range(0, len(queries), block_size)
+    n_cores = (os.cpu_count() or 1) if n_cores == -1 else n_cores
+    if n_cores == 1:
+        blocks = [_query_block(profiles, index.codes, s, s + block_size, queries) for s in starts]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=n_cores) as pool:
+            blocks = list(pool.map(lambda s: _query_block(profiles, index.codes, s, s + block_size, queries), starts))
+    average_precision = np.concatenate(blocks) if blocks else np.empty(0)
+
+    groups = index.codes[queries]
+    res = pd.DataFrame(
+        {"n_replicates": sizes, "mean_average_precision": np.nan, "pvalue": np.nan},
+        index=pd.Index(index.keys) if len(index.group_key) == 1 else pd.MultiIndex.from_tuples(index.keys),
+    )
+    res.index.names = index.group_key
+    res.iloc[:, 1] = pd.Series(average_precision).groupby(groups).mean().reindex(range(len(res))).to_numpy()
+
+    # null distribution of mAP depends only on group size
+    rng = np.random.default_rng(seed)
+    for size in np.unique(sizes[sizes > 1]):
+        null = _null_average_precision(size - 1, adata.n_obs - 1, (n_null, size), rng).mean(axis=1)
+        is_size = sizes == size
+        observed = res.loc[is_size, "mean_average_precision"].to_numpy()
+        res.loc[is_size, "pvalue"] = (1 + np.sum(null >= observed[:, np.newaxis], axis=1)) / (1 + n_null)
+
+    tested = res["pvalue"].notna()
+    res["qvalue"] = np.nan
+    res.loc[tested, "qvalue"] = fdrcorrection(res.loc[tested, "pvalue"])[1]
+    return res
+
+
+def percent_replicating(
+    adata: AnnData,
+    group_key: str | list[str],
+    metric: str = "pearson",
+    layer: str | None = None,
+    n_null: int = 1000,
+    percentile: float = 95,
+    seed: int = 0,
+) -> tuple[float, pd.DataFrame]:
+    """
+    Fraction of groups whose replicates are more similar than random profiles
+
+    The replicate similarity of a group is the median pairwise similarity of its profiles.
+    The null distribution is the median pairwise similarity of equally sized sets of
+    profiles, each drawn from a different group. A group is replicating if its similarity
+    exceeds the `percentile` of this null distribution.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        Well-level profiles, e.g. as returned by :func:`scmorph.pp.aggregate`
+    group_key : str | list[str]
+        Column(s) in `obs` defining replicates, e.g. the treatment
+    metric : str
+        Similarity, one of "cosine" or "pearson", by default "pearson"
+    layer : str | None
+        Layer holding the profiles, by default None (i.e. `X`)
+    n_null : int
+        Number of random sets of profiles per group size, by default 1000
+    percentile : float
+        Percentile of the null distribution a group has to exceed, by default 95
+    seed : int
+        Seed of the random number generator for the null distribution, by default 0
+
+    Returns
+    -------
+    tuple[float, :class:`~pandas.DataFrame`]
+        Percent replicating and, per group, the replicate similarity ("similarity"), the null
+        threshold ("threshold") and whether the group is replicating ("replicating")
+    """
+    X = adata.X if layer is None else adata.layers[layer]
+    profiles = _normalize_profiles(np.asarray(X), metric)
+    index = get_group_index(adata, group_key)
+    sizes = index.sizes
+    rng = np.random.default_rng(seed)
+
+    def _median_similarity(members: np.ndarray) -> np.ndarray:
+        # members: (n_sets, size) positions of profiles
+        P = profiles[members]
+        sims = np.einsum("nip,njp->nij", P, P)
+        upper = np.triu_indices(members.shape[1], k=1)
+        return np.median(sims[:, upper[0], upper[1]], axis=1)
+
+    res = pd.DataFrame(
+        {"similarity": np.nan, "threshold": np.nan},
+        index=pd.Index(index.keys) if len(index.group_key) == 1 else pd.MultiIndex.from_tuples(index.keys),
+    )
+    res.index.names = index.group_key
+
+    for size in np.unique(sizes[sizes > 1]):
+        groups = np.flatnonzero(sizes == size)
+        members = np.stack([index.indices(g) for g in groups])
+        res.iloc[groups, 0] = _median_similarity(members)
+
+        if size > len(sizes):
+            continue
+        # draw `size` distinct groups per set, then one random profile from each
+        random_groups = np.argsort(rng.random((n_null, len(sizes))), axis=1)[:, :size]
+        offsets = np.floor(rng.random(random_groups.shape) * sizes[random_groups]).astype(np.int64)
+        null = _median_similarity(index.order[index.bounds[random_groups] + offsets])
+        res.iloc[groups, 1] = np.percentile(null, percentile)
+
+    res["replicating"] = res["similarity"] > res["threshold"]
+    tested = res["threshold"].notna()
+    return float(res.loc[tested, "replicating"].mean() * 100), res
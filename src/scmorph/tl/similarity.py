@@ -0,0 +1,202 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+
+def _normalize_profiles(X: np.ndarray, metric: str) -> np.ndarray:
+    """Scale profiles so that their inner products are cosine or Pearson similarities"""
+    if metric not in ("cosine", "pearson"):
+        raise ValueError("metric must be one of 'cosine' or 'pearson'")
+
+    X = np.array(X, dtype=np.promote_types(np.asarray(X).dtype, np.float32))
+    if np.isnan(X).any():
+        raise ValueError("Profiles contain missing values, remove them with scmorph.pp.drop_na first")
+
+    if metric == "pearson":
+        X -= X.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(X, axis=1, keepdims=True)
+    norm[norm == 0] = 1
+    X /= norm
+    return X
+
+
+def _blocked_topk(
+    Q: np.ndarray, R: np.ndarray, k: int, block_size: int = 2048, exclude_self: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Largest inner products of each row of `Q` with the rows of `R`
+
+    Computes the similarity matrix in blocks of `block_size` × `block_size` and only keeps
+    the running top `k` per row, so memory use does not depend on the number of profiles.
+    If `exclude_self`, `Q` and `R` are the same profiles and each row's own match is skipped.
+    """
+    n_q, n_r = Q.shape[0], R.shape[0]
+    k = min(k, n_r - exclude_self)
+    indices = np.empty((n_q, k), dtype=np.int64)
+    values = np.empty((n_q, k), dtype=R.dtype)
+
+    for q_start in range(0, n_q, block_size):
+        q_end = min(q_start + block_size, n_q)
+        best_values = np.full((q_end - q_start, k), -np.inf, dtype=R.dtype)
+        best_indices = np.full((q_end - q_start, k), -1, dtype=np.int64)
+
+        for r_start in range(0, n_r, block_size):
+            r_end = min(r_start + block_size, n_r)
+            sims = Q[q_start:q_end] @ R[r_start:r_end].T
+            if exclude_self:
+                rows = np.arange(max(q_start, r_start), min(q_end, r_end))
+                sims[rows - q_start, rows - r_start] = -np.inf
+
+            candidates = np.hstack([best_values, sims])
+            candidate_indices = np.hstack([best_indices, np.broadcast_to(np.arange(r_start, r_end), sims.shape)])
+            top = np.argpartition(-candidates, k - 1, axis=1)[:, :k]
+            best_values = np.take_along_axis(candidates, top, axis=1)
+            best_indices = np.take_along_axis(candidate_indices, top, axis=1)
+
+        order = np.argsort(-best_values, axis=1, kind="stable")
+        values[q_start:q_end] = np.take_along_axis(best_values, order, axis=1)
+        indices[q_start:q_end] = np.take_along_axis(best_indices, order, axis=1)
+
+    return indices, values
+
+
+class ProfileIndex:
+    """
+    Library of normalized profiles for nearest-neighbor queries
+
+    Stores profiles scaled such that inner products are similarities, so that
+    queries are computed as blocked matrix products. The index can be saved to disk
+    and reloaded to query new profiles against the same library.
+
+    Parameters
+    ----------
+    X : np.ndarray
+        Profiles of shape (n_profiles, n_features)
+    names : list[str] | None
+        Name of each profile, by default its position
+    metric : str
+        Similarity, one of "cosine" or "pearson", by default "cosine"
+    """
+
+    def __init__(self, X: np.ndarray, names: list[str] | None = None, metric: str = "cosine") -> None:
+        self.metric = metric
+        self.profiles = _normalize_profiles(X, metric)
+        self.names = pd.Index(np.arange(len(self.profiles)) if names is None else names).astype(str)
+        if len(self.names) != len(self.profiles):
+            raise ValueError("Number of names and profiles do not match")
+
+    @classmethod
+    def from_anndata(cls, adata: AnnData, layer: str | None = None, metric: str = "cosine") -> "ProfileIndex":
+        """
+        Build from aggregated profiles, e.g. as returned by :func:`scmorph.pp.aggregate`
+
+        Parameters
+        ----------
+        adata : :class:`~anndata.AnnData`
+            Profiles, named by `obs_names`
+        layer : str | None
+            Layer holding the profiles, by default None (i.e. `X`)
+        metric : str
+            Similarity, one of "cosine" or "pearson", by default "cosine"
+
+        Returns
+        -------
+        ProfileIndex
+            Index of the profiles
+        """
+        X = adata.X if layer is None else adata.layers[layer]
+        return cls(np.asarray(X), names=list(adata.obs_names), metric=metric)
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def add(self, X: np.ndarray, names: list[str]) -> "ProfileIndex":
+        """Add profiles to the library"""
+        self.profiles = np.vstack([self.profiles, _normalize_profiles(X, self.metric)])
+        self.names = self.names.append(pd.Index(names).astype(str))
+        return self
+
+    def query(
+        self, X: np.ndarray | None = None, k: int = 10, block_size: int = 2048
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Find the most similar library profiles
+
+        Parameters
+        ----------
+        X : np.ndarray | None
+            Profiles to query of shape (n_queries, n_features). If None, the library is queried
+            against itself, skipping each profile's match with itself.
+        k : int
+            Number of neighbors per query, by default 10
+        block_size : int
+            Number of profiles per block of the similarity matrix, by default 2048
+
+        Returns
+        -------
+        tuple[pd.DataFrame, pd.DataFrame]
+            Names and similarities of the `k` nearest library profiles of each query,
+            sorted from most to least similar
+        """
+        if X is None:
+            indices, values = _blocked_topk(self.profiles, self.profiles, k, block_size, exclude_self=True)
+            index = self.names
+        else:
+            Q = _normalize_profiles(X, self.metric).astype(self.profiles.dtype, copy=False)
+            indices, values = _blocked_topk(Q, self.profiles, k, block_size)
+            index = pd.RangeIndex(len(Q)).astype(str)
+
+        names = pd.DataFrame(self.names.to_numpy()[indices], index=index)
+        return names, pd.DataFrame(values, index=index)
+
+    def save(self, path: str | Path) -> None:
+        """Save the index to a `.npz` file"""
+        np.savez(path, profiles=self.profiles, names=self.names.to_numpy(dtype=str), metric=self.metric)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ProfileIndex":
+        """Load an index saved with :meth:`save`"""
+        with np.load(path, allow_pickle=False) as f:
+            index = cls.__new__(cls)
+            index.metric = str(f["metric"])
+            index.profiles = f["profiles"]
+            index.names = pd.Index(f["names"])
+        return index
+
+
+def similarity_neighbors(
+    adata: AnnData,
+    k: int = 10,
+    metric: str = "cosine",
+    layer: str | None = None,
+    block_size: int = 2048,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Most similar profiles of every profile
+
+    Computes all pairwise similarities of the profiles in blocks, keeping only the top `k`
+    neighbors of each profile. This scales to libraries whose dense similarity matrix would not
+    fit in memory. Use :class:`ProfileIndex` to also query new profiles against the library.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        Aggregated profiles, e.g. as returned by :func:`scmorph.pp.aggregate`
+    k : int
+        Number of neighbors per profile, by default 10
+    metric : str
+        Similarity, one of "cosine" or "pearson", by default "cosine"
+    layer : str | None
+        Layer holding the profiles, by default None (i.e. `X`)
+    block_size : int
+        Number of profiles per block of the similarity matrix, by default 2048
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        Names (`obs_names`) and similarities of the `k` nearest profiles of each profile,
+        sorted from most to least similar
+    """
+    return ProfileIndex.from_anndata(adata, layer=layer, metric=metric).query(k=k, block_size=block_size)
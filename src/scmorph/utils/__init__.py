@@ -1,8 +1,22 @@
+from .cache import GroupedOpCache, get_cache, set_cache
+from .group_index import GroupIndex, get_group_index
+from .mahalanobis import CovarianceFactor, get_covariance_factor, streaming_covariance
 from .r_functions import _clean_R_env, _load_R_functions, _None_converter
+from .sketch import QuantileSketch
 from .utils import (
+    _MOMENT_OPS,
     _get_group_keys,
+    _getX,
+    _grouped_obs_stream,
     _infer_names,
+    _iter_chunks,
+    _process_pool,
+    _quantile_names,
+    _rollup_stats,
+    _stats_op,
     get_grouped_op,
+    group_broadcast_inplace,
     group_obs_fun_inplace,
     grouped_op,
+    grouped_op_to_anndata,
 )
@@ -0,0 +1,175 @@
+"""Cache for results of grouped operations."""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+from scmorph.logging import get_logger
+
+from .group_index import GroupIndex
+
+
+def fingerprint(
+    adata: AnnData, group_key: str | list[str] | GroupIndex, layer: str | None = None, chunk_size: int = 10000
+) -> str:
+    """
+    Fingerprint of the data and grouping underlying a grouped operation
+
+    Hashes the shape, feature names, grouping and all values of the data,
+    read in chunks of `chunk_size` rows so that backed data is not loaded at once.
+    Any in-place change to the data, even of a single cell, changes the fingerprint.
+    Computing it reads all of the data once, which is cheaper than the grouped operations
+    it guards but not free, especially for backed data.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        AnnData object, may be backed
+    group_key : str | list[str] | GroupIndex
+        Column(s) in `obs` used for grouping, or a prebuilt :class:`scmorph.utils.GroupIndex`
+    layer : str | None
+        Layer holding the data, by default None (i.e. `X`)
+    chunk_size : int
+        Number of rows of the data to hash at once, by default 10000
+
+    Returns
+    -------
+    str
+        Hexadecimal digest
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pd.util.hash_pandas_object(adata.var_names, index=False).to_numpy().tobytes())
+    if isinstance(group_key, GroupIndex):
+        # the codes and labels define the grouping, which may differ from the obs columns it was built from
+        h.update(repr((adata.shape, layer, group_key.group_key, group_key.keys)).encode())
+        h.update(np.ascontiguousarray(group_key.codes).tobytes())
+    else:
+        group_key = [group_key] if isinstance(group_key, str) else list(group_key)
+        h.update(repr((adata.shape, layer, group_key)).encode())
+        h.update(pd.util.hash_pandas_object(adata.obs[group_key], index=False).to_numpy().tobytes())
+
+    X = adata.X if layer is None else adata.layers[layer]
+    for start in range(0, adata.n_obs, chunk_size):
+        h.update(np.ascontiguousarray(X[start : start + chunk_size]).tobytes())
+    return h.hexdigest()
+
+
+class GroupedOpCache:
+    """
+    Least-recently-used cache for results of grouped operations
+
+    Results are keyed by a content fingerprint of the data (see :func:`fingerprint`), so
+    stale results are not returned after the data changed. Optionally, results are also
+    written to a directory as parquet files, allowing reuse across sessions.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of results to keep in memory and on disk, by default 64
+    directory : str | Path | None
+        Directory to persist results to, by default None (memory only)
+    """
+
+    def __init__(self, max_entries: int = 64, directory: str | Path | None = None) -> None:
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory is not None else None
+        self._entries: OrderedDict[str, pd.DataFrame] = OrderedDict()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(data_fingerprint: str, operation: str) -> str:
+        """Combine a data fingerprint and an operation description into a cache key"""
+        return hashlib.blake2b(json.dumps([data_fingerprint, operation]).encode(), digest_size=16).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.parquet"  # type: ignore[operator]
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        """Retrieve a result, or None if it is not cached"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        if self.directory is not None and self._path(key).exists():
+            path = self._path(key)
+            os.utime(path)  # mark as recently used
+            res = pd.read_parquet(path).T
+            self._store_in_memory(key, res)
+            return res
+
+        return None
+
+    def set(self, key: str, value: pd.DataFrame) -> None:
+        """Add a result to the cache, evicting the least recently used results if full"""
+        self._store_in_memory(key, value)
+
+        if self.directory is not None:
+            try:
+                value.T.to_parquet(self._path(key))
+            except (ValueError, TypeError) as e:
+                get_logger().warning(f"Could not write grouped operation to cache directory: {e}")
+                return
+
+            files = sorted(self.directory.glob("*.parquet"), key=lambda f: f.stat().st_mtime)
+            for f in files[: max(0, len(files) - self.max_entries)]:
+                f.unlink(missing_ok=True)
+
+    def _store_in_memory(self, key: str, value: pd.DataFrame) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self, disk: bool = False) -> None:
+        """
+        Remove all cached results
+
+        Parameters
+        ----------
+        disk : bool
+            Whether to also delete results persisted to disk, by default False
+        """
+        self._entries.clear()
+        if disk and self.directory is not None:
+            for f in self.directory.glob("*.parquet"):
+                f.unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_cache = GroupedOpCache()
+
+
+def get_cache() -> GroupedOpCache:
+    """Get the cache used by :func:`scmorph.utils.get_grouped_op`"""
+    return _cache
+
+
+def set_cache(max_entries: int = 64, directory: str | Path | None = None) -> GroupedOpCache:
+    """
+    Configure the cache used by :func:`scmorph.utils.get_grouped_op`
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of results to keep, by default 64
+    directory : str | Path | None
+        Directory to persist results to, so that they are reused across sessions.
+        By default None (memory only)
+
+    Returns
+    -------
+    GroupedOpCache
+        The new cache
+    """
+    global _cache
+    _cache = GroupedOpCache(max_entries=max_entries, directory=directory)
+    return _cache
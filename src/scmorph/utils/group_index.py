@@ -0,0 +1,181 @@
+"""Reusable integer encoding of groups of observations."""
+
+from collections.abc import Iterator
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from anndata import AnnData
+
+
+class GroupIndex:
+    """
+    Integer encoding of a grouping of observations
+
+    Holds one integer code per observation, a stable sort permutation that places
+    observations of the same group next to each other and the boundaries of each
+    group's segment in that permutation. This is equivalent to
+    ``adata.obs.groupby(group_key, observed=True)``, but is built once and reused.
+    Use :func:`get_group_index` to build or retrieve it for an AnnData object.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Group code of each observation, -1 for observations without group (missing keys)
+    keys : list
+        Label of each group in code order. Scalars for a single grouping column, tuples otherwise.
+    group_key : list[str]
+        Columns in `obs` the grouping was derived from
+    """
+
+    def __init__(self, codes: np.ndarray, keys: list[Any], group_key: list[str]) -> None:
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.keys = list(keys)
+        self.group_key = list(group_key)
+
+        order = np.argsort(self.codes, kind="stable")
+        self.order = order[self.codes[order] >= 0]
+        self.bounds = np.searchsorted(self.codes[self.order], np.arange(len(self.keys) + 1))
+
+    @classmethod
+    def from_obs(cls, obs: pd.DataFrame, group_key: str | list[str]) -> "GroupIndex":
+        """
+        Build from columns of a metadata table
+
+        Groups are sorted as in :meth:`pandas.DataFrame.groupby`, i.e. by category order
+        for categorical columns and by value otherwise. Only observed combinations are kept.
+
+        Parameters
+        ----------
+        obs : pd.DataFrame
+            Metadata table
+        group_key : str | list[str]
+            Column(s) to group by
+
+        Returns
+        -------
+        GroupIndex
+            Encoded grouping
+        """
+        group_key = [group_key] if isinstance(group_key, str) else list(group_key)
+
+        level_codes, level_uniques = [], []
+        for key in group_key:
+            col = obs[key]
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                codes, uniques = col.cat.codes.to_numpy().astype(np.int64), col.cat.categories
+            else:
+                codes, uniques = pd.factorize(col, sort=True)
+            level_codes.append(np.asarray(codes, dtype=np.int64))
+            level_uniques.append(uniques)
+
+        valid = np.logical_and.reduce([c >= 0 for c in level_codes])
+        combined = np.zeros(len(obs), dtype=np.int64)
+        for codes, uniques in zip(level_codes, level_uniques, strict=True):
+            combined = combined * len(uniques) + codes
+
+        observed, inverse = np.unique(combined[valid], return_inverse=True)
+        codes = np.full(len(obs), -1, dtype=np.int64)
+        codes[valid] = inverse
+
+        # decode combined codes back into labels of each level
+        labels = []
+        remainder = observed
+        for uniques in reversed(level_uniques):
+            labels.append(np.asarray(uniques, dtype=object)[remainder % len(uniques)])
+            remainder = remainder // len(uniques)
+        labels = labels[::-1]
+        keys = list(labels[0]) if len(group_key) == 1 else list(zip(*labels, strict=True))
+
+        return cls(codes, keys, group_key)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def n_groups(self) -> int:
+        """Number of groups"""
+        return len(self.keys)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """Number of observations per group"""
+        return np.diff(self.bounds)
+
+    def indices(self, group: int) -> np.ndarray:
+        """Sorted positions of observations in the `group`-th group"""
+        return self.order[self.bounds[group] : self.bounds[group + 1]]
+
+    def items(self) -> Iterator[tuple[Any, np.ndarray]]:
+        """Iterate over group labels and positions, like :attr:`pandas.core.groupby.GroupBy.indices`"""
+        for i, key in enumerate(self.keys):
+            yield key, self.indices(i)
+
+    def subset(self, mask: np.ndarray) -> "GroupIndex":
+        """
+        Restrict to a subset of observations, dropping groups that become empty
+
+        Parameters
+        ----------
+        mask : np.ndarray
+            Boolean mask or integer positions of observations to keep
+
+        Returns
+        -------
+        GroupIndex
+            Grouping of the selected observations
+        """
+        codes = self.codes[mask]
+        present = np.unique(codes[codes >= 0])
+        remap = np.full(len(self.keys) + 1, -1, dtype=np.int64)
+        remap[present] = np.arange(len(present))
+        return GroupIndex(remap[codes], [self.keys[i] for i in present], self.group_key)
+
+    def key_frame(self) -> pd.DataFrame:
+        """Group labels as a DataFrame with one column per grouping column"""
+        if len(self.group_key) == 1:
+            return pd.DataFrame({self.group_key[0]: self.keys})
+        return pd.DataFrame.from_records(self.keys, columns=self.group_key)
+
+
+def _obs_unchanged(obs: pd.DataFrame, snapshot: pd.DataFrame) -> bool:
+    """Whether the grouping columns of `obs` still hold the values of a snapshot, compared without hashing"""
+    if len(obs) != len(snapshot):
+        return False
+    return all(obs[k].dtype == snapshot[k].dtype and obs[k].array.equals(snapshot[k].array) for k in snapshot)
+
+
+def get_group_index(adata: AnnData, group_key: "str | list[str] | GroupIndex") -> GroupIndex:
+    """
+    Build or retrieve the :class:`GroupIndex` of an AnnData object
+
+    Group indices are cached on the AnnData object per tuple of grouping columns and
+    rebuilt when any value of those columns changes.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        AnnData object
+    group_key : str | list[str] | GroupIndex
+        Column(s) in `obs` to group by, or a prebuilt :class:`GroupIndex`, which is returned as is
+
+    Returns
+    -------
+    GroupIndex
+        Encoded grouping of `adata.obs`
+    """
+    if isinstance(group_key, GroupIndex):
+        if len(group_key.codes) != adata.n_obs:
+            raise ValueError(f"GroupIndex has {len(group_key.codes)} observations, but data has {adata.n_obs}")
+        return group_key
+
+    group_key = [group_key] if isinstance(group_key, str) else list(group_key)
+    cache = adata.__dict__.setdefault("_scmorph_group_indices", {})
+    # a copy of the grouping columns detects edits, which is cheaper than hashing them on every lookup
+    cached = cache.get(tuple(group_key))
+    if cached is not None and _obs_unchanged(adata.obs, cached[0]):
+        return cached[1]
+
+    index = GroupIndex.from_obs(adata.obs, group_key)
+    cache[tuple(group_key)] = (adata.obs[group_key].copy(), index)
+    return index
@@ -0,0 +1,251 @@
+"""Batched Mahalanobis distances from a factorized covariance matrix."""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from anndata import AnnData
+
+from scmorph.logging import get_logger
+
+from .utils import _iter_chunks
+
+
+class CovarianceFactor:
+    """
+    Factorization of a covariance matrix for batched Mahalanobis distances
+
+    The covariance is factorized once as ``L @ L.T`` (Cholesky), so that
+    distances of many observations are obtained with a single triangular solve
+    instead of inverting the covariance. If the covariance is not positive definite
+    or too ill-conditioned for the inverse to be trusted, it is either shrunk towards
+    a scaled identity matrix until it is well-conditioned (`fallback="shrinkage"`),
+    or its pseudo-inverse is used (`fallback="pinv"`).
+
+    Parameters
+    ----------
+    cov : np.ndarray
+        Covariance matrix of shape (n_features, n_features)
+    fallback : str
+        How to handle ill-conditioned covariances, one of "shrinkage", "pinv" or "raise".
+        By default "shrinkage"
+    rcond : float
+        Smallest acceptable ratio of smallest to largest eigenvalue, by default 1e-10
+
+    Attributes
+    ----------
+    method : str
+        Factorization that was used, one of "cholesky", "shrinkage" or "pinv"
+    shrinkage : float
+        Weight of the identity target in the shrunk covariance, 0 unless `method` is "shrinkage"
+    """
+
+    _shrinkage_steps = (1e-8, 1e-6, 1e-4, 1e-2, 1e-1, 0.5)
+
+    def __init__(self, cov: np.ndarray, fallback: str = "shrinkage", rcond: float = 1e-10) -> None:
+        if fallback not in ("shrinkage", "pinv", "raise"):
+            raise ValueError("fallback must be one of 'shrinkage', 'pinv' or 'raise'")
+
+        cov = np.atleast_2d(np.asarray(cov, dtype=np.float64))
+        self.n_features = cov.shape[0]
+        self.shrinkage = 0.0
+        self._whitening: np.ndarray | None = None
+
+        self._lower = self._cholesky(cov, rcond)
+        if self._lower is not None:
+            self.method = "cholesky"
+            return
+
+        if fallback == "raise":
+            raise np.linalg.LinAlgError("Covariance matrix is singular or ill-conditioned")
+
+        if fallback == "shrinkage":
+            target = np.trace(cov) / self.n_features
+            for alpha in self._shrinkage_steps if target > 0 else ():
+                shrunk = (1 - alpha) * cov + alpha * target * np.eye(self.n_features)
+                self._lower = self._cholesky(shrunk, rcond)
+                if self._lower is not None:
+                    self.method, self.shrinkage = "shrinkage", alpha
+                    get_logger().info(f"Covariance matrix was ill-conditioned, shrinking it by {alpha:g}")
+                    return
+
+        # pseudo-inverse through the eigendecomposition, dropping null directions
+        eigval, eigvec = np.linalg.eigh((cov + cov.T) / 2)
+        keep = eigval > max(eigval.max(), 0) * rcond
+        self._whitening = eigvec[:, keep] / np.sqrt(eigval[keep])
+        self.method = "pinv"
+        get_logger().info(f"Covariance matrix was singular, using pseudo-inverse of rank {keep.sum()}")
+
+    @staticmethod
+    def _cholesky(cov: np.ndarray, rcond: float) -> np.ndarray | None:
+        try:
+            lower = np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError:
+            return None
+        diag = np.abs(np.diag(lower))
+        if diag.min() == 0 or (diag.min() / diag.max()) ** 2 < rcond:
+            return None
+        return lower
+
+    def whiten(self, X: np.ndarray) -> np.ndarray:
+        """
+        Transform observations so that Mahalanobis distances become Euclidean distances
+
+        Parameters
+        ----------
+        X : np.ndarray
+            Centered observations of shape (n_obs, n_features)
+
+        Returns
+        -------
+        np.ndarray
+            Whitened observations of shape (n_obs, rank)
+        """
+        from scipy.linalg import solve_triangular
+
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if self._lower is not None:
+            return solve_triangular(self._lower, X.T, lower=True, check_finite=False).T
+        return X @ self._whitening
+
+    def mahalanobis(self, X: np.ndarray, center: np.ndarray) -> np.ndarray:
+        """
+        Mahalanobis distances of observations to a center
+
+        Parameters
+        ----------
+        X : np.ndarray
+            Observations of shape (n_obs, n_features)
+        center : np.ndarray
+            Center of shape (n_features,), e.g. the control centroid
+
+        Returns
+        -------
+        np.ndarray
+            Distances of shape (n_obs,)
+        """
+        Z = self.whiten(np.atleast_2d(X) - np.asarray(center).reshape(1, -1))
+        return np.sqrt(np.einsum("ij,ij->i", Z, Z))
+
+
+_factor_cache: OrderedDict[str, CovarianceFactor] = OrderedDict()
+_factor_cache_size = 16
+
+
+def get_covariance_factor(cov: np.ndarray, fallback: str = "shrinkage", rcond: float = 1e-10) -> CovarianceFactor:
+    """
+    Build or retrieve the :class:`CovarianceFactor` of a covariance matrix
+
+    Factorizations are cached by the content of the covariance matrix, so repeated
+    distance computations against the same control set factorize it only once.
+
+    Parameters
+    ----------
+    cov : np.ndarray
+        Covariance matrix of shape (n_features, n_features)
+    fallback : str
+        How to handle ill-conditioned covariances, see :class:`CovarianceFactor`
+    rcond : float
+        Smallest acceptable ratio of smallest to largest eigenvalue, by default 1e-10
+
+    Returns
+    -------
+    CovarianceFactor
+        Factorized covariance
+    """
+    cov = np.ascontiguousarray(np.atleast_2d(cov), dtype=np.float64)
+    h = hashlib.blake2b(repr((cov.shape, fallback, rcond)).encode(), digest_size=16)
+    h.update(cov.tobytes())
+    key = h.hexdigest()
+
+    if key in _factor_cache:
+        _factor_cache.move_to_end(key)
+        return _factor_cache[key]
+
+    factor = CovarianceFactor(cov, fallback=fallback, rcond=rcond)
+    _factor_cache[key] = factor
+    while len(_factor_cache) > _factor_cache_size:
+        _factor_cache.popitem(last=False)
+    return factor
+
+
+def streaming_covariance(
+    adata: AnnData,
+    mask: np.ndarray | None = None,
+    layer: str | None = None,
+    shrinkage: str | None = None,
+    chunk_size: int = 10000,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Covariance of features, accumulated over chunks of cells
+
+    Reads `chunk_size` cells at a time and merges their means and cross-products
+    (Chan et al. 1979), so that memory use is independent of the number of cells and
+    backed data is never loaded completely.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        AnnData object, may be backed
+    mask : np.ndarray | None
+        Boolean mask of cells to include, by default None (all cells)
+    layer : str | None
+        Layer holding the data, by default None (i.e. `X`)
+    shrinkage : str | None
+        Shrink the covariance towards a scaled identity matrix, so that it is always
+        invertible. One of "ledoit_wolf" [Ledoit04]_, which requires a second pass over the data,
+        or "oas" [Chen10]_. Both match :mod:`sklearn.covariance`. By default None,
+        which matches :func:`numpy.cov`.
+    chunk_size : int
+        Number of cells to read at once, by default 10000
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Covariance matrix of shape (n_features, n_features) and mean of shape (n_features,)
+    """
+    if shrinkage not in (None, "ledoit_wolf", "oas"):
+        raise ValueError("shrinkage must be one of None, 'ledoit_wolf' or 'oas'")
+
+    def _chunks():
+        for start, end, X in _iter_chunks(adata, layer, chunk_size):
+            X = X if mask is None else X[mask[start:end]]
+            if X.shape[0] > 0:
+                yield X.astype(np.float64, copy=False)
+
+    n_vars = adata.n_vars
+    n, mean, m2 = 0, np.zeros(n_vars), np.zeros((n_vars, n_vars))
+    for X in _chunks():
+        n_b = X.shape[0]
+        mean_b = X.mean(axis=0)
+        centered = X - mean_b
+        delta = mean_b - mean
+        m2 += centered.T @ centered + np.outer(delta, delta) * n * n_b / (n + n_b)
+        mean += delta * n_b / (n + n_b)
+        n += n_b
+
+    if n == 0:
+        raise ValueError("No cells to compute covariance from")
+
+    if shrinkage is None:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return m2 / (n - 1), mean
+
+    emp_cov = m2 / n
+    mu = np.trace(emp_cov) / n_vars
+    if shrinkage == "oas":
+        alpha = np.mean(emp_cov**2)
+        den = (n + 1) * (alpha - mu**2 / n_vars)
+        amount = 1.0 if den == 0 else min((alpha + mu**2) / den, 1.0)
+    else:
+        # sum of fourth powers of the norms of centered cells
+        beta = sum(np.sum(np.sum((X - mean) ** 2, axis=1) ** 2) for X in _chunks())
+        delta_sq = np.sum(emp_cov**2)
+        beta = (beta / n - delta_sq) / (n_vars * n)
+        delta = (delta_sq - 2 * mu * np.trace(emp_cov) + n_vars * mu**2) / n_vars
+        beta = min(beta, delta)
+        amount = 0.0 if beta == 0 else beta / delta
+
+    shrunk = (1 - amount) * emp_cov
+    shrunk.flat[:: n_vars + 1] += amount * mu
+    return shrunk, mean
@@ -0,0 +1,239 @@
+"""Mergeable streaming quantile sketches."""
+
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def _weighted_quantile(values: np.ndarray, weights: np.ndarray, q: Sequence[float] | np.ndarray) -> np.ndarray:
+    """
+    Quantiles of weighted samples, computed column-wise
+
+    Uses midpoint interpolation of the weighted empirical CDF, which reduces
+    to :func:`numpy.median` for unit weights. Missing values (NaN) are ignored.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Samples of shape (n_samples, n_features)
+    weights : np.ndarray
+        Weights of shape (n_samples,) or (n_samples, n_features)
+    q : Sequence[float] | np.ndarray
+        Quantiles to compute, between 0 and 1
+
+    Returns
+    -------
+    np.ndarray
+        Quantiles of shape (len(q), n_features)
+    """
+    q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    n, p = values.shape
+    out = np.full((len(q), p), np.nan, dtype=np.float64)
+    if n == 0:
+        return out
+
+    # NaNs are sorted last and receive no weight
+    order = np.argsort(values, axis=0)
+    v = np.take_along_axis(values, order, axis=0).astype(np.float64)
+    w = weights[order] if weights.ndim == 1 else np.take_along_axis(weights, order, axis=0)
+    missing = np.isnan(v)
+    w = np.where(missing, 0, w)
+    n_valid = n - missing.sum(axis=0)
+    cw = np.cumsum(w, axis=0, dtype=np.float64)
+    total = cw[-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pos = (cw - 0.5 * w) / total
+
+    # positions are sorted within each column, so all quantiles are located with one binary search per column
+    hi = np.empty((len(q), p), dtype=np.int64)
+    for j in range(p):
+        hi[:, j] = np.searchsorted(pos[:, j], q, side="left")
+    hi = np.clip(hi, 0, np.maximum(n_valid - 1, 0))
+    lo = np.maximum(hi - 1, 0)
+    p_lo, p_hi = np.take_along_axis(pos, lo, axis=0), np.take_along_axis(pos, hi, axis=0)
+    v_lo, v_hi = np.take_along_axis(v, lo, axis=0), np.take_along_axis(v, hi, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(p_hi > p_lo, (q[:, np.newaxis] - p_lo) / (p_hi - p_lo), 0)
+    out[:] = v_lo + np.clip(frac, 0, 1) * (v_hi - v_lo)
+
+    out[:, n_valid == 0] = np.nan
+    return out
+
+
+class QuantileSketch:
+    """
+    Mergeable approximate quantile sketch for many features at once
+
+    Implements the KLL sketch [Karnin16]_ with one compactor hierarchy shared by all features.
+    Because every observation contributes a value to each feature, all features
+    hold the same number of items and compaction is vectorized across features.
+
+    The rank error of any quantile is bounded with high probability by
+    roughly ``1.7 / k``, independently of the number of observations. Sketches
+    built on separate chunks or in separate processes can be combined with
+    :meth:`merge` without loss of this guarantee.
+
+    Missing values (NaN) are counted exactly per feature and otherwise treated as
+    the largest values, so quantiles of the remaining values can still be estimated.
+
+    Parameters
+    ----------
+    n_features : int
+        Number of features (columns) to sketch
+    k : int
+        Size of the largest compactor. Larger values are more accurate but use more memory.
+    seed : int | None
+        Seed for the random compaction offsets
+    """
+
+    _c = 2 / 3
+
+    def __init__(self, n_features: int, k: int = 200, seed: int | None = None) -> None:
+        if k < 2:
+            raise ValueError("k must be at least 2")
+        self.n_features = n_features
+        self.k = k
+        self.n = 0
+        self.n_missing = np.zeros(n_features, dtype=np.int64)
+        self._rng = np.random.default_rng(seed)
+        self._levels: list[np.ndarray] = [np.empty((0, n_features))]
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(2, int(np.ceil(self.k * self._c**depth)))
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if items.shape[0] > self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.empty((0, self.n_features), dtype=items.dtype))
+
+                # keep one item back if odd so that weights stay exact
+                keep = items.shape[0] % 2
+                compacted = np.sort(items[keep:], axis=0)[self._rng.integers(2) :: 2]
+                self._levels[level] = items[:keep]
+                self._levels[level + 1] = np.concatenate([self._levels[level + 1], compacted])
+            level += 1
+
+    def update(self, X: np.ndarray) -> "QuantileSketch":
+        """
+        Add observations to the sketch
+
+        Parameters
+        ----------
+        X : np.ndarray
+            Observations of shape (n_obs, n_features)
+
+        Returns
+        -------
+        QuantileSketch
+            The updated sketch
+        """
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, received {X.shape[1]}")
+        if X.shape[0] == 0:
+            return self
+
+        self.n += X.shape[0]
+        if np.issubdtype(X.dtype, np.floating):
+            self.n_missing += np.isnan(X).sum(axis=0)
+        self._levels[0] = np.concatenate([self._levels[0], X])
+        self._compress()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Merge another sketch into this one
+
+        Parameters
+        ----------
+        other : QuantileSketch
+            Sketch of the same features
+
+        Returns
+        -------
+        QuantileSketch
+            The merged sketch
+        """
+        if other.n_features != self.n_features:
+            raise ValueError("Can only merge sketches with the same number of features")
+
+        for level, items in enumerate(other._levels):
+            if level == len(self._levels):
+                self._levels.append(items.copy())
+            else:
+                self._levels[level] = np.concatenate([self._levels[level], items])
+        self.n += other.n
+        self.n_missing += other.n_missing
+        self._compress()
+        return self
+
+    def _weighted_items(self) -> tuple[np.ndarray, np.ndarray]:
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(items.shape[0], 2.0**level) for level, items in enumerate(self._levels)])
+        return values, weights
+
+    @property
+    def count(self) -> np.ndarray:
+        """Number of non-missing values of each feature"""
+        return self.n - self.n_missing
+
+    def quantile(self, q: float | Sequence[float] | np.ndarray, skipna: bool = False) -> np.ndarray:
+        """
+        Approximate quantiles of each feature
+
+        Parameters
+        ----------
+        q : float | Sequence[float] | np.ndarray
+            Quantile(s) to compute, between 0 and 1
+        skipna : bool
+            Whether to ignore missing values. If False, features with missing values
+            return NaN, as in :func:`numpy.quantile`. By default False
+
+        Returns
+        -------
+        np.ndarray
+            Quantiles of shape (n_features,) for scalar `q`, else (len(q), n_features)
+        """
+        res = _weighted_quantile(*self._weighted_items(), q)
+        if not skipna:
+            res[:, self.n_missing > 0] = np.nan
+        return res[0] if np.ndim(q) == 0 else res
+
+    def median(self, skipna: bool = False) -> np.ndarray:
+        """Approximate median of each feature"""
+        return self.quantile(0.5, skipna=skipna)
+
+    def mad(self, scale: float | str = 1.0, skipna: bool = False) -> np.ndarray:
+        """
+        Approximate median absolute deviation of each feature
+
+        Deviations are taken from the approximate median of the sketched items,
+        so no second pass over the data is needed.
+
+        Parameters
+        ----------
+        scale : float | str
+            Scaling factor, or "normal" for consistency with the standard deviation
+            of normally distributed data, as in :func:`scipy.stats.median_abs_deviation`
+        skipna : bool
+            Whether to ignore missing values, by default False
+
+        Returns
+        -------
+        np.ndarray
+            Median absolute deviations of shape (n_features,)
+        """
+        if scale == "normal":
+            scale = 0.67448975019608171
+        values, weights = self._weighted_items()
+        deviation = np.abs(values - _weighted_quantile(values, weights, 0.5))
+        res = _weighted_quantile(deviation, weights, 0.5)[0] / scale
+        if not skipna:
+            res[self.n_missing > 0] = np.nan
+        return res
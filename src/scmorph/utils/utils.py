@@ -1,8 +1,9 @@
+import os
 import re
-from collections.abc import Callable, Iterable, Sequence
+from collections.abc import Callable, Iterable, Iterator, Sequence
 from functools import partial
 from inspect import signature
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import numpy as np
 import pandas as pd
@@ -10,6 +11,13 @@ from anndata import AnnData
 
 from scmorph.logging import get_logger
 
+from .cache import fingerprint, get_cache
+from .group_index import GroupIndex, get_group_index
+from .sketch import QuantileSketch
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
 
 def _infer_names(target: str, options: Iterable[str]) -> Sequence[str]:
     logger = get_logger()
@@ -38,67 +46,224 @@ def _infer_names(target: str, options: Iterable[str]) -> Sequence[str]:
 
 def _grouped_obs_fun(
     adata: AnnData,
-    group_key: str | list[str],
-    fun: Callable[..., Any],
+    group_key: str | list[str] | GroupIndex,
+    fun: Callable[..., Any] | dict[str, Callable[..., Any]],
     layer: str | None = None,
     progress: bool = True,
-) -> pd.DataFrame:
+) -> pd.DataFrame | dict[str, pd.DataFrame]:
     """
     Grouped operations on anndata objects
 
+    If `fun` is a dictionary of functions, each group is only selected once
+    and all functions are evaluated on it, returning one DataFrame per function.
+
     Slightly adapted from https://github.com/scverse/scanpy/issues/181#issuecomment-534867254
     All copyright lies with Isaac Virshup.
     """
     from tqdm import tqdm
 
-    def getX(adata: AnnData, layer: None | str) -> np.ndarray:
-        return adata.X if layer is None else adata.layers[layer]
+    funs = fun if isinstance(fun, dict) else {"": fun}
 
-    grouped = adata.obs.groupby(group_key, observed=True)
-    out = pd.DataFrame(
-        np.zeros((adata.shape[1], len(grouped)), dtype=np.float64),
-        columns=list(grouped.groups.keys()),
-        index=adata.var_names,
-    )
-    items = tqdm(grouped.indices.items(), unit=" groups") if progress else grouped.indices.items()
+    index = get_group_index(adata, group_key)
+    out = {name: np.zeros((adata.shape[1], len(index)), dtype=np.float64) for name in funs}
+    items = enumerate(index.items())
+    items = tqdm(items, total=len(index), unit=" groups") if progress else items
 
-    for group, idx in items:
-        X = getX(adata[idx], layer)
-        out[group] = np.array(fun(X))
+    X_full = _getX(adata, layer)
+    for i, (_, idx) in items:
+        X = X_full[idx]
+        for name, f in funs.items():
+            out[name][:, i] = np.array(f(X))
 
-    return out
+    res = {name: pd.DataFrame(vals, columns=index.keys, index=adata.var_names) for name, vals in out.items()}
+    return res if isinstance(fun, dict) else res[""]
 
 
-def grouped_op(
+def _group_key_names(group_key: str | list[str] | GroupIndex) -> list[str]:
+    """Names of the obs columns defining a grouping"""
+    if isinstance(group_key, GroupIndex):
+        return group_key.group_key
+    return [group_key] if isinstance(group_key, str) else list(group_key)
+
+
+def _getX(adata: AnnData, layer: None | str) -> np.ndarray:
+    return adata.X if layer is None else adata.layers[layer]
+
+
+def _iter_chunks(
+    adata: AnnData, layer: str | None = None, chunk_size: int = 10000
+) -> Iterator[tuple[int, int, np.ndarray]]:
+    """Iterate over row blocks of X or a layer, also for backed data"""
+    X = _getX(adata, layer)
+    for start in range(0, adata.n_obs, chunk_size):
+        end = min(start + chunk_size, adata.n_obs)
+        yield start, end, np.asarray(X[start:end])
+
+
+def _process_pool(n_cores: int) -> "ProcessPoolExecutor":
+    """
+    Pool of `n_cores` worker processes, -1 for all cores
+
+    Workers are spawned rather than forked, because forking after numba's parallel kernels
+    have started their threads deadlocks the child processes.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    n_cores = (os.cpu_count() or 1) if n_cores == -1 else n_cores
+    return ProcessPoolExecutor(max_workers=n_cores, mp_context=multiprocessing.get_context("spawn"))
+
+
+_MOMENT_OPS = ("mean", "var", "std", "sem", "count")
+
+
+def _combine_moments(
+    n_a: np.ndarray, mean_a: np.ndarray, m2_a: np.ndarray, n_b: np.ndarray, mean_b: np.ndarray, m2_b: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Combine counts, means and sums of squared deviations of two sets of groups (Chan et al. 1979)"""
+    n = n_a + n_b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(n > 0, n_b / n, 0)
+        cross = np.where(n > 0, n_a * n_b / n, 0)
+    delta = mean_b - mean_a
+    return n, mean_a + delta * frac, m2_a + m2_b + delta**2 * cross
+
+
+def _grouped_obs_stream(
     adata: AnnData,
-    group_key: str | list[str],
-    operation: str,
+    group_key: str | list[str] | GroupIndex,
     layer: str | None = None,
+    moments: bool = True,
+    sketch_size: int | None = None,
+    chunk_size: int = 10000,
     progress: bool = True,
-    **kwargs: Any,
-) -> pd.DataFrame:
+    skipna: bool = False,
+) -> tuple[GroupIndex, dict[str, Any]]:
     """
-    Grouped operations on anndata objects
+    Compute mergeable per-group statistics in a single streamed pass
+
+    Only `chunk_size` cells are held in memory at a time, so this also works on backed data.
+    Returns the grouping and a dictionary of statistics, holding per-group and per-feature counts
+    of non-missing values ("count"), means ("mean") and sums of squared deviations ("m2")
+    if `moments` is True and one :class:`QuantileSketch` per group ("sketches") if `sketch_size` is given.
+    If `skipna` is False, missing values propagate into the means.
+    """
+    from tqdm import tqdm
+
+    index = get_group_index(adata, group_key)
+    n_groups, n_vars = len(index), adata.n_vars
+
+    stats: dict[str, Any] = {"count": np.zeros((n_groups, n_vars), dtype=np.float64)}
+    if moments:
+        stats["mean"] = np.zeros((n_groups, n_vars), dtype=np.float64)
+        stats["m2"] = np.zeros((n_groups, n_vars), dtype=np.float64)
+    if sketch_size is not None:
+        stats["sketches"] = [QuantileSketch(n_vars, k=sketch_size, seed=i) for i in range(n_groups)]
+
+    chunks = _iter_chunks(adata, layer, chunk_size)
+    chunks = tqdm(chunks, total=int(np.ceil(adata.n_obs / chunk_size)), unit=" chunks") if progress else chunks
+
+    for start, end, X in chunks:
+        codes = index.codes[start:end]
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        codes, X = codes[order], X[order]
+        groups, starts, sizes = np.unique(codes, return_index=True, return_counts=True)
+        if len(groups) == 0:
+            continue
+
+        valid = ~np.isnan(X)
+        counts = np.add.reduceat(valid, starts, axis=0).astype(np.float64)
+
+        if moments:
+            Xf = X.astype(np.float64, copy=False)
+            if skipna:
+                Xf = np.where(valid, Xf, 0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_b = np.add.reduceat(Xf, starts, axis=0) / counts
+            deviation = Xf - np.repeat(mean_b, sizes, axis=0)
+            if skipna:
+                mean_b[counts == 0] = 0
+                deviation = np.where(valid, deviation, 0)
+            m2_b = np.add.reduceat(deviation**2, starts, axis=0)
+            _, stats["mean"][groups], stats["m2"][groups] = _combine_moments(
+                stats["count"][groups], stats["mean"][groups], stats["m2"][groups], counts, mean_b, m2_b
+            )
+
+        stats["count"][groups] += counts
+
+        if sketch_size is not None:
+            for group, s, n in zip(groups, starts, sizes, strict=True):
+                stats["sketches"][group].update(X[s : s + n])
+
+    return index, stats
+
+
+def _rollup_stats(stats: dict[str, Any], codes: np.ndarray, n_groups: int) -> dict[str, Any]:
+    """
+    Merge statistics of fine groups into coarser groups
 
     Parameters
     ----------
-    adata : :class:`~anndata.AnnData`
-        AnnData object
-    group_key : str | list[str]
-        Column name in `obs` metadata to group by
-    operation : str
-        What operation to perform, one of "mean", "logmean", "median", "std",
-        "var", "sem", "mad" and "mad_scaled".
-    layer : str | None, optional
-        Which layer ("X" or "X_pca", for example) to aggregate, by default None
-    progress : bool, optional
-         Whether to show a progress bar, by default True
+    stats : dict[str, Any]
+        Statistics as returned by :func:`_grouped_obs_stream`
+    codes : np.ndarray
+        Coarse group code of each fine group
+    n_groups : int
+        Number of coarse groups
 
     Returns
     -------
-    pd.DataFrame
-        Data averaged per group in `group_key`
+    dict[str, Any]
+        Statistics of the coarse groups
     """
+    count = np.zeros((n_groups, stats["count"].shape[1]), dtype=np.float64)
+    np.add.at(count, codes, stats["count"])
+    res: dict[str, Any] = {"count": count}
+
+    if "mean" in stats:
+        weighted = np.zeros_like(count)
+        np.add.at(weighted, codes, stats["mean"] * stats["count"])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = weighted / count
+        m2 = np.zeros_like(count)
+        np.add.at(m2, codes, stats["m2"] + stats["count"] * (stats["mean"] - mean[codes]) ** 2)
+        res["mean"], res["m2"] = mean, m2
+
+    if "sketches" in stats:
+        fine = stats["sketches"]
+        sketches = [QuantileSketch(fine[0].n_features, k=fine[0].k, seed=i) for i in range(n_groups)]
+        for code, sketch in zip(codes, fine, strict=True):
+            sketches[code].merge(sketch)
+        res["sketches"] = sketches
+
+    return res
+
+
+def _stats_op(operation: str, stats: dict[str, Any], skipna: bool = False, **kwargs: Any) -> np.ndarray:
+    """Compute `operation` for each group from statistics of :func:`_grouped_obs_stream`"""
+    if operation in _MOMENT_OPS:
+        n = stats["count"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if operation == "count":
+                return n
+            elif operation == "mean":
+                return np.where(n > 0, stats["mean"], np.nan)
+            elif operation == "var":
+                return stats["m2"] / n
+            elif operation == "std":
+                return np.sqrt(stats["m2"] / n)
+            return np.sqrt(stats["m2"] / (n - 1) / n)
+
+    fun = _sketch_op_fun(operation, skipna=skipna, **kwargs)
+    return np.array([fun(sketch) for sketch in stats["sketches"]])
+
+
+def _op_fun(operation: str, skipna: bool = False, **kwargs: Any) -> Callable[[np.ndarray], np.ndarray]:
+    """Get function computing `operation` over the first axis of an array, optionally ignoring NaNs"""
+    if skipna:
+        return _nan_op_fun(operation, **kwargs)
+
     if operation == "mean":
         fun = partial(np.mean, axis=0, dtype=np.float64, **kwargs)
     elif operation == "logmean":
@@ -108,6 +273,8 @@ def grouped_op(
 
     elif operation == "median":
         fun = partial(np.median, axis=0, **kwargs)
+    elif operation == "quantile":
+        fun = partial(np.quantile, axis=0, **kwargs)
     elif operation == "std":
         fun = partial(np.std, axis=0, dtype=np.float64, **kwargs)
     elif operation == "var":
@@ -130,15 +297,242 @@ def grouped_op(
         def fun(x: np.array) -> np.array:  # type: ignore
             return f2(x) / (f1(x) + 1e-18)
 
+    elif operation == "count":
+
+        def fun(x: np.array) -> np.array:  # type: ignore
+            return np.sum(~np.isnan(x), axis=0)
+
     else:
-        raise ValueError("Operation must be one of 'mean', 'median', 'std', 'var', 'sem', 'mad', 'mad_scaled'")
+        raise ValueError(
+            "Operation must be one of 'mean', 'logmean', 'median', 'quantile', 'std', 'var', 'sem', 'mad', "
+            + "'mad_scaled', 'count'"
+        )
+    return fun
+
+
+def _nan_op_fun(operation: str, **kwargs: Any) -> Callable[[np.ndarray], np.ndarray]:
+    """Get function computing `operation` over the first axis of an array, ignoring NaNs per feature"""
+    import warnings
+
+    def _count(x: np.ndarray) -> np.ndarray:
+        return np.sum(~np.isnan(x), axis=0)
+
+    def _mad(x: np.ndarray, scale: float | str = 1.0) -> np.ndarray:
+        if scale == "normal":
+            scale = 0.67448975019608171
+        return np.nanmedian(np.abs(x - np.nanmedian(x, axis=0)), axis=0) / scale
+
+    if operation == "mean":
+        kernel = partial(np.nanmean, axis=0, dtype=np.float64, **kwargs)
+    elif operation == "logmean":
+
+        def kernel(x: np.ndarray) -> np.ndarray:
+            return np.nanmean(np.log1p(x), axis=0, dtype=np.float64, **kwargs)
+
+    elif operation == "median":
+        kernel = partial(np.nanmedian, axis=0, **kwargs)
+    elif operation == "quantile":
+        kernel = partial(np.nanquantile, axis=0, **kwargs)
+    elif operation == "std":
+        kernel = partial(np.nanstd, axis=0, dtype=np.float64, **kwargs)
+    elif operation == "var":
+        kernel = partial(np.nanvar, axis=0, dtype=np.float64, **kwargs)
+    elif operation == "sem":
+
+        def kernel(x: np.ndarray) -> np.ndarray:
+            return np.nanstd(x, axis=0, ddof=1, dtype=np.float64) / np.sqrt(_count(x))
+
+    elif operation == "mad":
+        kernel = partial(_mad, **kwargs)
+    elif operation == "mad_scaled":
+
+        def kernel(x: np.ndarray) -> np.ndarray:
+            return np.nanmedian(x, axis=0) / (_mad(x, scale="normal") + 1e-18)
+
+    elif operation == "count":
+        kernel = _count
+    else:
+        raise ValueError(
+            "Operation must be one of 'mean', 'logmean', 'median', 'quantile', 'std', 'var', 'sem', 'mad', "
+            + "'mad_scaled', 'count'"
+        )
+
+    # features without any values in a group are NaN, which is expected here
+    def fun(x: np.ndarray) -> np.ndarray:
+        with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return kernel(x)
+
+    return fun
+
+
+def _quantile_names(operations: list[str], q: Any) -> list[str]:
+    """Replace "quantile" by one operation "quantile_<q>" per value if `q` is a sequence"""
+    if np.ndim(q) == 0:
+        return operations
+    return [name for op in operations for name in ([f"quantile_{float(v)!r}" for v in q] if op == "quantile" else [op])]
+
+
+def _op_spec(operation: str, kwargs: dict[str, Any]) -> tuple[str, dict[str, Any]]:
+    """Operation and keyword arguments of an operation name, passing the quantile `q` only to quantiles"""
+    rest = {k: v for k, v in kwargs.items() if k != "q"}
+    if operation.startswith("quantile_"):
+        return "quantile", {**rest, "q": float(operation.removeprefix("quantile_"))}
+    return operation, kwargs if operation == "quantile" else rest
+
+
+def _op_funs(
+    operations: list[str], skipna: bool = False, **kwargs: Any
+) -> dict[str, Callable[[np.ndarray], np.ndarray]]:
+    """Get functions for several operations, sharing the median between median-based operations"""
+    funs = {}
+    for op in operations:
+        name, op_kwargs = _op_spec(op, kwargs)
+        funs[op] = _op_fun(name, skipna=skipna, **op_kwargs)
+
+    if len({"median", "mad", "mad_scaled"}.intersection(operations)) > 1 and not _op_spec("median", kwargs)[1]:
+        median_fun = _op_fun("median", skipna=skipna)
+        memo: dict[str, Any] = {}
+
+        def _medians(x: np.ndarray) -> dict[str, Any]:
+            if memo.get("x") is not x:
+                memo["x"] = x
+                memo["median"] = median_fun(x)
+                memo["mad"] = median_fun(np.abs(x - memo["median"]))
+            return memo
+
+        shared = {
+            "median": lambda x: _medians(x)["median"],
+            "mad": lambda x: _medians(x)["mad"],
+            "mad_scaled": lambda x: _medians(x)["median"] / (_medians(x)["mad"] / 0.67448975019608171 + 1e-18),
+        }
+        funs.update({op: fun for op, fun in shared.items() if op in funs})
+
+    return funs
 
-    return _grouped_obs_fun(adata, group_key, fun=fun, layer=layer, progress=progress)
+
+def _sketch_op_fun(operation: str, skipna: bool = False, **kwargs: Any) -> Callable[[QuantileSketch], np.ndarray]:
+    """Get function approximating `operation` from a :class:`QuantileSketch`"""
+    if operation == "median":
+
+        def fun(sketch: QuantileSketch) -> np.ndarray:
+            return sketch.median(skipna=skipna)
+
+    elif operation == "quantile":
+        if "q" not in kwargs:
+            raise ValueError("Operation 'quantile' requires argument `q`")
+
+        def fun(sketch: QuantileSketch) -> np.ndarray:
+            return sketch.quantile(kwargs["q"], skipna=skipna)
+
+    elif operation == "mad":
+
+        def fun(sketch: QuantileSketch) -> np.ndarray:
+            return sketch.mad(scale=kwargs.get("scale", 1.0), skipna=skipna)
+
+    elif operation == "mad_scaled":
+
+        def fun(sketch: QuantileSketch) -> np.ndarray:
+            return sketch.median(skipna=skipna) / (sketch.mad(scale="normal", skipna=skipna) + 1e-18)
+
+    else:
+        raise ValueError(
+            "Approximate operation must be one of 'mean', 'var', 'std', 'sem', 'count', 'median', 'quantile', "
+            + "'mad', 'mad_scaled'"
+        )
+    return fun
+
+
+def grouped_op(
+    adata: AnnData,
+    group_key: str | list[str] | GroupIndex,
+    operation: str | list[str],
+    layer: str | None = None,
+    progress: bool = True,
+    approximate: bool = False,
+    sketch_size: int = 200,
+    chunk_size: int = 10000,
+    skipna: bool = False,
+    **kwargs: Any,
+) -> pd.DataFrame | dict[str, pd.DataFrame]:
+    """
+    Grouped operations on anndata objects
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        AnnData object
+    group_key : str | list[str] | GroupIndex
+        Column name in `obs` metadata to group by, or a prebuilt :class:`scmorph.utils.GroupIndex`
+    operation : str | list[str]
+        What operation to perform, one of "mean", "logmean", "median", "std",
+        "var", "sem", "mad", "mad_scaled", "quantile" and "count" (i.e. number of non-missing values).
+        For "quantile", pass the quantile to compute as `q`. If a list of operations is given,
+        all are computed in a single pass over the groups. If `q` is a sequence of quantiles,
+        "quantile" is replaced by one operation per quantile, named e.g. "quantile_0.1".
+    layer : str | None, optional
+        Which layer ("X" or "X_pca", for example) to aggregate, by default None
+    progress : bool, optional
+         Whether to show a progress bar, by default True
+    approximate : bool, optional
+        Whether to compute operations in a single streamed pass over the data. This reads the data
+        in chunks of `chunk_size` cells, so memory use is bounded by the number of groups rather
+        than the number of cells. "mean", "var", "std", "sem" and "count" are computed exactly from
+        mergeable moments, while quantile-based operations ("median", "mad", "mad_scaled"
+        and "quantile") are approximated with mergeable sketches (see :class:`scmorph.utils.QuantileSketch`).
+        By default False
+    sketch_size : int, optional
+        Accuracy parameter `k` of the sketches, by default 200
+    chunk_size : int, optional
+        Number of cells to read at once when `approximate` is True, by default 10000
+    skipna : bool, optional
+        Whether to ignore missing values (NaN) per feature, rather than returning NaN for
+        any feature with missing values in a group. This avoids having to drop cells
+        with :func:`scmorph.pp.drop_na` beforehand. Use operation "count" to retrieve the number of
+        values each result is based on. By default False
+
+    Returns
+    -------
+    pd.DataFrame | dict[str, pd.DataFrame]
+        Data averaged per group in `group_key`. If `operation` is a list or `q` a sequence,
+        a dictionary mapping each operation to its result.
+    """
+    operations = [operation] if isinstance(operation, str) else list(operation)
+    if "q" in kwargs and np.ndim(kwargs["q"]) > 0:
+        operations = _quantile_names(operations, kwargs.pop("q"))
+
+    if approximate:
+        sketch_ops = [op for op in operations if op not in _MOMENT_OPS]
+        for op in sketch_ops:
+            name, op_kwargs = _op_spec(op, kwargs)
+            _sketch_op_fun(name, **op_kwargs)  # validate before reading data
+
+        index, stats = _grouped_obs_stream(
+            adata,
+            group_key,
+            layer=layer,
+            moments=len(sketch_ops) < len(operations),
+            sketch_size=sketch_size if sketch_ops else None,
+            chunk_size=chunk_size,
+            progress=progress,
+            skipna=skipna,
+        )
+        res = {}
+        for op in operations:
+            name, op_kwargs = _op_spec(op, kwargs)
+            values = _stats_op(name, stats, skipna=skipna, **op_kwargs)
+            res[op] = pd.DataFrame(values.T, columns=index.keys, index=adata.var_names)
+    else:
+        res = _grouped_obs_fun(
+            adata, group_key, fun=_op_funs(operations, skipna=skipna, **kwargs), layer=layer, progress=progress
+        )
+
+    return res[operation] if isinstance(operation, str) and len(operations) == 1 else res
 
 
 def group_obs_fun_inplace(
     adata: AnnData,
-    group_key: str | list[str],
+    group_key: str | list[str] | GroupIndex,
     fun: Callable[..., Any],
     progress: bool = True,
 ) -> AnnData:
@@ -150,8 +544,8 @@ def group_obs_fun_inplace(
     adata :class:`~anndata.AnnData`
         Annotated data matrix object
 
-    group_key : Union[str, List[str]]
-        obs keys to group by
+    group_key : Union[str, List[str], GroupIndex]
+        obs keys to group by, or a prebuilt :class:`scmorph.utils.GroupIndex`
 
     fun : Callable
         Function that takes array and returns array of equal size.
@@ -165,20 +559,116 @@ def group_obs_fun_inplace(
     """
     from tqdm import tqdm
 
-    grouped = adata.obs.groupby(group_key, observed=True)
+    index = get_group_index(adata, group_key)
 
     takes_group = len(signature(fun).parameters) > 1
 
-    items = grouped.indices.items()
-    items = tqdm(items, unit=" groups") if progress else items
+    items = index.items()
+    items = tqdm(items, total=len(index), unit=" groups") if progress else items
 
+    X_full = adata.X
+    direct = isinstance(X_full, np.ndarray) and not adata.is_view
     for group, idx in items:
-        X = adata[idx].X
-        adata[idx].X = fun(X, group) if takes_group else fun(X)
+        if direct:
+            X_full[idx] = fun(X_full[idx], group) if takes_group else fun(X_full[idx])
+        else:
+            X = adata[idx].X
+            adata[idx].X = fun(X, group) if takes_group else fun(X)
+
+    return adata
+
+
+def group_broadcast_inplace(
+    adata: AnnData,
+    group_key: str | list[str] | GroupIndex,
+    params: pd.DataFrame | np.ndarray,
+    operation: str = "subtract",
+    layer: str | None = None,
+    chunk_size: int = 10000,
+) -> AnnData:
+    """
+    Apply per-group parameter vectors to the data inplace
+
+    Instead of selecting each group, the parameters of each cell's group are
+    gathered by group code and applied to blocks of `chunk_size` cells, e.g.
+    ``X -= params[:, codes].T``. This is a single pass over the data and also works on backed data.
+    Cells that do not belong to any group (missing keys) are left unchanged.
+
+    Parameters
+    ----------
+    adata : :class:`~anndata.AnnData`
+        Annotated data matrix object
+    group_key : str | list[str] | GroupIndex
+        obs keys to group by, or a prebuilt :class:`scmorph.utils.GroupIndex`
+    params : pd.DataFrame | np.ndarray
+        Parameters of shape features × groups. If a DataFrame, rows are matched to `var_names`
+        and columns to group labels. Features missing from `params` are left unchanged.
+        If an array, columns must be in the order of the :class:`scmorph.utils.GroupIndex`.
+    operation : str
+        How to apply the parameters, one of "subtract", "add", "multiply" and "divide".
+        By default "subtract"
+    layer : str | None
+        Layer to modify, by default None (i.e. `X`)
+    chunk_size : int
+        Number of cells to process at once, by default 10000
 
+    Returns
+    -------
+    AnnData
+        Annotated data matrix object after the operation
+    """
+    ufuncs = {"subtract": np.subtract, "add": np.add, "multiply": np.multiply, "divide": np.divide}
+    if operation not in ufuncs:
+        raise ValueError(f"Operation must be one of {', '.join(ufuncs)}. Received {operation}")
+    ufunc = ufuncs[operation]
+
+    index = get_group_index(adata, group_key)
+
+    if isinstance(params, pd.DataFrame):
+        missing = [key for key in index.keys if key not in params.columns]
+        if missing:
+            raise ValueError(f"No parameters for groups: {', '.join(map(str, missing))}")
+        neutral = 0 if operation in {"subtract", "add"} else 1
+        params = params.reindex(index=adata.var_names, fill_value=neutral)[index.keys].to_numpy()
+
+    # one row of parameters per group
+    P = np.ascontiguousarray(np.asarray(params, dtype=np.float64).T)
+    if P.shape != (len(index), adata.n_vars):
+        raise ValueError(f"Expected parameters of shape {(adata.n_vars, len(index))}, received {P.T.shape}")
+
+    X = _getX(adata, layer)
+    if adata.is_view or not (isinstance(X, np.ndarray) or adata.isbacked):
+        # views and other array types are corrected in memory and written back once
+        X = np.array(X)
+        _group_broadcast_blocks(X, index.codes, P, ufunc, chunk_size)
+        if layer is None:
+            adata.X = X
+        else:
+            adata.layers[layer] = X
+        return adata
+
+    _group_broadcast_blocks(X, index.codes, P, ufunc, chunk_size)
     return adata
 
 
+def _group_broadcast_blocks(X: Any, codes: np.ndarray, P: np.ndarray, ufunc: np.ufunc, chunk_size: int) -> None:
+    """Apply `ufunc(X, P[codes])` inplace in row blocks of a numpy array or h5py dataset"""
+    in_memory = isinstance(X, np.ndarray)
+    for start in range(0, X.shape[0], chunk_size):
+        end = min(start + chunk_size, X.shape[0])
+        block = X[start:end] if in_memory else np.asarray(X[start:end])
+        block_codes = codes[start:end]
+
+        if (block_codes >= 0).all():
+            ufunc(block, P[block_codes].astype(block.dtype, copy=False), out=block, casting="unsafe")
+        else:
+            valid = block_codes >= 0
+            block[valid] = ufunc(block[valid], P[block_codes[valid]])
+
+        if not in_memory:
+            X[start:end] = block
+
+
 def _get_group_keys(
     adata: AnnData,
     treatment_key: str | None,
@@ -211,13 +701,16 @@ def _get_group_keys(
 
 def get_grouped_op(
     adata: AnnData,
-    group_key: list[str],
-    operation: str,
+    group_key: list[str] | GroupIndex,
+    operation: str | list[str],
     as_anndata: bool = False,
     layer: str | None = None,
     store: bool = True,
     progress: bool = True,
-) -> pd.DataFrame | AnnData:
+    approximate: bool = False,
+    skipna: bool = False,
+    **kwargs: Any,
+) -> pd.DataFrame | dict[str, pd.DataFrame] | AnnData:
     """
     Retrieve from cache or compute a grouped operation
 
@@ -225,62 +718,92 @@ def get_grouped_op(
     ----------
     adata :class:`~anndata.AnnData`
         AnnData object
-    group_key : List[str]
-        Column name in `obs` metadata to group by
-    operation : str
+    group_key : List[str] | GroupIndex
+        Column name in `obs` metadata to group by, or a prebuilt :class:`scmorph.utils.GroupIndex`
+    operation : str | list[str]
         What operation to perform, one of "mean", "logmean", "median", "std",
-        "var", "sem", "mad" and "mad_scaled".
+        "var", "sem", "mad", "mad_scaled", "quantile" and "count". If a list is given,
+        all operations not found in the cache are computed in a single pass.
     as_anndata : bool,
-        Whether to return an AnnData object, by default False
+        Whether to return an AnnData object, by default False. If `operation`
+        is a list or `q` a sequence of quantiles, each result is stored in a layer named after the operation
+        and `X` holds the result of the first operation.
     layer : Optional[str]
         Which layer to retrieve data from, by default None
     store : bool
-        Whether to retrieve from/save to cache the result, by default True
+        Whether to retrieve from/save to cache the result, by default True.
+        Results are cached by a fingerprint of the data, grouping and layer,
+        so they are recomputed after the data changes. The fingerprint hashes all of the data,
+        so each lookup reads the data once. See :func:`scmorph.utils.set_cache`
+        to configure the cache size or persist results to disk.
     progress : bool
         Whether to show a progress bar, by default True
+    approximate : bool
+        Whether to approximate quantile-based operations with streaming sketches,
+        see :func:`scmorph.utils.grouped_op`. By default False
+    skipna : bool
+        Whether to ignore missing values per feature, see :func:`scmorph.utils.grouped_op`.
+        By default False
+    kwargs : Any
+        Other arguments passed to :func:`scmorph.utils.grouped_op`
 
     Returns
     -------
-    pd.DataFrame
-        Result of grouped operation
+    pd.DataFrame | dict[str, pd.DataFrame] | AnnData
+        Result of grouped operation. If `operation` is a list or `q` a sequence of quantiles
+        and `as_anndata` is False, a dictionary mapping each operation to its result.
     """
-    keys_tuple = tuple(group_key)
-    stored_present = False
+    operations = [operation] if isinstance(operation, str) else list(operation)
+    if "q" in kwargs and np.ndim(kwargs["q"]) > 0:
+        operations = _quantile_names(operations, kwargs.pop("q"))
+    suffix = "_approx" if approximate else ""
+    suffix += "_skipna" if skipna else ""
+    suffix += "".join(f"_{k}={v}" for k, v in sorted(kwargs.items()))
+    res = {}
 
     if store:
-        if "grouped_ops" not in adata.uns:
-            adata.uns["grouped_ops"] = {}
-
-        if keys_tuple not in adata.uns["grouped_ops"]:
-            adata.uns["grouped_ops"][keys_tuple] = {}
-
-        if operation in adata.uns["grouped_ops"][keys_tuple]:
-            stored_present = True
-            res = adata.uns["grouped_ops"][keys_tuple][operation]
-
-    if not stored_present:
-        res = grouped_op(
+        cache = get_cache()
+        data_fingerprint = fingerprint(adata, group_key, layer)
+        cache_keys = {op: cache.key(data_fingerprint, op + suffix) for op in operations}
+        for op in operations:
+            cached = cache.get(cache_keys[op])
+            if cached is not None:
+                res[op] = cached
+
+    missing = [op for op in operations if op not in res]
+    if missing:
+        computed = grouped_op(
             adata,
             group_key=group_key,
-            operation=operation,
+            operation=missing,
             layer=layer,
             progress=progress,
+            approximate=approximate,
+            skipna=skipna,
+            **kwargs,
         )
+        res.update(computed)
 
         if store:
-            adata.uns["grouped_ops"][keys_tuple][operation] = res
+            for op in missing:
+                cache.set(cache_keys[op], computed[op])
 
-    return grouped_op_to_anndata(res, group_key) if as_anndata else res
+    group_names = _group_key_names(group_key)
+    if isinstance(operation, str) and len(operations) == 1:
+        return grouped_op_to_anndata(res[operation], group_names) if as_anndata else res[operation]
+    res = {op: res[op] for op in operations}
+    return grouped_op_to_anndata(res, group_names) if as_anndata else res
 
 
-def grouped_op_to_anndata(df: pd.DataFrame, group_key: list[str]) -> AnnData:
+def grouped_op_to_anndata(df: pd.DataFrame | dict[str, pd.DataFrame], group_key: list[str]) -> AnnData:
     """
     Convert a result from a grouped operation into AnnData
 
     Parameters
     ----------
-    df : pd.DataFrame
-            Result from grouped operation
+    df : pd.DataFrame | dict[str, pd.DataFrame]
+            Result from grouped operation. If a dictionary of results, each
+            is stored in a layer named after its key and `X` holds the first result.
     group_key : List[str]
             Keys used for grouping
 
@@ -289,6 +812,10 @@ def grouped_op_to_anndata(df: pd.DataFrame, group_key: list[str]) -> AnnData:
     AnnData
             Converted object
     """
+    layers = df if isinstance(df, dict) else {}
+    if layers:
+        df = next(iter(layers.values()))
+
     if len(group_key) == 1:
         obs = pd.DataFrame(df.columns, index=df.columns, columns=group_key)
     else:
@@ -296,7 +823,10 @@ def grouped_op_to_anndata(df: pd.DataFrame, group_key: list[str]) -> AnnData:
     obs.index = obs.index.astype(str)
     X = df.T
     X.index = obs.index
-    return AnnData(X=X, obs=obs)
+    adata = AnnData(X=X, obs=obs)
+    for name, layer_df in layers.items():
+        adata.layers[name] = layer_df.loc[df.index, df.columns].T.to_numpy()
+    return adata
 
 
 def anndata_to_df(adata: AnnData) -> pd.DataFrame:
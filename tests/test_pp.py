@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -39,11 +40,78 @@ def test_aggregate_modes(adata):
         assert agg.shape == (20, adata.shape[1])
 
 
+def test_aggregate_multiple_methods(adata):
+    methods = ["median", "mad", "mean", "std"]
+    agg = sm.pp.aggregate(
+        adata, method=methods, group_keys=["Image_Metadata_Plate"], well_key="Image_Metadata_Well", progress=False
+    )
+    assert agg.shape == (20, adata.shape[1])
+    assert all(agg.layers[m].shape == agg.shape for m in methods)
+
+
+def test_aggregate_hierarchy(adata):
+    levels = {"well": ["Image_Metadata_Well", "Image_Metadata_Plate"], "plate": "Image_Metadata_Plate"}
+    agg = sm.pp.aggregate_hierarchy(adata, levels, method=["mean", "std", "median"], progress=False)
+    well = sm.pp.aggregate(
+        adata, method="mean", group_keys=["Image_Metadata_Plate"], well_key="Image_Metadata_Well", progress=False
+    )
+    assert agg["well"].shape == well.shape
+    np.testing.assert_allclose(agg["well"].layers["mean"], well.X, rtol=1e-4, equal_nan=True)
+    assert agg["plate"].n_obs == adata.obs["Image_Metadata_Plate"].nunique()
+
+
+def test_aggregate_modz():
+    from anndata import AnnData
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(13, 20))
+    treatment = np.array(list("aaaabbbccddde"))
+    wells = AnnData(X, obs=pd.DataFrame({"TARGETGENE": treatment}, index=[f"w{i}" for i in range(13)]))
+    agg = sm.pp.aggregate_modz(wells, treatment_key="TARGETGENE")
+    assert agg.shape == (5, 20)
+
+    for i, group in enumerate(agg.obs["TARGETGENE"]):
+        replicates = X[treatment == group]
+        weights = np.ones(1)
+        if len(replicates) > 1:
+            corr = pd.DataFrame(replicates.T).corr("spearman").clip(lower=0).to_numpy()
+            weights = np.maximum((corr.sum(axis=1) - 1) / (len(replicates) - 1), 0.01)
+            weights /= weights.sum()
+        np.testing.assert_allclose(agg.X[i], weights @ replicates)
+        np.testing.assert_allclose(wells[treatment == group].obs_names.map(agg.uns["modz_weights"]), weights)
+
+    # Spearman correlations are 0.8 (w0, w1), -1 (w0, w2) and -0.8 (w1, w2), so cmapPy's
+    # clipped mean correlations are 0.4, 0.4 and 0, the latter clamped to min_weight
+    X = np.array([[1, 2, 3, 4], [1, 2, 4, 3], [4, 3, 2, 1], [5, 6, 7, 8]], dtype=float)
+    wells = AnnData(X, obs=pd.DataFrame({"TARGETGENE": list("aaab")}, index=[f"w{i}" for i in range(4)]))
+    agg = sm.pp.aggregate_modz(wells, treatment_key="TARGETGENE")
+    expected = np.array([0.4, 0.4, 0.01, 0.81]) / 0.81
+    np.testing.assert_allclose(agg.uns["modz_weights"].to_numpy(), expected)
+    np.testing.assert_allclose(agg.X, [expected[:3] @ X[:3], X[3]])
+
+
 def test_aggregate_mahalanobis(adata_treat):
     agg = sm.pp.aggregate_mahalanobis(adata_treat, treatment_key="TARGETGENE", well_key="Image_Metadata_Well")
     assert agg.shape == (1,)
 
 
+def test_aggregate_mahalanobis_per_treatment(adata_treat):
+    import anndata
+
+    from scmorph.pp.aggregate import _pca_mahalanobis
+
+    kwargs = {"treatment_key": "TARGETGENE", "well_key": "Image_Metadata_Well", "per_treatment": True}
+    dists = sm.pp.aggregate_mahalanobis(adata_treat, **kwargs)
+    np.testing.assert_allclose(sm.pp.aggregate_mahalanobis(adata_treat, n_cores=2, **kwargs), dists)
+
+    # matches redoing scaling and PCA for each treatment
+    agg = sm.pp.aggregate(adata_treat, well_key="Image_Metadata_Well", group_keys="TARGETGENE", progress=False)
+    control = agg[agg.obs["TARGETGENE"] == "DMSO"]
+    for treatment, dist in dists.items():
+        joint = anndata.concat([control, agg[agg.obs["TARGETGENE"] == treatment]])
+        np.testing.assert_allclose(_pca_mahalanobis(joint, "TARGETGENE", "DMSO")[0], dist, rtol=1e-3)
+
+
 def test_aggregate_pc(adata_treat):
     sm.pp.drop_na(adata_treat)
     agg = sm.pp.aggregate_pc(adata_treat, treatment_key="TARGETGENE")
@@ -64,7 +132,366 @@ def test_aggregate_ttest_summary(adata_treat):
     assert t.shape == (1,)
 
 
+def test_aggregate_ttest_matches_scipy(adata_treat):
+    from scipy.stats import ttest_ind
+
+    sm.pp.drop_na(adata_treat)
+    tstats = sm.pp.aggregate_ttest(adata_treat, treatment_key="TARGETGENE")[0]
+    treatment = adata_treat.obs["TARGETGENE"]
+    for group in tstats.columns:
+        expected = ttest_ind(
+            adata_treat[treatment == "DMSO"].X, adata_treat[treatment == group].X, axis=0, equal_var=False
+        )[0]
+        np.testing.assert_allclose(tstats[group], expected, rtol=1e-3)
+
+
+def test_aggregate_ttest_missing_group_keys():
+    from anndata import AnnData
+    from scipy.stats import ttest_ind
+
+    rng = np.random.default_rng(10)
+    obs = pd.DataFrame(
+        {"TARGETGENE": rng.choice(["DMSO", "x"], 400), "Image_Metadata_Well": rng.choice(["w1", "w2", None], 400)},
+        index=[str(i) for i in range(400)],
+    )
+    adata = AnnData(rng.normal(size=(400, 3)) + (obs["TARGETGENE"] == "x").to_numpy()[:, None], obs=obs)
+
+    tstats = sm.pp.aggregate_ttest(adata, treatment_key="TARGETGENE", group_key="Image_Metadata_Well")[0]
+    control = adata.X[obs["TARGETGENE"] == "DMSO"]
+    for well in ["w1", "w2"]:
+        treated = adata.X[((obs["TARGETGENE"] == "x") & (obs["Image_Metadata_Well"] == well)).to_numpy()]
+        expected = ttest_ind(control, treated, axis=0, equal_var=False)[0]
+        np.testing.assert_allclose(tstats[("x", well)], expected)
+
+
+def test_aggregate_distribution(adata_treat):
+    from scipy.stats import ks_2samp, mannwhitneyu, wasserstein_distance
+
+    sm.pp.drop_na(adata_treat)
+    res = sm.pp.aggregate_distribution(adata_treat, treatment_key="TARGETGENE", method=["wasserstein", "ks", "auc"])
+    treatment = adata_treat.obs["TARGETGENE"]
+    group = res["ks"].columns[0]
+    control, treated = adata_treat[treatment == "DMSO"].X, adata_treat[treatment == group].X
+    for f in range(5):
+        c, t = control[:, f], treated[:, f]
+        assert res["wasserstein"].iloc[f][group] == pytest.approx(wasserstein_distance(c, t))
+        assert res["ks"].iloc[f][group] == pytest.approx(ks_2samp(c, t).statistic)
+        assert res["auc"].iloc[f][group] == pytest.approx(mannwhitneyu(t, c).statistic / len(c) / len(t))
+
+
+@pytest.mark.parametrize("method", ["mahalanobis", "pc", "tstat"])
+def test_permutation_test(adata_treat, method):
+    sm.pp.drop_na(adata_treat)
+    kwargs = {"treatment_key": "TARGETGENE", "well_key": "Image_Metadata_Well", "method": method}
+    res = sm.pp.permutation_test(adata_treat, n_permutations=99, **kwargs)
+    assert list(res.columns) == ["distance", "pvalue", "qvalue"]
+    assert ((res["pvalue"] >= 0.01) & (res["pvalue"] <= 1)).all()
+    pd.testing.assert_frame_equal(sm.pp.permutation_test(adata_treat, n_permutations=99, n_cores=2, **kwargs), res)
+
+    if method == "tstat":
+        tstats = sm.pp.aggregate_ttest(adata_treat, treatment_key="TARGETGENE")[0]
+        np.testing.assert_allclose(res["distance"], sm.pp.tstat_distance(tstats)[res.index], rtol=1e-3)
+
+
+@pytest.mark.parametrize("log", [False, True])
+def test_compute_batch_effects_backed(tmp_path, log):
+    from anndata import AnnData, read_h5ad
+
+    from scmorph.pp.batch_effects import compute_batch_effects
+
+    rng = np.random.default_rng(0)
+    n_cells = 600
+    obs = pd.DataFrame(
+        {
+            "line": rng.choice(["A", "B"], n_cells),
+            "Image_Metadata_Plate": rng.choice(["P1", "P2", "P3"], n_cells),
+            "TARGETGENE": rng.choice(["DMSO", "drug"], n_cells),
+        },
+        index=[f"cell{i}" for i in range(n_cells)],
+    )
+    plate_effect = obs["Image_Metadata_Plate"].map({"P1": 0, "P2": 1, "P3": -0.5}).to_numpy()
+    X = rng.uniform(size=(n_cells, 4)) + plate_effect[:, None]
+    X[obs["TARGETGENE"] == "drug", 0] -= 5  # only treated cells fall below -0.99
+    adata = AnnData(X, obs=obs)
+    kwargs = {"bio_key": "line", "batch_key": "Image_Metadata_Plate", "log": log, "progress": False}
+
+    # in-memory reference on control cells only
+    betas, gammas = compute_batch_effects(adata[adata.obs["TARGETGENE"] == "DMSO"].copy(), **kwargs)
+    adata.write_h5ad(tmp_path / "backed.h5ad")
+    backed = read_h5ad(tmp_path / "backed.h5ad", backed="r")
+    betas_b, gammas_b = compute_batch_effects(
+        backed, treatment_key="TARGETGENE", control="DMSO", chunk_size=77, **kwargs
+    )
+    pd.testing.assert_frame_equal(betas_b, betas)
+    pd.testing.assert_frame_equal(gammas_b, gammas)
+    if not log:
+        np.testing.assert_allclose(gammas.loc[:, "P2"], 1, atol=0.15)
+
+
+def test_batch_effect_model(tmp_path):
+    from anndata import AnnData, read_h5ad
+
+    rng = np.random.default_rng(1)
+    n_cells = 900
+    obs = pd.DataFrame(
+        {"line": rng.choice(["A", "B"], n_cells), "Image_Metadata_Plate": rng.choice(["P1", "P2", "P3"], n_cells)},
+        index=[f"cell{i}" for i in range(n_cells)],
+    )
+    X = (
+        rng.normal(size=(n_cells, 3))
+        + obs["Image_Metadata_Plate"].map({"P1": 0, "P2": 2, "P3": -1}).to_numpy()[:, None]
+    )
+    adata = AnnData(X, obs=obs)
+    kwargs = {"bio_key": "line", "batch_key": "Image_Metadata_Plate"}
+    full = sm.pp.BatchEffectModel(**kwargs).fit(adata, progress=False)
+
+    # adding a plate reproduces the full fit, since all lines are on every plate
+    is_new = (obs["Image_Metadata_Plate"] == "P3").to_numpy()
+    model = sm.pp.BatchEffectModel(**kwargs).fit(adata[~is_new], progress=False)
+    model.partial_fit(adata[is_new], progress=False)
+    pd.testing.assert_frame_equal(model.gammas, full.gammas)
+
+    model.save(tmp_path / "model.npz")
+    loaded = sm.pp.BatchEffectModel.load(tmp_path / "model.npz")
+    pd.testing.assert_frame_equal(loaded.gammas, model.gammas)
+    pd.testing.assert_frame_equal(loaded.betas, model.betas)
+
+    # correct a new plate streamed from disk
+    expected = full.transform(adata, copy=True).X[is_new]
+    adata[is_new].copy().write_h5ad(tmp_path / "plate.h5ad")
+    plate = read_h5ad(tmp_path / "plate.h5ad", backed="r+")
+    loaded.transform(plate)
+    plate.file.close()
+    np.testing.assert_allclose(read_h5ad(tmp_path / "plate.h5ad").X, expected)
+
+    with pytest.raises(ValueError, match="partial_fit"):
+        sm.pp.BatchEffectModel(**kwargs).fit(adata[~is_new], progress=False).transform(adata)
+
+
+def test_solve_batch_effects_unbalanced():
+    from scmorph.pp.batch_effects import _solve_batch_effects
+
+    rng = np.random.default_rng(2)
+    groups = pd.DataFrame(
+        [(line, plate) for line in "ABC" for plate in range(6) if not (line == "C" and plate > 2)],
+        columns=["line", "plate"],
+    )
+    data = pd.DataFrame(rng.normal(size=(4, len(groups))), index=[f"f{i}" for i in range(4)])
+    intercept, betas, gammas = _solve_batch_effects(data, groups, "line", "plate")
+
+    # dense treatment-coded least squares
+    design = np.column_stack(
+        [np.ones(len(groups)), pd.get_dummies(groups["line"]).iloc[:, 1:], pd.get_dummies(groups["plate"]).iloc[:, 1:]]
+    ).astype(np.float64)
+    params = np.linalg.lstsq(design, data.T.to_numpy(), rcond=None)[0]
+    np.testing.assert_allclose(intercept, params[0], atol=1e-8)
+    np.testing.assert_allclose(betas.iloc[:, 1:].T, params[1:3], atol=1e-8)
+    np.testing.assert_allclose(gammas.iloc[:, 1:].T, params[3:], atol=1e-8)
+    assert (betas.iloc[:, 0] == 0).all() and (gammas.iloc[:, 0] == 0).all()
+
+
+def test_quantile_norm_kernels():
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    from scmorph.pp.quantile_norm import _quantile, _running_median
+
+    rng = np.random.default_rng(4)
+    x = np.round(rng.normal(size=(301, 3)), 1)  # with ties
+    for window in [3, 5, 31]:
+        k2 = window // 2
+        expected = np.median(sliding_window_view(np.pad(x, [(k2, k2), (0, 0)], mode="edge"), window, axis=0), axis=2)
+        expected[:k2], expected[-k2:] = expected[k2], expected[-k2 - 1]
+        np.testing.assert_array_equal(_running_median(x, window), expected)
+        np.testing.assert_array_equal(_running_median(x[:, 0], window), expected[:, 0])
+
+    for q in [np.linspace(0, 1, len(x)), np.linspace(0, 1, 17)]:
+        np.testing.assert_array_equal(_quantile(x, q)[1], np.quantile(x, q, axis=0, method="inverted_cdf"))
+
+
+def test_quantile_normalize(tmp_path):
+    from anndata import AnnData, read_h5ad
+
+    rng = np.random.default_rng(3)
+    plate = rng.choice(["P1", "P2", "P3"], 1500)
+    shift = pd.Series(plate).map({"P1": 0, "P2": 2, "P3": -1}).to_numpy()[:, None]
+    X = rng.normal(size=(len(plate), 4)) * (1 + (plate == "P2"))[:, None] + shift
+    X[:, 3] = rng.poisson(3, len(plate)) + shift[:, 0]  # discrete feature with ties
+    adata = AnnData(X, obs=pd.DataFrame({"Image_Metadata_Plate": plate}, index=[f"c{i}" for i in range(len(plate))]))
+
+    normalized = sm.pp.quantile_normalize(adata, "Image_Metadata_Plate", n_quantiles=200, progress=False, copy=True)
+    quantiles = [np.quantile(normalized.X[plate == p, :3], [0.1, 0.5, 0.9], axis=0) for p in ["P1", "P2", "P3"]]
+    np.testing.assert_allclose(quantiles[0], quantiles[1], atol=0.05)
+    np.testing.assert_allclose(quantiles[0], quantiles[2], atol=0.05)
+    # ranks within each plate are preserved
+    for p in ["P1", "P2", "P3"]:
+        assert (np.diff(normalized.X[plate == p][np.argsort(X[plate == p, 0]), 0]) >= 0).all()
+
+    adata.write_h5ad(tmp_path / "backed.h5ad")
+    backed = read_h5ad(tmp_path / "backed.h5ad", backed="r+")
+    sm.pp.quantile_normalize(backed, "Image_Metadata_Plate", n_quantiles=200, progress=False, chunk_size=333)
+    backed.file.close()
+    np.testing.assert_allclose(read_h5ad(tmp_path / "backed.h5ad").X, normalized.X)
+
+    # integer data is normalized as float rather than truncated
+    counts = AnnData(np.round(X * 10).astype(np.int64), obs=adata.obs)
+    kwargs = {"n_quantiles": 200, "progress": False, "copy": True}
+    from_int = sm.pp.quantile_normalize(counts, "Image_Metadata_Plate", **kwargs).X
+    counts.X = counts.X.astype(np.float64)
+    np.testing.assert_allclose(from_int, sm.pp.quantile_normalize(counts, "Image_Metadata_Plate", **kwargs).X)
+    assert not np.allclose(from_int, np.round(from_int))
+
+
 def test_scale_by_plate(adata):
     sm.pp.scale_by_batch(adata, batch_key="Image_Metadata_Plate")
     X = pd.concat([adata.obs["Image_Metadata_Plate"], adata[:, 0].to_df()], axis=1)
     assert all(X.groupby("Image_Metadata_Plate").mean() < 1e-7)
+
+
+def test_position_effects(tmp_path):
+    from anndata import AnnData, read_h5ad
+
+    from scmorph.pp.batch_effects import _parse_wells
+
+    rows, cols = _parse_wells(["A01", "b2", "P24", "AA1", "AF48"])
+    np.testing.assert_array_equal(rows, [0, 1, 15, 26, 31])
+    np.testing.assert_array_equal(cols, [0, 1, 23, 0, 47])
+    with pytest.raises(ValueError, match="Could not parse"):
+        _parse_wells(["A01", "1A"])
+
+    rng = np.random.default_rng(5)
+    wells = [f"{r}{c:02d}" for r in "ABCDEFGH" for c in range(1, 13)]
+    obs = pd.DataFrame(
+        [(plate, well) for plate in ["P1", "P2"] for well in wells for _ in range(5)],
+        columns=["Image_Metadata_Plate", "Image_Metadata_Well"],
+    )
+    obs = obs.drop(index=obs.index[obs["Image_Metadata_Well"] == "D05"][:5])  # one missing well
+    obs.index = [f"c{i}" for i in range(len(obs))]
+    row, col = _parse_wells(obs["Image_Metadata_Well"])
+    gradient = 0.5 * row[:, None] + np.where(col == 0, 3, 0)[:, None] * [1, -1]  # gradient and edge effect
+    plate_shift = (obs["Image_Metadata_Plate"] == "P2").to_numpy()[:, None] * 10
+    X = rng.normal(size=(len(obs), 2)) * 0.1 + gradient + plate_shift
+    adata = AnnData(X, obs=obs)
+    keys = ["Image_Metadata_Well", "Image_Metadata_Plate"]
+
+    effects, plate_effects, plate_mad = sm.pp.compute_position_effects(adata, *keys, progress=False)
+    assert effects.shape == (2, len(adata.obs.drop_duplicates()))
+    assert plate_effects.loc["1", "P2"] - plate_effects.loc["1", "P1"] == pytest.approx(10, abs=0.2)
+
+    corrected = sm.pp.remove_position_effects(adata, *keys, progress=False, copy=True)
+    well_means = pd.DataFrame(corrected.X - plate_shift).groupby([row, col]).mean()
+    assert well_means.std().max() < 0.2 * pd.DataFrame(X - plate_shift).groupby([row, col]).mean().std().min()
+
+    bscores = sm.pp.remove_position_effects(adata, *keys, bscore=True, progress=False, copy=True)
+    medians = pd.DataFrame(bscores.X).groupby(obs["Image_Metadata_Plate"].to_numpy()).median()
+    np.testing.assert_allclose(medians, 0, atol=1)
+
+    adata.write_h5ad(tmp_path / "backed.h5ad")
+    backed = read_h5ad(tmp_path / "backed.h5ad", backed="r+")
+    sm.pp.remove_position_effects(backed, *keys, progress=False)
+    backed.file.close()
+    np.testing.assert_allclose(read_h5ad(tmp_path / "backed.h5ad").X, corrected.X)
+
+
+def test_bscore_constant_feature():
+    from anndata import AnnData
+
+    rng = np.random.default_rng(9)
+    wells = [f"{r}{c:02d}" for r in "ABCD" for c in range(1, 7)]
+    obs = pd.DataFrame({"plate": np.repeat(["P1", "P2"], len(wells)), "well": wells * 2})
+    obs.index = obs.index.astype(str)
+    X = np.column_stack([rng.normal(size=len(obs)), np.full(len(obs), 3.0)])
+    X[obs["plate"] == "P2", 0] = np.nan  # no residuals of the first feature on P2
+    adata = AnnData(X, obs=obs)
+
+    sm.pp.remove_position_effects(adata, "well", "plate", bscore=True, progress=False)
+    np.testing.assert_array_equal(adata.X[:, 1], 0)
+    assert np.isfinite(adata.X[obs["plate"] == "P1"]).all()
+
+
+def test_median_polish():
+    from scmorph.pp.batch_effects import _median_polish
+
+    def medpolish(x, max_iter=10, tol=0.01):
+        # direct translation of R's stats::medpolish with na.rm = TRUE
+        z, r, c, t, old = x.copy(), np.zeros(x.shape[0]), np.zeros(x.shape[1]), 0.0, 0.0
+        for _ in range(max_iter):
+            delta = np.nanmedian(z, axis=1)
+            z, r = z - delta[:, None], r + delta
+            delta = np.median(c)
+            c, t = c - delta, t + delta
+            delta = np.nanmedian(z, axis=0)
+            z, c = z - delta, c + delta
+            delta = np.median(r)
+            r, t = r - delta, t + delta
+            new = np.nansum(np.abs(z))
+            if new == 0 or abs(new - old) < tol * new:
+                break
+            old = new
+        return t, r, c, z
+
+    rng = np.random.default_rng(6)
+    grid = rng.normal(size=(3, 8, 12, 2)) + np.arange(8)[:, None, None] + np.arange(12)[:, None] ** 2
+    grid[0, 2, 3, 0] = grid[1, 4, :6, 1] = np.nan
+    overall, row, col, residuals = _median_polish(grid)
+    np.testing.assert_allclose(overall + row + col + residuals, grid)
+    for plate in range(3):
+        for feature in range(2):
+            t, r, c, z = medpolish(grid[plate, :, :, feature])
+            np.testing.assert_allclose(overall[plate, 0, 0, feature], t)
+            np.testing.assert_allclose(row[plate, :, 0, feature], r)
+            np.testing.assert_allclose(col[plate, 0, :, feature], c)
+            np.testing.assert_allclose(residuals[plate, :, :, feature], z)
+
+
+def _run_after_numba(call: str) -> str:
+    """Run `call` on synthetic data in a fresh interpreter, after a numba-parallel kernel has started its threads"""
+    import subprocess
+    import sys
+
+    script = f"""
+import numpy as np, pandas as pd
+from anndata import AnnData
+import scmorph as sm
+
+rng = np.random.default_rng(0)
+wells = np.repeat([f"A{{i:02d}}" for i in range(12)], 30)
+treatment = pd.Series(wells).map(lambda w: ["DMSO", "DMSO", "DMSO", "drug1", "drug2", "drug3"][int(w[1:]) % 6]).to_numpy()
+obs = pd.DataFrame({{"TARGETGENE": treatment, "Image_Metadata_Well": wells}}, index=[str(i) for i in range(len(wells))])
+adata = AnnData(rng.normal(size=(len(wells), 5)) + (treatment != "DMSO")[:, None], obs=obs)
+kwargs = {{"treatment_key": "TARGETGENE", "well_key": "Image_Metadata_Well"}}
+sm.pp.aggregate_distribution(adata, treatment_key="TARGETGENE")
+print({call})
+"""
+    res = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=300)
+    assert res.returncode == 0, res.stderr
+    return res.stdout
+
+
+def test_permutation_test_after_numba():
+    kwargs = "**kwargs, method='pc', n_permutations=99"
+    parallel = _run_after_numba(f"sm.pp.permutation_test(adata, n_cores=2, {kwargs})")
+    assert parallel == _run_after_numba(f"sm.pp.permutation_test(adata, {kwargs})")
+
+
+def test_aggregate_mahalanobis_after_numba():
+    parallel = _run_after_numba("sm.pp.aggregate_mahalanobis(adata, n_cores=2, per_treatment=True, **kwargs)")
+    assert parallel == _run_after_numba("sm.pp.aggregate_mahalanobis(adata, per_treatment=True, **kwargs)")
+
+
+def _controls_only():
+    from anndata import AnnData
+
+    wells = np.repeat([f"A{i:02d}" for i in range(6)], 20)
+    obs = pd.DataFrame({"TARGETGENE": "DMSO", "Image_Metadata_Well": wells}, index=[str(i) for i in range(len(wells))])
+    adata = AnnData(np.random.default_rng(0).normal(size=(len(wells), 5)), obs=obs)
+    return adata, {"treatment_key": "TARGETGENE", "well_key": "Image_Metadata_Well", "n_cores": 2, "progress": False}
+
+
+def test_aggregate_mahalanobis_no_treatments():
+    adata, kwargs = _controls_only()
+    assert sm.pp.aggregate_mahalanobis(adata, per_treatment=True, **kwargs).empty
+
+
+def test_permutation_test_no_treatments():
+    adata, kwargs = _controls_only()
+    assert sm.pp.permutation_test(adata, method="pc", n_permutations=9, **kwargs).empty
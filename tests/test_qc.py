@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anndata import AnnData
+
+import scmorph as sm
+
+
+@pytest.fixture
+def mixing_data():
+    rng = np.random.default_rng(7)
+    n = 1200
+    batch = rng.choice(["P1", "P2", "P3"], n)
+    treatment = rng.choice(["DMSO", "drug"], n)
+    shift = pd.Series(batch).map({"P1": 0, "P2": 4, "P3": -4}).to_numpy()[:, None]
+    X = rng.normal(size=(n, 10)) + (treatment == "drug")[:, None] * 3
+    obs = pd.DataFrame({"batch": batch, "treatment": treatment}, index=[f"c{i}" for i in range(n)])
+    return AnnData(X + shift, obs=obs), AnnData(X, obs=obs)
+
+
+def test_batch_mixing(mixing_data):
+    before, after = mixing_data
+    res = sm.qc.batch_mixing(
+        {"before": before, "after": after}, bio_key="treatment", n_cells=1000, n_neighbors=30, approximate=False
+    )
+    assert list(res.index) == ["before", "after"]
+    assert res.loc["before", "kbet_acceptance"] < 0.1 < 0.8 < res.loc["after", "kbet_acceptance"]
+    assert res.loc["before", "ilisi_batch"] < 1.5 < 2.5 < res.loc["after", "ilisi_batch"]
+    assert res.loc["after", "silhouette_batch"] < 0.1 < res.loc["before", "silhouette_batch"]
+    assert res.loc["after", "clisi_bio"] < 1.2
+    assert res.loc["after", "silhouette_bio"] > 0.3
+
+    only_batch = sm.qc.batch_mixing(before, "batch", n_cells=1000, n_neighbors=30, approximate=False)
+    assert only_batch[["clisi_bio", "silhouette_bio"]].isna().all().all()
+    assert only_batch.loc["data", "kbet_acceptance"] == res.loc["before", "kbet_acceptance"]
+
+
+def test_mixing_metrics():
+    from scipy.stats import chisquare
+    from sklearn.metrics import silhouette_samples
+
+    from scmorph.qc.mixing import _kbet_acceptance, _lisi, _neighbor_weights, _simplified_silhouette
+
+    rng = np.random.default_rng(8)
+    codes = rng.integers(0, 3, 500)
+    neighbors = rng.integers(0, 500, (500, 20))
+    expected = np.bincount(codes) / len(codes) * 20
+    pvals = [chisquare(np.bincount(codes[row], minlength=3), expected).pvalue for row in neighbors]
+    assert _kbet_acceptance(codes[neighbors], codes, 0.05) == np.mean(np.array(pvals) >= 0.05)
+
+    distances = np.sort(rng.random((500, 20)) * 3, axis=1)
+    weights = _neighbor_weights(distances, perplexity=5)
+    np.testing.assert_allclose(np.exp(-np.sum(weights * np.log(weights), axis=1)), 5, rtol=1e-6)
+    probs = np.stack([weights[i] @ np.eye(3)[codes[neighbors[i]]] for i in range(500)])
+    np.testing.assert_allclose(_lisi(codes[neighbors], weights, 3), 1 / np.sum(probs**2, axis=1))
+
+    # well separated groups have silhouettes close to the exact ones
+    X = rng.normal(size=(500, 5)) + codes[:, None] * 10
+    assert _simplified_silhouette(X, codes) == pytest.approx(silhouette_samples(X, codes).mean(), abs=0.05)
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anndata import AnnData
+
+import scmorph as sm
+
+
+@pytest.fixture
+def profiles():
+    rng = np.random.default_rng(0)
+    n_treatments, n_replicates, n_vars = 40, 4, 30
+    signatures = rng.normal(size=(n_treatments, n_vars))
+    X = np.repeat(signatures, n_replicates, axis=0) + rng.normal(scale=0.5, size=(n_treatments * n_replicates, n_vars))
+    obs = pd.DataFrame(
+        {
+            "TARGETGENE": np.repeat([f"drug{i}" for i in range(n_treatments)], n_replicates),
+            "Image_Metadata_Plate": np.tile([f"P{i}" for i in range(n_replicates)], n_treatments),
+        },
+        index=[f"well{i}" for i in range(len(X))],
+    )
+    return AnnData(X=X.astype(np.float32), obs=obs)
+
+
+@pytest.mark.parametrize("metric", ["cosine", "pearson"])
+def test_similarity_neighbors(profiles, metric):
+    names, sims = sm.tl.similarity_neighbors(profiles, k=5, metric=metric, block_size=17)
+
+    X = profiles.X - (profiles.X.mean(axis=1, keepdims=True) if metric == "pearson" else 0)
+    X = X / np.linalg.norm(X, axis=1, keepdims=True)
+    dense = X @ X.T
+    np.fill_diagonal(dense, -np.inf)
+    expected = np.sort(dense, axis=1)[:, ::-1][:, :5]
+    np.testing.assert_allclose(sims.to_numpy(), expected, rtol=1e-5)
+    assert (names.to_numpy() != profiles.obs_names.to_numpy()[:, None]).all()
+
+
+def test_profile_index_persistence(profiles, tmp_path):
+    index = sm.tl.ProfileIndex.from_anndata(profiles[:100])
+    index.save(tmp_path / "index.npz")
+    loaded = sm.tl.ProfileIndex.load(tmp_path / "index.npz")
+    loaded.add(profiles[100:].X, list(profiles.obs_names[100:]))
+    assert len(loaded) == profiles.n_obs
+
+    names, sims = loaded.query(profiles.X[:3], k=1)
+    assert list(names[0]) == list(profiles.obs_names[:3])
+    np.testing.assert_allclose(sims[0], 1, rtol=1e-5)
+
+
+def test_mean_average_precision(profiles):
+    res = sm.tl.mean_average_precision(profiles, "TARGETGENE", n_null=200, block_size=33)
+    assert res.shape == (40, 4)
+    assert (res["mean_average_precision"] > 0.9).all() and (res["qvalue"] < 0.05).all()
+
+    shuffled = profiles.copy()
+    shuffled.obs["TARGETGENE"] = np.random.default_rng(1).permutation(shuffled.obs["TARGETGENE"].to_numpy())
+    res = sm.tl.mean_average_precision(shuffled, "TARGETGENE", n_null=200, n_cores=2)
+    assert res["mean_average_precision"].mean() < 0.3
+
+    # matches a direct computation of average precision per query
+    X = shuffled.X / np.linalg.norm(shuffled.X, axis=1, keepdims=True)
+    labels = shuffled.obs["TARGETGENE"].to_numpy()
+    expected = {}
+    for i in range(shuffled.n_obs):
+        others = np.delete(np.arange(shuffled.n_obs), i)
+        is_replicate = labels[others][np.argsort(-(X[others] @ X[i]), kind="stable")] == labels[i]
+        ranks = np.flatnonzero(is_replicate) + 1
+        expected.setdefault(labels[i], []).append(np.mean(np.arange(1, len(ranks) + 1) / ranks))
+    expected = pd.Series({k: np.mean(v) for k, v in expected.items()})
+    np.testing.assert_allclose(res["mean_average_precision"], expected[res.index], rtol=1e-5)
+
+
+def test_percent_replicating(profiles):
+    percent, res = sm.tl.percent_replicating(profiles, "TARGETGENE", n_null=200)
+    assert percent == 100
+    assert res["replicating"].all()
+
+    shuffled = profiles.copy()
+    shuffled.obs["TARGETGENE"] = np.random.default_rng(1).permutation(shuffled.obs["TARGETGENE"].to_numpy())
+    assert sm.tl.percent_replicating(shuffled, "TARGETGENE", n_null=200)[0] < 30
+
+
+@pytest.mark.parametrize("group_key", [None, "Image_Metadata_Plate"])
+def test_linear_model(profiles, group_key):
+    from statsmodels.regression.linear_model import OLS
+
+    profiles.obs["dose"] = np.random.default_rng(2).uniform(size=profiles.n_obs)
+    profiles.obs.loc[profiles.obs_names[0], "dose"] = np.nan
+    res = sm.tl.linear_model(profiles, "dose + C(Image_Metadata_Plate)", group_key=group_key)
+    assert res["coef"].shape == (profiles.n_vars, 5)
+
+    obs = profiles.obs.iloc[1:]
+    design = np.column_stack([np.ones(len(obs)), obs["dose"], pd.get_dummies(obs["Image_Metadata_Plate"]).iloc[:, 1:]])
+    for f in range(3):
+        fit = OLS(profiles.X[1:, f].astype(np.float64), design.astype(np.float64))
+        if group_key is None:
+            fit = fit.fit()
+        else:
+            fit = fit.fit(cov_type="cluster", cov_kwds={"groups": pd.factorize(obs[group_key])[0]})
+        np.testing.assert_allclose(res["coef"].iloc[f], fit.params, rtol=1e-5, atol=1e-8)
+        np.testing.assert_allclose(res["se"].iloc[f], fit.bse, rtol=1e-5)
+        if group_key is None:
+            np.testing.assert_allclose(res["pvalue"].iloc[f], fit.pvalues, rtol=1e-5)
+
+
+def test_linear_model_missing_group(profiles):
+    profiles.obs["dose"] = np.random.default_rng(2).uniform(size=profiles.n_obs)
+    profiles.obs["cluster"] = profiles.obs["Image_Metadata_Plate"].astype(object)
+    profiles.obs.loc[profiles.obs_names[:2], "cluster"] = np.nan
+    res = sm.tl.linear_model(profiles, "dose", group_key="cluster")
+    expected = sm.tl.linear_model(profiles[2:].copy(), "dose", group_key="cluster")
+    for name in ["coef", "se", "pvalue"]:
+        pd.testing.assert_frame_equal(res[name], expected[name])
+
+
+def test_fit_dose_response():
+    from scipy.optimize import curve_fit
+
+    def hill(log_dose, bottom, top, log_ec50, slope):
+        return bottom + (top - bottom) / (1 + 10 ** ((log_ec50 - log_dose) * slope))
+
+    rng = np.random.default_rng(0)
+    n_compounds, n_vars = 6, 5
+    log_doses = np.repeat(np.arange(-3, 5) - 1.0, 2)
+    true = rng.uniform([-1, 2, -2, 0.5], [1, 4, 2, 1.5], size=(n_compounds, n_vars, 4))
+    X = np.concatenate([hill(log_doses[:, None], *true[c].T) for c in range(n_compounds)])
+    X += rng.normal(scale=0.05, size=X.shape)
+    obs = pd.DataFrame(
+        {
+            "compound": np.repeat([f"cpd{c}" for c in range(n_compounds)], len(log_doses)),
+            "dose": np.tile(10**log_doses, n_compounds),
+        }
+    )
+    obs.index = obs.index.astype(str)
+    # vehicle wells without dose are ignored
+    obs.loc["0", "dose"] = 0
+    res = sm.tl.fit_dose_response(AnnData(X, obs=obs), "compound", "dose")
+    assert res["converged"].to_numpy().all()
+    assert res["r2"].shape == (n_compounds, n_vars)
+
+    for c in range(n_compounds):
+        rows = (obs["compound"] == f"cpd{c}").to_numpy() & (obs["dose"] > 0).to_numpy()
+        for f in range(n_vars):
+            x, y = np.log10(obs["dose"].to_numpy()[rows]), X[rows, f]
+            expected, _ = curve_fit(hill, x, y, p0=[y[x == x.min()].mean(), y[x == x.max()].mean(), 0.5, 1])
+            fitted = [res[k].iloc[c, f] for k in ["bottom", "top", "ec50", "hill_slope"]]
+            fitted[2] = np.log10(fitted[2])
+            np.testing.assert_allclose(fitted, expected, rtol=1e-4, atol=1e-4)
+
+    # a response that overflows cannot be fit and is not reported as converged
+    X[:, 1] = 1e200 * np.sin(np.arange(len(X)))
+    with np.errstate(over="ignore"):
+        failed = sm.tl.fit_dose_response(AnnData(X, obs=obs), "compound", "dose")["converged"]
+    assert not failed.iloc[:, 1].any() and failed.iloc[:, 0].all()
+
+    # distances indexed by compound and dose
+    dists = pd.Series(X[:, 0], index=pd.MultiIndex.from_frame(obs), name="mahalanobis")
+    res_dists = sm.tl.fit_dose_response(dists, "compound", "dose")
+    np.testing.assert_allclose(res_dists["ec50"]["mahalanobis"], res["ec50"].iloc[:, 0])
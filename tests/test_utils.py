@@ -0,0 +1,266 @@
+import numpy as np
+import pandas as pd
+import pytest
+from anndata import AnnData, read_h5ad
+
+from scmorph.utils import (
+    CovarianceFactor,
+    GroupIndex,
+    QuantileSketch,
+    get_covariance_factor,
+    get_group_index,
+    get_grouped_op,
+    group_broadcast_inplace,
+    grouped_op,
+    set_cache,
+    streaming_covariance,
+)
+
+
+@pytest.fixture
+def adata():
+    rng = np.random.default_rng(0)
+    n_obs, n_vars = 3000, 5
+    obs = pd.DataFrame(
+        {
+            "Image_Metadata_Well": rng.choice(["A01", "A02", "B01", "B02"], n_obs),
+            "Image_Metadata_Plate": rng.choice(["P1", "P2", "P3"], n_obs),
+        },
+        index=[str(i) for i in range(n_obs)],
+    )
+    X = rng.normal(size=(n_obs, n_vars)) + np.arange(n_vars)
+    return AnnData(X=X.astype(np.float32), obs=obs)
+
+
+def test_quantile_sketch_merge():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(20000, 3))
+    left = QuantileSketch(3, k=200, seed=0).update(X[:7000])
+    right = QuantileSketch(3, k=200, seed=1)
+    for chunk in np.array_split(X[7000:], 5):
+        right.update(chunk)
+    merged = left.merge(right)
+
+    assert merged.n == X.shape[0]
+    np.testing.assert_allclose(merged.median(), np.median(X, axis=0), atol=0.05)
+    np.testing.assert_allclose(merged.quantile([0.1, 0.9]), np.quantile(X, [0.1, 0.9], axis=0), atol=0.08)
+    exact_mad = np.median(np.abs(X - np.median(X, axis=0)), axis=0)
+    np.testing.assert_allclose(merged.mad(), exact_mad, atol=0.05)
+
+
+def test_quantile_sketch_exact_when_small():
+    X = np.arange(10, dtype=float).reshape(-1, 1)
+    sketch = QuantileSketch(1, k=200).update(X)
+    assert sketch.median()[0] == np.median(X)
+
+
+def test_grouped_op_streamed_moments(adata):
+    keys = ["Image_Metadata_Well", "Image_Metadata_Plate"]
+    ops = ["mean", "var", "std", "sem"]
+    exact = grouped_op(adata, keys, ops, progress=False)
+    streamed = grouped_op(adata, keys, ops, progress=False, approximate=True, chunk_size=333)
+    for op in ops:
+        np.testing.assert_allclose(streamed[op].to_numpy(), exact[op].to_numpy(), rtol=1e-5)
+
+
+@pytest.mark.parametrize("operation", ["median", "mad", "mad_scaled"])
+def test_grouped_op_approximate(adata, operation):
+    keys = ["Image_Metadata_Well", "Image_Metadata_Plate"]
+    exact = grouped_op(adata, keys, operation, progress=False)
+    approx = grouped_op(adata, keys, operation, progress=False, approximate=True, chunk_size=500)
+    assert approx.shape == exact.shape
+    np.testing.assert_allclose(approx.to_numpy(), exact.to_numpy(), rtol=0.1, atol=0.1)
+
+
+def test_get_grouped_op_multiple(adata):
+    keys = ["Image_Metadata_Well", "Image_Metadata_Plate"]
+    ops = ["median", "mad", "mad_scaled", "mean"]
+    agg = get_grouped_op(adata, keys, ops, as_anndata=True, progress=False)
+    assert set(agg.layers.keys()) == set(ops)
+    np.testing.assert_array_equal(agg.X, agg.layers["median"])
+    for op in ops:
+        expected = grouped_op(adata, keys, op, progress=False).T.to_numpy()
+        np.testing.assert_allclose(agg.layers[op], expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("approximate", [False, True])
+def test_grouped_op_quantile_with_other_ops(adata, approximate):
+    import scmorph as sm
+
+    keys = ["Image_Metadata_Well"]
+    ops = ["median", "quantile", "mad"]
+    res = grouped_op(adata, keys, ops, progress=False, approximate=approximate, q=0.25)
+    for op in ops:
+        expected = grouped_op(
+            adata, keys, op, progress=False, approximate=approximate, **({"q": 0.25} if op == "quantile" else {})
+        )
+        pd.testing.assert_frame_equal(res[op], expected)
+
+    agg = sm.pp.aggregate(
+        adata, "Image_Metadata_Well", method=["median", "quantile"], q=0.25, approximate=approximate, progress=False
+    )
+    np.testing.assert_allclose(agg.layers["quantile"], res["quantile"].T.to_numpy(), rtol=1e-5)
+
+
+@pytest.mark.parametrize("approximate", [False, True])
+def test_grouped_op_quantile_sequence(adata, approximate):
+    import scmorph as sm
+
+    keys = ["Image_Metadata_Well"]
+    kwargs = {"progress": False, "approximate": approximate}
+    res = grouped_op(adata, keys, ["quantile", "mean"], q=[0.1, 0.9], **kwargs)
+    assert list(res) == ["quantile_0.1", "quantile_0.9", "mean"]
+    for q in [0.1, 0.9]:
+        pd.testing.assert_frame_equal(res[f"quantile_{q}"], grouped_op(adata, keys, "quantile", q=q, **kwargs))
+    assert list(get_grouped_op(adata, keys, "quantile", q=[0.1, 0.9], store=False, **kwargs)) == list(res)[:2]
+
+    for skipna in [False, True]:
+        agg = sm.pp.aggregate(adata, "Image_Metadata_Well", method="quantile", q=[0.1, 0.9], skipna=skipna, **kwargs)
+        assert {"quantile_0.1", "quantile_0.9"} <= set(agg.layers)
+        np.testing.assert_allclose(agg.X, res["quantile_0.1"].T.to_numpy(), rtol=1e-5)
+
+
+def test_grouped_op_cache_invalidation(adata, tmp_path):
+    cache = set_cache(max_entries=2, directory=tmp_path)
+    keys = ["Image_Metadata_Well"]
+    first = get_grouped_op(adata, keys, "mean", progress=False)
+    assert get_grouped_op(adata, keys, "mean", progress=False) is first
+
+    adata.X = adata.X + 1
+    shifted = get_grouped_op(adata, keys, "mean", progress=False)
+    np.testing.assert_allclose(shifted.to_numpy(), first.to_numpy() + 1, rtol=1e-5)
+
+    # editing a single cell invalidates the result
+    adata.X[1, 0] += 300
+    edited = get_grouped_op(adata, keys, "mean", progress=False)
+    assert edited is not shifted and (edited.iloc[0] != shifted.iloc[0]).sum() == 1
+    adata.X[1, 0] -= 300
+
+    # results are read back from disk after clearing memory
+    cache.clear()
+    from_disk = get_grouped_op(adata, keys, "mean", progress=False)
+    pd.testing.assert_frame_equal(from_disk, shifted, check_names=False, check_column_type=False)
+
+    # least recently used entries are evicted
+    get_grouped_op(adata, keys, "median", progress=False)
+    get_grouped_op(adata, keys, "std", progress=False)
+    assert len(cache) == 2 and len(list(tmp_path.glob("*.parquet"))) == 2
+    set_cache()
+
+
+def test_grouped_op_cache_group_index(adata):
+    index = get_group_index(adata, "Image_Metadata_Well")
+    full = get_grouped_op(adata, index, "mean", progress=False)
+    subset = GroupIndex(np.where(index.codes == 0, 0, -1), index.keys[:1], index.group_key)
+    res = get_grouped_op(adata, subset, "mean", progress=False)
+    assert list(res.columns) == index.keys[:1]
+    np.testing.assert_allclose(res.iloc[:, 0], adata.X[index.codes == 0].mean(axis=0), rtol=1e-5)
+    assert get_grouped_op(adata, index, "mean", progress=False) is full
+
+
+def test_group_index_matches_groupby(adata):
+    adata.obs["Image_Metadata_Plate"] = adata.obs["Image_Metadata_Plate"].astype("category")
+    adata.obs.loc[adata.obs.index[:10], "Image_Metadata_Well"] = np.nan
+    keys = ["Image_Metadata_Plate", "Image_Metadata_Well"]
+    index = GroupIndex.from_obs(adata.obs, keys)
+    expected = adata.obs.groupby(keys, observed=True).indices
+
+    assert index.keys == list(expected.keys())
+    assert (index.codes[:10] == -1).all()
+    for key, idx in index.items():
+        np.testing.assert_array_equal(idx, expected[key])
+
+
+def test_group_index_cached(adata):
+    index = get_group_index(adata, "Image_Metadata_Well")
+    assert get_group_index(adata, "Image_Metadata_Well") is index
+    assert get_group_index(adata, index) is index
+
+    adata.obs["Image_Metadata_Well"] = "A01"
+    assert len(get_group_index(adata, "Image_Metadata_Well")) == 1
+
+    subset = index.subset(index.codes < 2)
+    assert subset.keys == index.keys[:2]
+
+
+def test_group_index_cache_single_edit():
+    adata = AnnData(np.zeros((10000, 1)), obs=pd.DataFrame({"g": ["a", "b"] * 5000}, index=map(str, range(10000))))
+    assert list(get_group_index(adata, "g").sizes) == [5000, 5000]
+    adata.obs.loc["1", "g"] = "a"
+    assert list(get_group_index(adata, "g").sizes) == [5001, 4999]
+
+
+def test_group_broadcast_inplace(adata, tmp_path):
+    means = grouped_op(adata, "Image_Metadata_Plate", "mean", progress=False)
+    expected = adata.X - means[adata.obs["Image_Metadata_Plate"]].to_numpy().T
+
+    backed_file = tmp_path / "backed.h5ad"
+    adata.write_h5ad(backed_file)
+
+    group_broadcast_inplace(adata, "Image_Metadata_Plate", means, chunk_size=700)
+    np.testing.assert_allclose(adata.X, expected, rtol=1e-5, atol=1e-5)
+
+    backed = read_h5ad(backed_file, backed="r+")
+    group_broadcast_inplace(backed, "Image_Metadata_Plate", means, chunk_size=700)
+    backed.file.close()
+    np.testing.assert_allclose(read_h5ad(backed_file).X, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("approximate", [False, True])
+def test_grouped_op_skipna(adata, approximate):
+    X = adata.X.copy()
+    X[np.random.default_rng(2).random(X.shape) < 0.1] = np.nan
+    X[adata.obs["Image_Metadata_Well"] == "A01", 0] = np.nan
+    adata.X = X
+    ops = ["mean", "std", "median", "count"]
+    res = grouped_op(adata, "Image_Metadata_Well", ops, progress=False, approximate=approximate, skipna=True)
+
+    df = pd.DataFrame(X).groupby(adata.obs["Image_Metadata_Well"].to_numpy())
+    expected = {"mean": df.mean(), "std": df.std(ddof=0), "median": df.median(), "count": df.count()}
+    for op in ops:
+        tol = 0.1 if approximate and op == "median" else 1e-5
+        np.testing.assert_allclose(res[op].T.to_numpy(), expected[op].to_numpy(), rtol=tol, atol=tol)
+
+    # without skipna, missing values propagate
+    assert grouped_op(adata, "Image_Metadata_Well", "mean", progress=False).isna().all().all()
+
+
+def test_covariance_factor_mahalanobis():
+    from scipy.spatial.distance import mahalanobis
+
+    rng = np.random.default_rng(3)
+    control = rng.normal(size=(200, 4)) @ rng.normal(size=(4, 4))
+    drugs = rng.normal(size=(10, 4))
+    cov, center = np.cov(control, rowvar=False), control.mean(axis=0)
+
+    factor = get_covariance_factor(cov)
+    assert factor.method == "cholesky" and get_covariance_factor(cov.copy()) is factor
+    expected = [mahalanobis(x, center, np.linalg.inv(cov)) for x in drugs]
+    np.testing.assert_allclose(factor.mahalanobis(drugs, center), expected)
+
+    # singular covariances fall back to shrinkage or the pseudo-inverse
+    singular = np.cov(control[:, [0, 0, 1, 2]], rowvar=False)
+    assert CovarianceFactor(singular).method == "shrinkage"
+    assert CovarianceFactor(singular, fallback="pinv").method == "pinv"
+    assert np.isfinite(CovarianceFactor(singular).mahalanobis(drugs, center)).all()
+    with pytest.raises(np.linalg.LinAlgError):
+        CovarianceFactor(singular, fallback="raise")
+
+
+@pytest.mark.parametrize("shrinkage", [None, "ledoit_wolf", "oas"])
+def test_streaming_covariance(adata, tmp_path, shrinkage):
+    from sklearn.covariance import ledoit_wolf, oas
+
+    mask = (adata.obs["Image_Metadata_Plate"] != "P1").to_numpy()
+    X = adata.X[mask].astype(np.float64)
+    expected = {
+        None: lambda x: np.cov(x, rowvar=False),
+        "ledoit_wolf": lambda x: ledoit_wolf(x)[0],
+        "oas": lambda x: oas(x)[0],
+    }
+
+    adata.write_h5ad(tmp_path / "backed.h5ad")
+    backed = read_h5ad(tmp_path / "backed.h5ad", backed="r")
+    cov, mean = streaming_covariance(backed, mask=mask, shrinkage=shrinkage, chunk_size=333)
+    np.testing.assert_allclose(cov, expected[shrinkage](X), rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(mean, X.mean(axis=0), rtol=1e-6)